@@ -1,15 +1,59 @@
+import asyncio
+import json
 import os
+import re
+import time
+from contextlib import aclosing, asynccontextmanager
+from pathlib import Path
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
 from typing import Optional, Any
-from server import WeatherFilesServer
+from metrics import CONTENT_TYPE
+from server import TOOLS, WeatherFilesServer
+from tools import ToolArgumentError, UnknownToolError
 from dotenv import load_dotenv
 
 load_dotenv()
 
-app = FastAPI(title="MCP Weather & Files AI Dashboard API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Abre o cliente HTTP compartilhado na subida e libera os recursos na parada."""
+    await mcp_server.start()
+    yield
+    await mcp_server.cleanup()
+
+app = FastAPI(title="MCP Weather & Files AI Dashboard API", lifespan=lifespan)
+
+class MetricsMiddleware:
+    """Mede a duração de cada requisição por método, rota e status.
+    
+    Middleware ASGI puro: não bufferiza o corpo, então os endpoints SSE são
+    medidos até o fim do stream.
+    """
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        started = time.perf_counter()
+        status = 500
+        
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+        
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # O router grava a rota no scope; o caminho do template evita uma série por URL
+            route = getattr(scope.get("route"), "path", "") or "static"
+            http_latency.observe(time.perf_counter() - started, scope["method"], route, status)
 
 # Configuração de CORS para permitir acesso do frontend
 app.add_middleware(
@@ -22,68 +66,263 @@ app.add_middleware(
 
 # Inicializar o servidor MCP (reutilizando a lógica)
 mcp_server = WeatherFilesServer()
+http_latency = mcp_server.metrics.histogram(
+    "http_request_duration_seconds", "Duração das requisições à API do dashboard", ("method", "route", "status")
+)
+app.add_middleware(MetricsMiddleware)
+
+# Limite de passos por chamada de /api/execute_batch
+BATCH_MAX_STEPS = int(os.getenv("BATCH_MAX_STEPS", "20"))
 
 class ToolRequest(BaseModel):
     tool_name: str
     arguments: dict
 
+# Lista do dashboard serializada uma única vez a partir do registro de ferramentas
+TOOLS_PAYLOAD = json.dumps(TOOLS.dashboard, ensure_ascii=False).encode("utf-8")
+
 @app.get("/api/tools")
 async def list_tools():
     """Lista as ferramentas disponíveis no servidor."""
-    # Como não temos um objeto direto fácil sem rodar o server.run(), 
-    # vamos retornar uma lista estática baseada na definição do server.py
-    return [
-        {
-            "name": "get_weather",
-            "description": "Dados meteorológicos em tempo real",
-            "params": ["city", "country_code"]
-        },
-        {
-            "name": "read_file",
-            "description": "Leitura segura de arquivos locais",
-            "params": ["file_path"]
-        },
-        {
-            "name": "list_directory",
-            "description": "Navegação em diretórios locais",
-            "params": ["directory_path"]
-        },
-        {
-            "name": "get_location_facts",
-            "description": "Informações geográficas de países",
-            "params": ["country"]
-        },
-        {
-            "name": "analyze_with_ai",
-            "description": "Análise inteligente com provedores de IA",
-            "params": ["prompt", "context"]
-        }
-    ]
+    return Response(content=TOOLS_PAYLOAD, media_type="application/json")
+
+@app.get("/metrics")
+async def metrics():
+    """Métricas do servidor no formato texto do Prometheus."""
+    return Response(content=mcp_server.metrics.render(), media_type=CONTENT_TYPE)
+
+@app.get("/api/cities/autocomplete")
+async def autocomplete_cities(q: str, limit: int = 10, country: str = ""):
+    """Sugestões de cidades (com ID e coordenadas) pelo início do nome."""
+    cities = await mcp_server.autocomplete_cities(q, limit, country)
+    if cities is None:
+        raise HTTPException(
+            status_code=503,
+            detail="Lista de cidades não encontrada. Execute: python cities.py --refresh"
+        )
+    return [{**city._asdict(), "label": city.label} for city in cities]
+
+@app.get("/api/cache/stats")
+async def cache_stats():
+    """Contadores de hit/miss/despejo dos caches do servidor."""
+    return mcp_server.cache_stats()
+
+@app.get("/api/ai/stats")
+async def ai_stats():
+    """Latências observadas dos provedores de IA e uso do hedging."""
+    return mcp_server.ai_stats()
+
+@app.get("/api/circuits")
+async def circuit_stats():
+    """Estado dos disjuntores de cada serviço externo."""
+    return mcp_server.circuit_stats()
+
+@app.get("/api/quotas")
+async def quota_stats():
+    """Fichas disponíveis, fila e descartes da cota de cada serviço externo."""
+    return mcp_server.quota_stats()
+
+async def run_tool(name: str, args: dict) -> str:
+    """Executa uma ferramenta pelo nome e retorna o texto da resposta."""
+    try:
+        return await mcp_server.execute_tool(name, args)
+    except UnknownToolError:
+        raise HTTPException(status_code=404, detail="Ferramenta não encontrada")
+    except ToolArgumentError as e:
+        raise HTTPException(status_code=422, detail=str(e))
 
 @app.post("/api/execute")
 async def execute_tool(request: ToolRequest):
     """Executa uma ferramenta MCP via HTTP."""
     try:
-        name = request.tool_name
-        args = request.arguments
-        
-        if name == "get_weather":
-            result = await mcp_server._get_weather(args.get("city"), args.get("country_code", ""))
-        elif name == "read_file":
-            result = await mcp_server._read_file(args.get("file_path"))
-        elif name == "list_directory":
-            result = await mcp_server._list_directory(args.get("directory_path"))
-        elif name == "get_location_facts":
-            result = await mcp_server._get_location_facts(args.get("country"))
-        elif name == "analyze_with_ai":
-            result = await mcp_server._analyze_with_ai(args.get("prompt"), args.get("context", ""))
-        else:
-            raise HTTPException(status_code=404, detail="Ferramenta não encontrada")
-            
+        result = await run_tool(request.tool_name, request.arguments)
         return {"status": "success", "result": result}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+class BatchStep(BaseModel):
+    id: Optional[str] = None
+    tool_name: str
+    arguments: dict = {}
+    depends_on: list[str] = []
+    context_from: list[str] = []  # passos cuja saída vira o `context` deste
+
+class BatchRequest(BaseModel):
+    steps: list[BatchStep]
+
+def plan_batch(steps: list[BatchStep]) -> list[BatchStep]:
+    """Valida ids e dependências e devolve os passos em ordem topológica."""
+    if not steps:
+        raise HTTPException(status_code=400, detail="Informe ao menos um passo")
+    if len(steps) > BATCH_MAX_STEPS:
+        raise HTTPException(status_code=400, detail=f"Lote muito grande: máximo de {BATCH_MAX_STEPS} passos")
+    
+    by_id: dict[str, BatchStep] = {}
+    for i, step in enumerate(steps):
+        step.id = step.id or f"step{i + 1}"
+        if step.id in by_id:
+            raise HTTPException(status_code=400, detail=f"Passo duplicado: '{step.id}'")
+        by_id[step.id] = step
+    
+    for step in steps:
+        if step.context_from and step.tool_name in TOOLS:
+            if "context" not in TOOLS.get(step.tool_name).input_schema.get("properties", {}):
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Passo '{step.id}': {step.tool_name} não recebe 'context', use depends_on em vez de context_from",
+                )
+    
+    deps = {step.id: set(step.depends_on) | set(step.context_from) for step in steps}
+    for step_id, needed in deps.items():
+        unknown = needed - by_id.keys()
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Passo '{step_id}' depende de passos inexistentes: {sorted(unknown)}")
+    
+    # Kahn: sobra algum passo se houver ciclo
+    ordered: list[BatchStep] = []
+    ready = [step_id for step_id, needed in deps.items() if not needed]
+    remaining = {step_id: set(needed) for step_id, needed in deps.items() if needed}
+    while ready:
+        current = ready.pop()
+        ordered.append(by_id[current])
+        for step_id in list(remaining):
+            remaining[step_id].discard(current)
+            if not remaining[step_id]:
+                del remaining[step_id]
+                ready.append(step_id)
+    if remaining:
+        raise HTTPException(status_code=400, detail=f"Dependência circular entre os passos: {sorted(remaining)}")
+    return ordered
+
+@app.post("/api/execute_batch")
+async def execute_batch(request: BatchRequest):
+    """Executa vários passos em uma chamada.
+    
+    Passos independentes rodam em paralelo; um passo só começa quando os de
+    `depends_on` e `context_from` terminam, e a saída dos de `context_from` é
+    anexada ao seu argumento `context`. Se uma dependência falhar, o passo é
+    pulado. Cada passo retorna resultado, início e duração em milissegundos.
+    """
+    ordered = plan_batch(request.steps)
+    started = time.perf_counter()
+    tasks: dict[str, asyncio.Task] = {}
+    
+    def elapsed_ms() -> float:
+        return round((time.perf_counter() - started) * 1000, 1)
+    
+    async def run_step(step: BatchStep) -> dict:
+        report = {"id": step.id, "tool_name": step.tool_name}
+        needed = list(dict.fromkeys(step.depends_on + step.context_from))
+        outcomes = dict(zip(needed, await asyncio.gather(*(tasks[d] for d in needed))))
+        
+        failed = [d for d, outcome in outcomes.items() if outcome["status"] != "success"]
+        if failed:
+            return {**report, "status": "skipped", "error": f"Dependências não concluídas: {failed}"}
+        
+        args = dict(step.arguments)
+        if step.context_from:
+            parts = [args.get("context", "")] + [outcomes[d]["result"] for d in step.context_from]
+            args["context"] = "\n\n".join(p for p in parts if p)
+        
+        report["started_ms"] = elapsed_ms()
+        try:
+            result = await run_tool(step.tool_name, args)
+            report.update(status="success", result=result)
+        except Exception as e:
+            detail = e.detail if isinstance(e, HTTPException) else str(e)
+            report.update(status="error", error=detail)
+        report["duration_ms"] = round(elapsed_ms() - report["started_ms"], 1)
+        return report
+    
+    # As tarefas herdam o span do lote: os passos aparecem no mesmo trace
+    with mcp_server.tracer.span("batch", steps=len(ordered)):
+        for step in ordered:
+            tasks[step.id] = asyncio.create_task(run_step(step))
+        await asyncio.gather(*tasks.values())
+    
+    return {
+        "status": "success",
+        "total_ms": elapsed_ms(),
+        "steps": [tasks[step.id].result() for step in request.steps],
+    }
+
+@app.get("/api/files/follow")
+async def follow_file(file_path: str, lines: int = 10, interval: float = 0.5, encoding: str = "utf-8"):
+    """Acompanha um arquivo de log (como `tail -f`) via Server-Sent Events."""
+    path, error = await mcp_server._run_file_op(mcp_server._resolve_file, file_path)
+    if error:
+        raise HTTPException(status_code=404, detail=error.strip())
+    
+    async def events():
+        async for line in mcp_server._follow_file(str(path), lines, max(interval, 0.1), encoding):
+            yield f"data: {line}\n\n"
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/api/search/stream")
+async def search_stream(
+    directory_path: str,
+    pattern: str,
+    regex: bool = False,
+    case_sensitive: bool = False,
+    glob: Optional[str] = None,
+    max_results: int = 100
+):
+    """Busca no conteúdo dos arquivos enviando cada arquivo encontrado via SSE."""
+    root = await mcp_server._run_file_op(Path(directory_path).resolve)
+    if not await mcp_server._run_file_op(root.is_dir):
+        raise HTTPException(status_code=404, detail=f"Diretório não encontrado: {directory_path}")
+    try:
+        compiled = mcp_server._compile_search(pattern, regex, case_sensitive)
+    except re.error as e:
+        raise HTTPException(status_code=400, detail=f"Padrão de busca inválido: {str(e)}")
+    
+    async def events():
+        progress: dict = {}
+        lines_sent = 0
+        async with aclosing(mcp_server._iter_search(root, compiled, glob, progress=progress)) as results:
+            async for matches in results:
+                payload = {
+                    "path": os.path.relpath(matches.path, root),
+                    "count": matches.count,
+                    "lines": matches.lines
+                }
+                yield f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+                lines_sent += len(matches.lines)
+                if lines_sent >= max_results:
+                    break
+        yield f"event: done\ndata: {json.dumps({'files': progress.get('files', 0)})}\n\n"
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+class AnalyzeRequest(BaseModel):
+    prompt: str
+    context: str = ""
+    use_cache: bool = True
+
+@app.post("/api/analyze/stream")
+async def analyze_stream(request: AnalyzeRequest):
+    """Executa analyze_with_ai enviando os trechos da resposta via SSE."""
+    async def events():
+        async for event in mcp_server._stream_analysis(request.prompt, request.context, request.use_cache):
+            yield f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 # Servir arquivos estáticos do dashboard (será criado a seguir)
 if os.path.exists("static"):
     app.mount("/", StaticFiles(directory="static", html=True), name="static")
@@ -0,0 +1 @@
+"""Benchmark do servidor com stand-ins locais das APIs externas (python -m bench.run)."""
@@ -0,0 +1,227 @@
+"""
+Gerador de carga em malha fechada para a API HTTP (api.py) e o servidor MCP stdio.
+
+``concurrency`` tarefas repetem chamadas sorteadas do mix de operações até o
+fim da duração; cada uma só envia a próxima chamada quando a anterior
+termina. As chamadas feitas no aquecimento não entram nas estatísticas.
+"""
+
+import asyncio
+import os
+import random
+import sys
+import time
+from contextlib import AsyncExitStack
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Optional
+
+import httpx
+
+CITIES = [
+    "São Paulo", "Rio de Janeiro", "Recife", "Salvador", "Curitiba", "Porto Alegre",
+    "Manaus", "Belém", "Fortaleza", "Natal", "Tokyo", "Paris", "Lisboa", "Madrid",
+    "New York", "Buenos Aires", "Santiago", "Lima", "Bogotá", "Cidade do México",
+]
+COUNTRIES = ["Brasil", "Chile", "Japan", "France", "Portugal", "Argentina", "Peru", "Mexico"]
+
+# Operações disponíveis: nome da ferramenta -> argumentos sorteados
+OPERATIONS: dict[str, Callable[[random.Random], dict]] = {
+    "get_weather": lambda rng: {"city": rng.choice(CITIES)},
+    "get_weather_batch": lambda rng: {"cities": rng.sample(CITIES, 5)},
+    "get_forecast": lambda rng: {"city": rng.choice(CITIES), "period": rng.choice(["today", "tomorrow", "week"])},
+    "get_location_facts": lambda rng: {"country": rng.choice(COUNTRIES)},
+    "analyze_with_ai": lambda rng: {
+        "prompt": f"Vale a pena viajar para {rng.choice(CITIES)} nesta semana?",
+        "use_cache": False,
+    },
+}
+
+DEFAULT_MIX = "get_weather=6,get_forecast=2,get_location_facts=2,analyze_with_ai=1"
+
+
+def parse_mix(spec: str) -> dict[str, float]:
+    """Lê um mix no formato 'get_weather=6,analyze_with_ai=1'."""
+    mix = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, weight = item.partition("=")
+        if name not in OPERATIONS:
+            raise ValueError(f"Operação desconhecida: '{name}' (use {', '.join(OPERATIONS)})")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def percentile(sorted_values: list[float], q: float) -> Optional[float]:
+    """Percentil por interpolação linear (valores já ordenados)."""
+    if not sorted_values:
+        return None
+    pos = (len(sorted_values) - 1) * q
+    low = int(pos)
+    high = min(low + 1, len(sorted_values) - 1)
+    return sorted_values[low] + (sorted_values[high] - sorted_values[low]) * (pos - low)
+
+
+def _ms(seconds: Optional[float]) -> Optional[float]:
+    return None if seconds is None else round(seconds * 1000, 3)
+
+
+def is_error_text(text: str) -> bool:
+    """Mensagens de erro das ferramentas começam com espaço ou com 'Erro'."""
+    return not text or text.startswith(" ") or text.startswith("Erro")
+
+
+@dataclass
+class Samples:
+    """Latências (s) e erros de uma operação."""
+
+    latencies: list[float] = field(default_factory=list)
+    errors: int = 0
+    error_kinds: dict[str, int] = field(default_factory=dict)
+
+    def record_error(self, kind: str):
+        self.errors += 1
+        self.error_kinds[kind] = self.error_kinds.get(kind, 0) + 1
+
+    def summary(self, duration: float) -> dict:
+        values = sorted(self.latencies)
+        return {
+            "requests": len(values),
+            "errors": self.errors,
+            "error_kinds": self.error_kinds,
+            "throughput_rps": round(len(values) / duration, 2) if duration else 0.0,
+            "mean_ms": _ms(sum(values) / len(values)) if values else None,
+            "p50_ms": _ms(percentile(values, 0.50)),
+            "p95_ms": _ms(percentile(values, 0.95)),
+            "p99_ms": _ms(percentile(values, 0.99)),
+            "max_ms": _ms(values[-1]) if values else None,
+        }
+
+
+class ApiDriver:
+    """Chama as ferramentas por POST /api/execute."""
+
+    name = "api"
+
+    def __init__(self, base_url: str, concurrency: int):
+        limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+        self.client = httpx.AsyncClient(base_url=base_url, timeout=60.0, limits=limits)
+
+    async def call(self, tool: str, arguments: dict) -> Optional[str]:
+        """Retorna None em caso de sucesso ou o tipo de erro."""
+        response = await self.client.post("/api/execute", json={"tool_name": tool, "arguments": arguments})
+        if response.status_code != 200:
+            return f"http_{response.status_code}"
+        return "tool_error" if is_error_text(response.json()["result"]) else None
+
+    async def close(self):
+        await self.client.aclose()
+
+
+class McpDriver:
+    """Chama as ferramentas por uma sessão MCP stdio (um subprocesso server.py)."""
+
+    name = "mcp"
+
+    def __init__(self, env: dict, cwd: Path, errlog):
+        self.env = env
+        self.cwd = cwd
+        self.errlog = errlog
+        self.session = None
+        self._stack = AsyncExitStack()
+
+    async def start(self):
+        from mcp import ClientSession, StdioServerParameters
+        from mcp.client.stdio import stdio_client
+
+        params = StdioServerParameters(
+            command=sys.executable, args=[str(self.cwd / "server.py")], env=self.env, cwd=str(self.cwd)
+        )
+        read, write = await self._stack.enter_async_context(stdio_client(params, errlog=self.errlog))
+        self.session = await self._stack.enter_async_context(ClientSession(read, write))
+        await self.session.initialize()
+
+    async def call(self, tool: str, arguments: dict) -> Optional[str]:
+        result = await self.session.call_tool(tool, arguments)
+        text = result.content[0].text if result.content else ""
+        if result.isError:
+            return "mcp_error"
+        return "tool_error" if is_error_text(text) else None
+
+    async def close(self):
+        await self._stack.aclose()
+
+
+async def run_load(
+    driver,
+    mix: dict[str, float],
+    concurrency: int,
+    duration: float,
+    warmup: float = 0.0,
+    seed: int = 1,
+) -> dict:
+    """Executa a carga e retorna o resumo por operação e o total."""
+    names, weights = list(mix), list(mix.values())
+    samples = {name: Samples() for name in names}
+    total = Samples()
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    measure_from = started + warmup
+    deadline = measure_from + duration
+
+    async def worker(worker_id: int):
+        rng = random.Random(seed * 1000 + worker_id)
+        while loop.time() < deadline:
+            name = rng.choices(names, weights)[0]
+            begin = time.perf_counter()
+            try:
+                error = await driver.call(name, OPERATIONS[name](rng))
+            except Exception as e:
+                error = type(e).__name__
+            elapsed = time.perf_counter() - begin
+            if loop.time() - elapsed < measure_from:
+                continue
+            for bucket in (samples[name], total):
+                bucket.latencies.append(elapsed)
+                if error:
+                    bucket.record_error(error)
+
+    await asyncio.gather(*(worker(i) for i in range(concurrency)))
+    measured = loop.time() - measure_from
+    return {
+        "concurrency": concurrency,
+        "duration_s": round(measured, 3),
+        "total": total.summary(measured),
+        "operations": {name: s.summary(measured) for name, s in samples.items() if s.latencies},
+    }
+
+
+def process_memory(pid: int) -> dict:
+    """RSS atual e pico (KiB) de um processo, lidos de /proc (só Linux)."""
+    result = {}
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key in ("VmRSS", "VmHWM"):
+                    result["rss_kib" if key == "VmRSS" else "peak_rss_kib"] = int(value.split()[0])
+    except OSError:
+        pass
+    return result
+
+
+def child_pids(parent: int, marker: str) -> list[int]:
+    """Processos filhos de ``parent`` cuja linha de comando contém ``marker``."""
+    pids = []
+    for entry in os.listdir("/proc") if os.path.isdir("/proc") else []:
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+            with open(f"/proc/{entry}/cmdline", "rb") as f:
+                cmdline = f.read().replace(b"\0", b" ").decode(errors="replace")
+        except (OSError, IndexError, ValueError):
+            continue
+        if ppid == parent and marker in cmdline:
+            pids.append(int(entry))
+    return pids
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""
+Benchmark do MCP Weather & Files Server contra stand-ins locais das APIs.
+
+Sobe os stand-ins (bench/standins.py) e a API (api.py via uvicorn) em
+subprocessos, abre uma sessão MCP stdio com server.py e aplica a mesma carga
+aos dois. Grava um JSON com vazão, latências (p50/p95/p99) por operação e a
+memória de cada servidor; ``--compare`` confronta o resultado com outro JSON.
+
+    python -m bench.run --duration 20 --concurrency 16
+    python -m bench.run --owm latency=200,rate429=0.05 --compare bench/results/base.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Optional
+
+import httpx
+
+from bench.loadgen import (
+    DEFAULT_MIX,
+    ApiDriver,
+    McpDriver,
+    child_pids,
+    parse_mix,
+    process_memory,
+    run_load,
+)
+from bench.standins import add_profile_args, upstream_env
+
+ROOT = Path(__file__).resolve().parent.parent
+RESULTS_DIR = ROOT / "bench" / "results"
+
+# Métricas comparadas: (chave, maior é melhor)
+COMPARED = (("throughput_rps", True), ("p50_ms", False), ("p95_ms", False), ("p99_ms", False))
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def wait_ready(url: str, timeout: float = 30.0, process: Optional[subprocess.Popen] = None):
+    """Espera o endpoint responder (ou o processo morrer)."""
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            if process is not None and process.poll() is not None:
+                raise RuntimeError(f"Processo terminou antes de responder em {url}")
+            try:
+                if (await client.get(url, timeout=1.0)).status_code < 500:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.2)
+    raise TimeoutError(f"{url} não respondeu em {timeout:.0f}s")
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def server_env(standin_url: str, args: argparse.Namespace, tmp_dir: Path) -> dict:
+    """Ambiente dos servidores: APIs apontadas para os stand-ins e sem estado em disco."""
+    env = {
+        **os.environ,
+        **upstream_env(standin_url),
+        "WEATHER_QUOTA_PER_MINUTE": str(args.quota),
+        "AI_CACHE_ENABLED": "true" if args.ai_cache else "false",
+        "AI_CACHE_PATH": str(tmp_dir / "ai_cache.sqlite3"),
+        "COUNTRY_SNAPSHOT_PATH": str(tmp_dir / "countries.json"),
+        "CITY_LIST_PATH": str(tmp_dir / "city.list.json.gz"),
+        "TRACE_ENABLED": "false",
+        "PYTHONUNBUFFERED": "1",
+    }
+    env.update(dict(item.split("=", 1) for item in args.env))
+    return env
+
+
+async def bench_api(env: dict, args, mix, log) -> dict:
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "api:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning"],
+        cwd=ROOT, env=env, stdout=log, stderr=log,
+    )
+    driver = ApiDriver(f"http://127.0.0.1:{port}", args.concurrency)
+    try:
+        await wait_ready(f"http://127.0.0.1:{port}/api/tools", process=process)
+        idle = process_memory(process.pid)
+        result = await run_load(driver, mix, args.concurrency, args.duration, args.warmup, args.seed)
+        result["memory"] = {"idle_rss_kib": idle.get("rss_kib"), **process_memory(process.pid)}
+        return result
+    finally:
+        await driver.close()
+        process.terminate()
+        process.wait(timeout=10)
+
+
+async def bench_mcp(env: dict, args, mix, log) -> dict:
+    driver = McpDriver(env, ROOT, log)
+    try:
+        await driver.start()
+        pids = child_pids(os.getpid(), "server.py")
+        idle = process_memory(pids[0]) if pids else {}
+        result = await run_load(driver, mix, args.concurrency, args.duration, args.warmup, args.seed)
+        result["memory"] = {"idle_rss_kib": idle.get("rss_kib"), **(process_memory(pids[0]) if pids else {})}
+        return result
+    finally:
+        await driver.close()
+
+
+async def run(args: argparse.Namespace) -> dict:
+    mix = parse_mix(args.mix)
+    tmp_dir = Path(tempfile.mkdtemp(prefix="mcp-bench-"))
+    log_path = tmp_dir / "servers.log"
+    standin_port = free_port()
+    standin_url = f"http://127.0.0.1:{standin_port}"
+
+    profile_args = [f"--{name}={getattr(args, name)}" for name in ("owm", "restcountries", "openai", "anthropic")
+                    if getattr(args, name)]
+    with open(log_path, "w") as log:
+        standins = subprocess.Popen(
+            [sys.executable, "-m", "bench.standins", "--port", str(standin_port), "--seed", str(args.seed),
+             *profile_args],
+            cwd=ROOT, stdout=log, stderr=log,
+        )
+        try:
+            await wait_ready(f"{standin_url}/stats", process=standins)
+            env = server_env(standin_url, args, tmp_dir)
+            targets = {}
+            for target in args.targets.split(","):
+                print(f"Carga em {target}: {args.concurrency} clientes por {args.duration:g}s...", flush=True)
+                bench = bench_api if target == "api" else bench_mcp
+                targets[target] = await bench(env, args, mix, log)
+            async with httpx.AsyncClient() as client:
+                upstreams = (await client.get(f"{standin_url}/stats")).json()
+        finally:
+            standins.terminate()
+            standins.wait(timeout=10)
+
+    return {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "mix": mix,
+            "concurrency": args.concurrency,
+            "duration_s": args.duration,
+            "warmup_s": args.warmup,
+            "server_log": str(log_path),
+        },
+        "targets": targets,
+        "upstreams": upstreams,
+    }
+
+
+def print_report(results: dict):
+    for target, data in results["targets"].items():
+        memory = data.get("memory", {})
+        print(f"\n[{target}] {data['total']['throughput_rps']} req/s, "
+              f"RSS {memory.get('rss_kib', 0) / 1024:.1f} MiB (pico {memory.get('peak_rss_kib', 0) / 1024:.1f} MiB)")
+        print(f"  {'operação':<20}{'req':>7}{'erros':>7}{'req/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+        for name, s in {**data["operations"], "total": data["total"]}.items():
+            print(f"  {name:<20}{s['requests']:>7}{s['errors']:>7}{s['throughput_rps']:>9}"
+                  f"{s['p50_ms'] or 0:>10.1f}{s['p95_ms'] or 0:>10.1f}{s['p99_ms'] or 0:>10.1f}")
+
+
+def compare(current: dict, baseline: dict, threshold: float) -> list[str]:
+    """Imprime as diferenças e retorna as regressões acima de ``threshold`` (fração)."""
+    regressions = []
+    print(f"\nComparação com {baseline['meta'].get('commit')} ({baseline['meta'].get('timestamp')}):")
+    for target, data in current["targets"].items():
+        base_target = baseline.get("targets", {}).get(target)
+        if not base_target:
+            continue
+        rows = {**data["operations"], "total": data["total"]}
+        base_rows = {**base_target["operations"], "total": base_target["total"]}
+        for name, row in rows.items():
+            base = base_rows.get(name)
+            if not base:
+                continue
+            for key, higher_is_better in COMPARED:
+                new, old = row.get(key), base.get(key)
+                if not new or not old:
+                    continue
+                change = (new - old) / old
+                worse = -change if higher_is_better else change
+                flag = " <- regressão" if worse > threshold else ""
+                print(f"  {target}/{name} {key}: {old} -> {new} ({change:+.1%}){flag}")
+                if flag:
+                    regressions.append(f"{target}/{name} {key} {change:+.1%}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark com stand-ins locais das APIs externas")
+    parser.add_argument("--targets", default="api,mcp", help="Alvos: api, mcp ou api,mcp")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"Pesos das operações (padrão: {DEFAULT_MIX})")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=15.0, help="Segundos medidos por alvo")
+    parser.add_argument("--warmup", type=float, default=2.0, help="Segundos descartados no início")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--quota", type=float, default=0, help="WEATHER_QUOTA_PER_MINUTE dos servidores (0 = sem cota)")
+    parser.add_argument("--ai-cache", action="store_true", help="Mantém o cache persistente de IA ligado")
+    parser.add_argument("--env", action="append", default=[], metavar="CHAVE=VALOR",
+                        help="Variável extra para os servidores (pode repetir)")
+    parser.add_argument("--out", help="Arquivo JSON de saída (padrão: bench/results/<data>-<commit>.json)")
+    parser.add_argument("--compare", metavar="JSON", help="Resultado anterior para comparar")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Piora relativa considerada regressão")
+    add_profile_args(parser)
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    print_report(results)
+
+    out = Path(args.out) if args.out else RESULTS_DIR / f"{time.strftime('%Y%m%d-%H%M%S')}-{results['meta']['commit'] or 'local'}.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(results, ensure_ascii=False, indent=2))
+    print(f"\nResultados gravados em {out}")
+
+    if args.compare:
+        regressions = compare(results, json.loads(Path(args.compare).read_text()), args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regressão(ões) acima de {args.threshold:.0%}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
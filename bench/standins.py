@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+"""
+Substitutos locais das APIs externas para os benchmarks.
+
+Um único app responde pelos quatro serviços, cada um sob um prefixo:
+
+    /owm/data/2.5        OpenWeatherMap (weather, group, forecast)
+    /restcountries/v3.1  RestCountries (name, all)
+    /openai/v1           OpenAI (chat/completions, com e sem stream)
+    /anthropic/v1        Anthropic (messages, com e sem stream)
+
+Cada serviço tem um perfil com latência (mediana e dispersão lognormal),
+taxa de erros 500, taxa de 429 aleatórios e um limite de requisições por
+minuto que também responde 429 com Retry-After.
+
+Para rodar isolado:
+    python -m bench.standins --port 9100 --owm latency=80,errors=0.01
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import time
+from dataclasses import asdict, dataclass, fields
+from typing import Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+UPSTREAMS = ("owm", "restcountries", "openai", "anthropic")
+
+# URL base de cada serviço, relativa à raiz do stand-in
+BASE_PATHS = {
+    "owm": "/owm/data/2.5",
+    "restcountries": "/restcountries/v3.1",
+    "openai": "/openai/v1",
+    "anthropic": "/anthropic",
+}
+
+AI_REPLY = (
+    "Com base nos dados, o clima está agradável para passeios ao ar livre. "
+    "Leve protetor solar e uma garrafa de água, e evite os horários de maior calor."
+)
+
+
+@dataclass
+class Profile:
+    """Comportamento simulado de um serviço."""
+
+    latency: float = 50.0     # mediana, em ms
+    sigma: float = 0.3        # dispersão da lognormal (0 = latência fixa)
+    errors: float = 0.0       # fração de respostas 500
+    rate429: float = 0.0      # fração de respostas 429 aleatórias
+    rpm: float = 0.0          # limite de requisições por minuto (0 = sem limite)
+    retry_after: float = 1.0  # segundos no cabeçalho Retry-After dos 429
+    chunk_delay: float = 5.0  # ms entre trechos das respostas em streaming
+
+    @classmethod
+    def parse(cls, spec: str) -> "Profile":
+        """Lê um perfil no formato 'latency=80,errors=0.01,rpm=600'."""
+        profile = cls()
+        names = {f.name for f in fields(cls)}
+        for item in filter(None, (part.strip() for part in (spec or "").split(","))):
+            key, _, value = item.partition("=")
+            if key not in names:
+                raise ValueError(f"Parâmetro desconhecido no perfil: '{key}' (use {', '.join(sorted(names))})")
+            setattr(profile, key, float(value))
+        return profile
+
+    def sample_latency(self, rng: random.Random) -> float:
+        """Latência sorteada, em segundos."""
+        if self.sigma <= 0:
+            return self.latency / 1000
+        return rng.lognormvariate(0.0, self.sigma) * self.latency / 1000
+
+
+class _Upstream:
+    """Estado de um serviço simulado: perfil, janela do limite e contadores."""
+
+    def __init__(self, profile: Profile, rng: random.Random):
+        self.profile = profile
+        self.rng = rng
+        self._window: list[float] = []
+        self.counts = {"requests": 0, "errors": 0, "rate_limited": 0}
+
+    async def gate(self) -> Optional[Response]:
+        """Aplica latência, 429 e erros; None se a requisição deve ser atendida."""
+        self.counts["requests"] += 1
+        profile = self.profile
+
+        limited = self.rng.random() < profile.rate429
+        if profile.rpm > 0:
+            now = time.monotonic()
+            self._window = [t for t in self._window if now - t < 60.0]
+            if len(self._window) >= profile.rpm:
+                limited = True
+            else:
+                self._window.append(now)
+        if limited:
+            self.counts["rate_limited"] += 1
+            return JSONResponse(
+                {"message": "rate limited"}, status_code=429,
+                headers={"Retry-After": f"{profile.retry_after:g}"},
+            )
+
+        await asyncio.sleep(profile.sample_latency(self.rng))
+        if self.rng.random() < profile.errors:
+            self.counts["errors"] += 1
+            return JSONResponse({"message": "internal error"}, status_code=500)
+        return None
+
+
+def _city_id(name: str) -> int:
+    return int(hashlib.md5(name.lower().encode()).hexdigest()[:6], 16)
+
+
+def _weather(name: str, city_id: Optional[int] = None) -> dict:
+    city_id = city_id or _city_id(name)
+    temp = 15 + city_id % 20
+    return {
+        "id": city_id,
+        "name": name.title(),
+        "sys": {"country": "BR"},
+        "main": {"temp": temp, "feels_like": temp + 1, "temp_min": temp - 2, "temp_max": temp + 3,
+                 "humidity": 40 + city_id % 50, "pressure": 1012},
+        "weather": [{"id": 800, "description": "céu limpo"}],
+        "wind": {"speed": 3.5, "deg": 120},
+        "visibility": 10000,
+    }
+
+
+def _forecast(name: str) -> dict:
+    start = int(time.time()) // 10800 * 10800
+    city_id = _city_id(name)
+    return {
+        "city": {"id": city_id, "name": name.title(), "country": "BR", "timezone": -10800},
+        "list": [
+            {
+                "dt": start + i * 10800,
+                "main": {"temp": 20 + (i % 8), "temp_min": 19 + (i % 8), "temp_max": 21 + (i % 8), "humidity": 60},
+                "wind": {"speed": 2.0 + i % 5},
+                "pop": (i % 4) / 4,
+                "rain": {"3h": 0.5} if i % 4 == 3 else {},
+                "weather": [{"id": 500 if i % 4 == 3 else 800}],
+            }
+            for i in range(40)
+        ],
+    }
+
+
+def _country(name: str) -> dict:
+    return {
+        "name": {"common": name.title(), "official": f"República de {name.title()}"},
+        "cca2": name[:2].upper(),
+        "cca3": name[:3].upper(),
+        "capital": ["Capital"],
+        "population": 1_000_000 + _city_id(name),
+        "region": "Americas",
+        "subregion": "South America",
+        "languages": {"por": "Portuguese"},
+        "currencies": {"BRL": {"name": "Brazilian real", "symbol": "R$"}},
+        "area": 8515767.0,
+        "timezones": ["UTC-03:00"],
+        "flag": "🏳️",
+    }
+
+
+def _sse(data: dict, event: Optional[str] = None) -> str:
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def create_app(profiles: Optional[dict[str, Profile]] = None, seed: int = 42) -> FastAPI:
+    """App com os quatro serviços simulados."""
+    rng = random.Random(seed)
+    upstreams = {name: _Upstream((profiles or {}).get(name, Profile()), rng) for name in UPSTREAMS}
+    app = FastAPI(title="Stand-ins das APIs externas")
+    app.state.upstreams = upstreams
+
+    @app.get("/stats")
+    async def stats():
+        return {name: {**u.counts, "profile": asdict(u.profile)} for name, u in upstreams.items()}
+
+    # OpenWeatherMap
+    @app.get(BASE_PATHS["owm"] + "/weather")
+    async def weather(q: str = "", id: Optional[int] = None):
+        rejected = await upstreams["owm"].gate()
+        if rejected:
+            return rejected
+        return _weather(q.split(",")[0] or f"cidade {id}", id)
+
+    @app.get(BASE_PATHS["owm"] + "/group")
+    async def group(id: str):
+        rejected = await upstreams["owm"].gate()
+        if rejected:
+            return rejected
+        items = [_weather(f"cidade {city_id}", int(city_id)) for city_id in id.split(",") if city_id]
+        return {"cnt": len(items), "list": items}
+
+    @app.get(BASE_PATHS["owm"] + "/forecast")
+    async def forecast(q: str = "", id: Optional[int] = None):
+        rejected = await upstreams["owm"].gate()
+        if rejected:
+            return rejected
+        return _forecast(q.split(",")[0] or f"cidade {id}")
+
+    # RestCountries
+    @app.get(BASE_PATHS["restcountries"] + "/name/{name}")
+    async def country(name: str):
+        rejected = await upstreams["restcountries"].gate()
+        if rejected:
+            return rejected
+        return [_country(name)]
+
+    @app.get(BASE_PATHS["restcountries"] + "/all")
+    async def all_countries():
+        rejected = await upstreams["restcountries"].gate()
+        if rejected:
+            return rejected
+        return [_country(name) for name in ("brasil", "chile", "japan", "france")]
+
+    # OpenAI
+    @app.post(BASE_PATHS["openai"] + "/chat/completions")
+    async def chat_completions(request: Request):
+        upstream = upstreams["openai"]
+        body = await request.json()
+        rejected = await upstream.gate()
+        if rejected:
+            return rejected
+        created, model = int(time.time()), body.get("model", "gpt-4o-mini")
+        if not body.get("stream"):
+            return {
+                "id": "chatcmpl-bench", "object": "chat.completion", "created": created, "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": AI_REPLY},
+                             "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 50, "completion_tokens": 40, "total_tokens": 90},
+            }
+
+        async def chunks():
+            base = {"id": "chatcmpl-bench", "object": "chat.completion.chunk", "created": created, "model": model}
+            for word in AI_REPLY.split(" "):
+                await asyncio.sleep(upstream.profile.chunk_delay / 1000)
+                yield _sse({**base, "choices": [{"index": 0, "delta": {"content": word + " "}, "finish_reason": None}]})
+            yield _sse({**base, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(chunks(), media_type="text/event-stream")
+
+    # Anthropic
+    @app.post(BASE_PATHS["anthropic"] + "/v1/messages")
+    async def messages(request: Request):
+        upstream = upstreams["anthropic"]
+        body = await request.json()
+        rejected = await upstream.gate()
+        if rejected:
+            return rejected
+        model = body.get("model", "claude-3-5-sonnet-20241022")
+        message = {
+            "id": "msg_bench", "type": "message", "role": "assistant", "model": model,
+            "content": [{"type": "text", "text": AI_REPLY}],
+            "stop_reason": "end_turn", "stop_sequence": None,
+            "usage": {"input_tokens": 50, "output_tokens": 40},
+        }
+        if not body.get("stream"):
+            return message
+
+        async def events():
+            yield _sse({"type": "message_start", "message": {**message, "content": [], "stop_reason": None,
+                                                              "usage": {"input_tokens": 50, "output_tokens": 1}}},
+                       "message_start")
+            yield _sse({"type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""}},
+                       "content_block_start")
+            for word in AI_REPLY.split(" "):
+                await asyncio.sleep(upstream.profile.chunk_delay / 1000)
+                yield _sse({"type": "content_block_delta", "index": 0,
+                            "delta": {"type": "text_delta", "text": word + " "}}, "content_block_delta")
+            yield _sse({"type": "content_block_stop", "index": 0}, "content_block_stop")
+            yield _sse({"type": "message_delta", "delta": {"stop_reason": "end_turn", "stop_sequence": None},
+                        "usage": {"output_tokens": 40}}, "message_delta")
+            yield _sse({"type": "message_stop"}, "message_stop")
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    return app
+
+
+def upstream_env(base_url: str) -> dict[str, str]:
+    """Variáveis de ambiente que apontam o servidor para os stand-ins."""
+    base_url = base_url.rstrip("/")
+    return {
+        "WEATHER_API_KEY": "bench",
+        "WEATHER_API_BASE": base_url + BASE_PATHS["owm"],
+        "RESTCOUNTRIES_API_BASE": base_url + BASE_PATHS["restcountries"],
+        "OPENAI_API_KEY": "bench",
+        "OPENAI_BASE_URL": base_url + BASE_PATHS["openai"],
+        "ANTHROPIC_API_KEY": "bench",
+        "ANTHROPIC_BASE_URL": base_url + BASE_PATHS["anthropic"],
+    }
+
+
+def add_profile_args(parser: argparse.ArgumentParser):
+    for name in UPSTREAMS:
+        parser.add_argument(
+            f"--{name}", default="", metavar="PERFIL",
+            help=f"Perfil do stand-in {name} (ex: latency=80,sigma=0.4,errors=0.01,rate429=0.02,rpm=600)",
+        )
+
+
+def profiles_from_args(args: argparse.Namespace) -> dict[str, Profile]:
+    return {name: Profile.parse(getattr(args, name)) for name in UPSTREAMS}
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Stand-ins locais das APIs externas")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--seed", type=int, default=42)
+    add_profile_args(parser)
+    args = parser.parse_args()
+
+    app = create_app(profiles_from_args(args), args.seed)
+    for key, value in upstream_env(f"http://{args.host}:{args.port}").items():
+        if not key.endswith("_KEY"):
+            print(f"{key}={value}")
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Tempo de subida do servidor MCP stdio.
+
+Mede em processos novos o tempo de importação de ``server`` (``-X importtime``)
+e o tempo do lançamento de ``server.py`` até a resposta do ``initialize`` e do
+``list_tools``, que é o que o Claude Desktop espera a cada sessão.
+
+    python -m bench.startup --runs 5 --budget-ms 1500
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Optional
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def startup_env(extra: Optional[dict] = None) -> dict:
+    """Ambiente do servidor sem trabalho de rede em segundo plano na subida."""
+    return {**os.environ, "HTTP_PREWARM": "false", "WEATHER_PREFETCH_ENABLED": "false", **(extra or {})}
+
+
+def _importtime(module: str, env: Optional[dict]) -> list[tuple[int, str, int]]:
+    """(profundidade, módulo, µs cumulativos) de cada linha do ``-X importtime``."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT, env=env or startup_env(), capture_output=True, text=True, check=True,
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        rows.append((depth, name.strip(), int(cumulative)))
+    return rows
+
+
+def import_profile(module: str = "server", env: Optional[dict] = None) -> dict[str, int]:
+    """Tempo cumulativo de importação (µs) de cada módulo carregado por ``module``."""
+    return {name: micros for _, name, micros in _importtime(module, env)}
+
+
+def direct_imports(module: str = "server", env: Optional[dict] = None) -> list[tuple[str, int]]:
+    """Módulos importados diretamente por ``module``, do mais lento ao mais rápido."""
+    rows = [(name, micros) for depth, name, micros in _importtime(module, env) if depth == 1]
+    return sorted(rows, key=lambda row: row[1], reverse=True)
+
+
+async def handshake_seconds(env: Optional[dict] = None) -> float:
+    """Segundos do lançamento de server.py até ``initialize`` e ``list_tools`` responderem."""
+    from mcp import ClientSession, StdioServerParameters
+    from mcp.client.stdio import stdio_client
+
+    params = StdioServerParameters(
+        command=sys.executable, args=[str(ROOT / "server.py")], env=env or startup_env(), cwd=str(ROOT)
+    )
+    with open(os.devnull, "w") as errlog:
+        started = time.perf_counter()
+        async with stdio_client(params, errlog=errlog) as (read, write):
+            async with ClientSession(read, write) as session:
+                await session.initialize()
+                await session.list_tools()
+                return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tempo de subida do servidor MCP")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=0, help="Falha se a importação mediana passar disso")
+    args = parser.parse_args()
+
+    imports = [import_profile()["server"] / 1000 for _ in range(args.runs)]
+    handshakes = [asyncio.run(handshake_seconds()) * 1000 for _ in range(args.runs)]
+    print(f"Importação de server: mediana {statistics.median(imports):.0f} ms (mín {min(imports):.0f} ms)")
+    print(f"Lançamento até list_tools: mediana {statistics.median(handshakes):.0f} ms (mín {min(handshakes):.0f} ms)")
+    print("\nImportações diretas mais lentas:")
+    for name, micros in direct_imports()[:10]:
+        print(f"  {name:<24}{micros / 1000:>8.1f} ms")
+
+    if args.budget_ms and statistics.median(imports) > args.budget_ms:
+        print(f"\nImportação acima do orçamento de {args.budget_ms:.0f} ms")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
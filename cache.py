@@ -0,0 +1,439 @@
+"""
+Estruturas de cache em memória usadas pelo MCP Weather & Files Server.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable, Optional
+
+# Estados retornados por TTLCache.get
+CACHE_FRESH = "fresh"
+CACHE_STALE = "stale"
+CACHE_MISS = "miss"
+
+
+class TTLCache:
+    """Cache LRU limitado com expiração (TTL) e janela stale-while-revalidate.
+
+    Uma entrada é "fresca" até ``ttl`` segundos após ser gravada e "velha"
+    (ainda servível, mas que deve ser revalidada) por mais ``stale_ttl``
+    segundos. Depois disso é descartada na próxima leitura.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 256,
+        ttl: float = 600.0,
+        stale_ttl: float = 0.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.maxsize = max(1, maxsize)
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._clock = clock
+        self._data: "OrderedDict[Hashable, tuple[Any, float]]" = OrderedDict()
+
+        # Contadores para ajuste fino do cache
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._data
+
+    def get(self, key: Hashable) -> tuple[Any, str]:
+        """Retorna ``(valor, estado)``, onde estado é fresh, stale ou miss."""
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return None, CACHE_MISS
+
+        value, stored_at = entry
+        age = self._clock() - stored_at
+
+        if age < self.ttl:
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value, CACHE_FRESH
+
+        if age < self.ttl + self.stale_ttl:
+            self._data.move_to_end(key)
+            self.stale_hits += 1
+            return value, CACHE_STALE
+
+        del self._data[key]
+        self.expirations += 1
+        self.misses += 1
+        return None, CACHE_MISS
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """Grava um valor, despejando a entrada menos usada se necessário."""
+        self._data[key] = (value, self._clock())
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def age(self, key: Hashable) -> float | None:
+        """Idade da entrada em segundos (sem afetar LRU nem contadores)."""
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        return self._clock() - entry[1]
+
+    def peek(self, key: Hashable) -> Any:
+        """Valor gravado, mesmo expirado (sem afetar LRU nem contadores).
+
+        Serve como resposta degradada quando o upstream está indisponível.
+        """
+        entry = self._data.get(key)
+        return entry[0] if entry is not None else None
+
+    def invalidate(self, key: Hashable) -> None:
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def stats(self) -> dict:
+        """Contadores de uso do cache."""
+        lookups = self.hits + self.stale_hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "stale_ttl": self.stale_ttl,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_ratio": round((self.hits + self.stale_hits) / lookups, 4) if lookups else 0.0,
+        }
+
+
+class _Call:
+    """Execução em andamento compartilhada por SingleFlight."""
+
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: "asyncio.Task"):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Deduplica chamadas concorrentes idênticas (request coalescing).
+
+    Enquanto uma chamada com a mesma chave estiver em andamento, novos
+    chamadores aguardam o mesmo resultado em vez de disparar outra
+    requisição. Exceções são propagadas para todos os que aguardam. Se um
+    chamador for cancelado, apenas ele é cancelado; a execução compartilhada
+    só é cancelada quando não resta mais ninguém aguardando.
+    """
+
+    def __init__(self):
+        self._calls: dict[Hashable, _Call] = {}
+        self.executed = 0
+        self.shared = 0
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+    async def do(self, key: Hashable, factory: Callable[[], Awaitable[Any]]) -> Any:
+        """Executa ``factory()`` uma única vez por chave entre chamadas concorrentes."""
+        call = self._calls.get(key)
+        if call is None:
+            call = _Call(asyncio.ensure_future(factory()))
+            self._calls[key] = call
+            call.task.add_done_callback(lambda _t, k=key, c=call: self._forget(k, c))
+            self.executed += 1
+        else:
+            self.shared += 1
+
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        except asyncio.CancelledError:
+            # Só este chamador foi cancelado: cancela a execução se ninguém mais espera
+            if not call.task.done() and call.waiters == 1:
+                call.task.cancel()
+            raise
+        finally:
+            call.waiters -= 1
+
+    def _forget(self, key: Hashable, call: _Call) -> None:
+        if self._calls.get(key) is call:
+            del self._calls[key]
+        # Todos os chamadores desistiram: ninguém vai ler a exceção, e o asyncio
+        # registraria "Task exception was never retrieved"
+        if call.waiters == 0 and not call.task.cancelled():
+            call.task.exception()
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": len(self._calls),
+            "executed": self.executed,
+            "shared": self.shared,
+        }
+
+
+class FileContentCache:
+    """Cache LRU do conteúdo de arquivos, limitado por um orçamento em bytes.
+
+    Cada entrada guarda a assinatura (st_mtime_ns, st_size, st_ino) do
+    arquivo quando foi lido; uma leitura só é servida da memória se o
+    ``stat()`` atual tiver a mesma assinatura. É seguro para uso a partir
+    de várias threads.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, max_entry_bytes: int = 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self._data: "OrderedDict[str, tuple[tuple[int, int, int], bytes]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.resident_bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def signature(st: os.stat_result) -> tuple[int, int, int]:
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+    def cacheable(self, st: os.stat_result) -> bool:
+        return st.st_size <= self.max_entry_bytes
+
+    def get(self, path: str, st: os.stat_result) -> Optional[bytes]:
+        """Conteúdo em cache se o arquivo não mudou desde a leitura."""
+        with self._lock:
+            entry = self._data.get(path)
+            if entry is not None and entry[0] == self.signature(st):
+                self._data.move_to_end(path)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                self._remove(path)
+            self.misses += 1
+            return None
+
+    def put(self, path: str, st: os.stat_result, data: bytes) -> None:
+        if len(data) > self.max_entry_bytes or len(data) > self.max_bytes:
+            return
+        with self._lock:
+            if path in self._data:
+                self._remove(path)
+            self._data[path] = (self.signature(st), data)
+            self.resident_bytes += len(data)
+            while self.resident_bytes > self.max_bytes:
+                _, (_, evicted) = self._data.popitem(last=False)
+                self.resident_bytes -= len(evicted)
+                self.evictions += 1
+
+    def invalidate(self, path: Optional[str] = None) -> int:
+        """Descarta um arquivo, todos os arquivos sob um diretório ou, sem
+        argumento, o cache inteiro. Pensado para ser chamado por um watcher."""
+        with self._lock:
+            if path is None:
+                keys = list(self._data)
+            else:
+                prefix = path.rstrip(os.sep) + os.sep
+                keys = [k for k in self._data if k == path or k.startswith(prefix)]
+            for key in keys:
+                self._remove(key)
+            self.invalidations += len(keys)
+            return len(keys)
+
+    def _remove(self, path: str) -> None:
+        _, data = self._data.pop(path)
+        self.resident_bytes -= len(data)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._data),
+            "resident_bytes": self.resident_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+class AIResponseCache:
+    """Cache persistente de respostas de IA em SQLite, compartilhado entre processos.
+
+    Entradas expiram após ``ttl`` segundos e, acima de ``max_entries``, as
+    menos acessadas são descartadas. O banco usa WAL para permitir que
+    vários workers do uvicorn leiam e gravem ao mesmo tempo. Os métodos são
+    bloqueantes: chame-os fora do event loop.
+    """
+
+    def __init__(self, path: str, ttl: float = 86400.0, max_entries: int = 5000):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._puts = 0
+
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(*parts: Any) -> str:
+        """Hash estável dos parâmetros que determinam a resposta."""
+        raw = json.dumps(parts, ensure_ascii=False, separators=(",", ":"))
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS ai_responses ("
+                " key TEXT PRIMARY KEY,"
+                " value TEXT NOT NULL,"
+                " created REAL NOT NULL,"
+                " accessed REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS ai_responses_accessed ON ai_responses (accessed)")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> Optional[str]:
+        conn = self._conn()
+        now = time.time()
+        row = conn.execute(
+            "SELECT value FROM ai_responses WHERE key = ? AND created > ?", (key, now - self.ttl)
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        conn.execute("UPDATE ai_responses SET accessed = ? WHERE key = ?", (now, key))
+        self.hits += 1
+        return row[0]
+
+    def put(self, key: str, value: str) -> None:
+        conn = self._conn()
+        now = time.time()
+        conn.execute(
+            "INSERT OR REPLACE INTO ai_responses (key, value, created, accessed) VALUES (?, ?, ?, ?)",
+            (key, value, now, now),
+        )
+        self._puts += 1
+        if self._puts % 50 == 1:
+            self.evict()
+
+    def evict(self) -> None:
+        """Remove entradas expiradas e o excedente menos acessado."""
+        conn = self._conn()
+        conn.execute("DELETE FROM ai_responses WHERE created <= ?", (time.time() - self.ttl,))
+        conn.execute(
+            "DELETE FROM ai_responses WHERE key IN ("
+            " SELECT key FROM ai_responses ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "path": self.path,
+            "ttl": self.ttl,
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+class HotKeys:
+    """Frequência aproximada de acessos com count-min sketch e decaimento.
+
+    O sketch usa ``depth`` linhas de ``width`` contadores (memória fixa,
+    independente do número de chaves) e a estimativa de uma chave é o menor
+    dos seus contadores. A cada ``decay_after`` registros todos os
+    contadores são divididos por dois, então a popularidade antiga perde
+    peso. Só as ``k`` chaves mais frequentes são guardadas explicitamente.
+    """
+
+    def __init__(self, k: int = 50, width: int = 2048, depth: int = 4, decay_after: int = 10000):
+        self.k = max(1, k)
+        self.width = width
+        self.depth = depth
+        self.decay_after = decay_after
+        self._counters = array("I", bytes(4 * width * depth))
+        self._top: dict[Hashable, int] = {}
+        self._seeds = [0x9E3779B1 * (i + 1) for i in range(depth)]
+        self._since_decay = 0
+
+        self.additions = 0
+        self.decays = 0
+
+    def _slots(self, key: Hashable) -> list[int]:
+        base = hash(key)
+        return [row * self.width + (hash((seed, base)) % self.width) for row, seed in enumerate(self._seeds)]
+
+    def estimate(self, key: Hashable) -> int:
+        return min(self._counters[slot] for slot in self._slots(key))
+
+    def add(self, key: Hashable) -> int:
+        """Registra um acesso e retorna a frequência estimada da chave."""
+        slots = self._slots(key)
+        estimate = min(self._counters[slot] for slot in slots) + 1
+        # Atualização conservadora: só sobe os contadores abaixo da nova estimativa
+        for slot in slots:
+            if self._counters[slot] < estimate:
+                self._counters[slot] = estimate
+
+        if key in self._top or len(self._top) < self.k:
+            self._top[key] = estimate
+        else:
+            coldest = min(self._top, key=self._top.__getitem__)
+            if estimate > self._top[coldest]:
+                del self._top[coldest]
+                self._top[key] = estimate
+
+        self.additions += 1
+        self._since_decay += 1
+        if self._since_decay >= self.decay_after:
+            self._decay()
+        return estimate
+
+    def _decay(self) -> None:
+        self._counters = array("I", (c >> 1 for c in self._counters))
+        self._top = {key: count >> 1 for key, count in self._top.items() if count >> 1}
+        self._since_decay = 0
+        self.decays += 1
+
+    def top(self, n: Optional[int] = None, min_count: int = 1) -> list[tuple[Hashable, int]]:
+        """Chaves mais frequentes, da mais para a menos acessada."""
+        ranked = sorted(self._top.items(), key=lambda item: item[1], reverse=True)
+        return [(key, count) for key, count in ranked[:n or self.k] if count >= min_count]
+
+    def stats(self) -> dict:
+        return {
+            "tracked": len(self._top),
+            "k": self.k,
+            "sketch_bytes": self._counters.itemsize * len(self._counters),
+            "additions": self.additions,
+            "decays": self.decays,
+        }
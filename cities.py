@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+Índice local de cidades a partir da lista de cidades da OpenWeatherMap.
+
+Baixe a lista com:
+    python cities.py --refresh
+"""
+
+import argparse
+import gzip
+import json
+import logging
+import os
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from pathlib import Path
+from typing import Iterable, NamedTuple, Optional
+
+import httpx
+
+from countries import normalize
+
+logger = logging.getLogger("mcp-weather-server")
+
+CITY_LIST_URL = os.getenv("CITY_LIST_URL", "https://bulk.openweathermap.org/sample/city.list.json.gz")
+DEFAULT_CITY_LIST_PATH = Path(__file__).parent / "data" / "city.list.json.gz"
+
+
+class City(NamedTuple):
+    """Cidade da lista da OpenWeatherMap."""
+
+    id: int
+    name: str
+    state: str
+    country: str
+    lat: float
+    lon: float
+
+    @property
+    def label(self) -> str:
+        parts = [self.name, self.state, self.country]
+        return ", ".join(p for p in parts if p)
+
+
+class CityIndex:
+    """Índice compacto de cidades com busca exata e por prefixo.
+
+    As colunas numéricas ficam em ``array`` (sem um objeto Python por
+    cidade) e os nomes normalizados ficam em uma lista ordenada, com a
+    posição original de cada um em ``_order``: uma busca por prefixo é uma
+    busca binária seguida de uma varredura contígua, o mesmo que descer uma
+    trie, mas sem os milhões de nós que ela teria em Python.
+    """
+
+    def __init__(self, cities: Iterable[dict], fetched_at: float = 0.0):
+        self.fetched_at = fetched_at
+        self._ids = array("l")
+        self._lats = array("d")
+        self._lons = array("d")
+        self._names: list[str] = []
+        self._states: list[str] = []
+        self._countries: list[str] = []
+
+        for city in cities:
+            coord = city.get("coord") or {}
+            self._ids.append(int(city["id"]))
+            self._lats.append(float(coord.get("lat", 0.0)))
+            self._lons.append(float(coord.get("lon", 0.0)))
+            self._names.append(city.get("name", ""))
+            self._states.append(city.get("state") or "")
+            self._countries.append((city.get("country") or "").upper())
+
+        keys = [normalize(name) for name in self._names]
+        order = sorted(range(len(keys)), key=keys.__getitem__)
+        self._order = array("I", order)
+        self._keys = [keys[pos] for pos in order]
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    @classmethod
+    def load(cls, path: Path | str = DEFAULT_CITY_LIST_PATH) -> Optional["CityIndex"]:
+        """Carrega a lista (JSON, opcionalmente .gz); None se não existir ou for inválida."""
+        path = Path(path)
+        try:
+            opener = gzip.open if path.suffix == ".gz" else open
+            with opener(path, "rt", encoding="utf-8") as f:
+                cities = json.load(f)
+            index = cls(cities, path.stat().st_mtime)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Lista de cidades inválida em {path}: {str(e)}")
+            return None
+
+        logger.info(f"Índice de cidades carregado: {len(index)} cidades")
+        return index
+
+    def _city(self, pos: int) -> City:
+        return City(
+            self._ids[pos], self._names[pos], self._states[pos],
+            self._countries[pos], self._lats[pos], self._lons[pos],
+        )
+
+    def resolve(self, name: str, country: str = "") -> Optional[City]:
+        """Cidade com o nome exato (sem acentos/caixa), se não houver ambiguidade.
+
+        Homônimos no mesmo país (ou em países diferentes, sem ``country``)
+        retornam None, deixando a decisão para a API.
+        """
+        key = normalize(name)
+        if not key:
+            return None
+        country = (country or "").strip().upper()
+        lo, hi = bisect_left(self._keys, key), bisect_right(self._keys, key)
+        matches = [
+            pos for pos in self._order[lo:hi]
+            if not country or self._countries[pos] == country
+        ]
+        if len({(self._countries[pos], self._states[pos]) for pos in matches}) != 1:
+            return None
+        return self._city(matches[0])
+
+    def complete(self, prefix: str, limit: int = 10, country: str = "") -> list[City]:
+        """Cidades cujo nome começa com ``prefix``; nomes exatos vêm primeiro."""
+        key = normalize(prefix)
+        if not key or limit <= 0:
+            return []
+        country = (country or "").strip().upper()
+
+        results: list[City] = []
+        seen: set[tuple[str, str, str]] = set()
+        for i in range(bisect_left(self._keys, key), len(self._keys)):
+            if not self._keys[i].startswith(key):
+                break
+            pos = self._order[i]
+            if country and self._countries[pos] != country:
+                continue
+            # A lista tem entradas repetidas para a mesma cidade
+            label = (self._names[pos], self._states[pos], self._countries[pos])
+            if label in seen:
+                continue
+            seen.add(label)
+            results.append(self._city(pos))
+            if len(results) >= limit:
+                break
+        return results
+
+
+def download_city_list(path: Path | str = DEFAULT_CITY_LIST_PATH, timeout: float = 120.0) -> Path:
+    """Baixa a lista de cidades da OpenWeatherMap de forma atômica."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    with httpx.stream("GET", CITY_LIST_URL, timeout=timeout, follow_redirects=True) as response:
+        response.raise_for_status()
+        with open(tmp, "wb") as f:
+            for chunk in response.iter_bytes():
+                f.write(chunk)
+    os.replace(tmp, path)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Índice local de cidades (OpenWeatherMap)")
+    parser.add_argument("--refresh", action="store_true", help="Baixa uma nova lista de cidades")
+    parser.add_argument("--path", default=os.getenv("CITY_LIST_PATH", str(DEFAULT_CITY_LIST_PATH)))
+    parser.add_argument("--country", default="", help="Filtra pelo código do país (ex: BR)")
+    parser.add_argument("prefix", nargs="?", help="Início do nome da cidade")
+    args = parser.parse_args()
+
+    if args.refresh:
+        path = download_city_list(args.path)
+        print(f"Lista de cidades atualizada em {path}")
+
+    if args.prefix:
+        index = CityIndex.load(args.path)
+        if index is None:
+            print("Lista de cidades não encontrada. Execute: python cities.py --refresh")
+            return
+        start = time.perf_counter()
+        cities = index.complete(args.prefix, country=args.country)
+        elapsed = (time.perf_counter() - start) * 1e6
+        for city in cities:
+            print(f"{city.id:>9}  {city.label}  ({city.lat:.4f}, {city.lon:.4f})")
+        print(f"Consulta em {elapsed:.0f} µs")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+Índice offline de países a partir de um snapshot da RestCountries.
+
+Atualize o snapshot com:
+    python countries.py --refresh
+"""
+
+import argparse
+import difflib
+import json
+import logging
+import os
+import time
+import unicodedata
+from collections import Counter
+from pathlib import Path
+from typing import Optional
+
+import httpx
+
+logger = logging.getLogger("mcp-weather-server")
+
+RESTCOUNTRIES_API_BASE = os.getenv("RESTCOUNTRIES_API_BASE", "https://restcountries.com/v3.1")
+DEFAULT_SNAPSHOT_PATH = Path(__file__).parent / "data" / "countries.json"
+
+# O endpoint /all aceita no máximo 10 campos por requisição
+SNAPSHOT_FIELDS = [
+    ["name", "cca2", "cca3", "capital", "population", "area", "region", "subregion", "languages", "currencies"],
+    ["cca3", "flag", "timezones", "translations", "altSpellings"],
+]
+
+# Candidatos, por bigramas em comum, avaliados pela busca aproximada fora do bucket da inicial
+FUZZY_SHORTLIST = 50
+
+# Campos mantidos em memória (traduções e grafias alternativas só alimentam o índice)
+RECORD_FIELDS = (
+    "name", "cca2", "cca3", "capital", "population", "area", "region",
+    "subregion", "languages", "currencies", "flag", "timezones",
+)
+
+
+def normalize(text: str) -> str:
+    """Remove acentos, pontuação e caixa: 'São Tomé & Príncipe' -> 'sao tome principe'."""
+    decomposed = unicodedata.normalize("NFKD", text or "")
+    chars = [c if c.isalnum() else " " for c in decomposed if not unicodedata.combining(c)]
+    return " ".join("".join(chars).casefold().split())
+
+
+def _bigrams(key: str) -> set[str]:
+    return {key[i:i + 2] for i in range(len(key) - 1)}
+
+
+class CountryIndex:
+    """Índice compacto de países com busca exata por código/nome e fallback aproximado."""
+
+    def __init__(self, countries: list[dict], fetched_at: float = 0.0):
+        self.fetched_at = fetched_at
+        self._records: list[dict] = []
+        self._codes: dict[str, int] = {}
+        self._names: dict[str, int] = {}
+
+        # Nomes oficiais/comuns têm prioridade sobre nativos, traduções e apelidos
+        name_passes: list[list[tuple[str, int]]] = [[], [], []]
+
+        for country in countries:
+            pos = len(self._records)
+            self._records.append({k: country[k] for k in RECORD_FIELDS if k in country})
+
+            for code in (country.get("cca2"), country.get("cca3")):
+                if code:
+                    self._codes.setdefault(code.casefold(), pos)
+
+            name = country.get("name", {})
+            name_passes[0] += [(name.get("common", ""), pos), (name.get("official", ""), pos)]
+
+            for native in name.get("nativeName", {}).values():
+                name_passes[1] += [(native.get("common", ""), pos), (native.get("official", ""), pos)]
+            for translation in country.get("translations", {}).values():
+                name_passes[1] += [(translation.get("common", ""), pos), (translation.get("official", ""), pos)]
+
+            name_passes[2] += [(alt, pos) for alt in country.get("altSpellings", [])]
+
+        for entries in name_passes:
+            for text, pos in entries:
+                key = normalize(text)
+                if key:
+                    self._names.setdefault(key, pos)
+
+        # Buckets pela inicial limitam o custo da busca aproximada; os bigramas
+        # cobrem consultas com a inicial errada ("Vrazil")
+        self._keys = list(self._names)
+        self._buckets: dict[str, list[str]] = {}
+        self._grams: dict[str, list[int]] = {}
+        for i, key in enumerate(self._keys):
+            self._buckets.setdefault(key[0], []).append(key)
+            for gram in _bigrams(key):
+                self._grams.setdefault(gram, []).append(i)
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    @classmethod
+    def load(cls, path: Path | str = DEFAULT_SNAPSHOT_PATH) -> Optional["CountryIndex"]:
+        """Carrega o snapshot do disco; retorna None se ele não existir ou for inválido."""
+        try:
+            with open(path, encoding="utf-8") as f:
+                snapshot = json.load(f)
+            index = cls(snapshot["countries"], snapshot.get("fetched_at", 0.0))
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Snapshot de países inválido em {path}: {str(e)}")
+            return None
+
+        logger.info(f"Índice de países carregado: {len(index)} países")
+        return index
+
+    def is_fresh(self, max_age: float) -> bool:
+        return time.time() - self.fetched_at < max_age
+
+    def lookup(self, query: str, fuzzy: bool = True) -> Optional[dict]:
+        """Busca um país por código (cca2/cca3), nome, nome nativo ou tradução."""
+        raw = (query or "").strip().casefold()
+        if raw in self._codes:
+            return self._records[self._codes[raw]]
+
+        key = normalize(query)
+        if not key:
+            return None
+        if key in self._names:
+            return self._records[self._names[key]]
+
+        if fuzzy:
+            match = self._closest(key)
+            if match:
+                return self._records[self._names[match]]
+        return None
+
+    def _closest(self, key: str) -> Optional[str]:
+        """Nome indexado mais parecido com ``key`` (similaridade mínima de 0.8)."""
+        matches = difflib.get_close_matches(key, self._buckets.get(key[0], []), n=1, cutoff=0.8)
+        if not matches:
+            shared = Counter(i for gram in _bigrams(key) for i in self._grams.get(gram, ()))
+            shortlist = [self._keys[i] for i, _ in shared.most_common(FUZZY_SHORTLIST)]
+            matches = difflib.get_close_matches(key, shortlist, n=1, cutoff=0.8)
+        return matches[0] if matches else None
+
+
+def merge_snapshot(responses: list[list[dict]]) -> list[dict]:
+    """Junta por cca3 as respostas do /all (uma por grupo de SNAPSHOT_FIELDS)."""
+    merged: dict[str, dict] = {}
+    for countries in responses:
+        for country in countries:
+            merged.setdefault(country["cca3"], {}).update(country)
+    return sorted(merged.values(), key=lambda c: c["cca3"])
+
+
+def fetch_snapshot(timeout: float = 30.0) -> list[dict]:
+    """Baixa todos os países da RestCountries, juntando as consultas por cca3."""
+    responses = []
+    with httpx.Client(timeout=timeout) as client:
+        for fields in SNAPSHOT_FIELDS:
+            response = client.get(f"{RESTCOUNTRIES_API_BASE}/all", params={"fields": ",".join(fields)})
+            response.raise_for_status()
+            responses.append(response.json())
+    return merge_snapshot(responses)
+
+
+def save_snapshot(countries: list[dict], path: Path | str = DEFAULT_SNAPSHOT_PATH) -> None:
+    """Grava o snapshot de forma atômica."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"fetched_at": time.time(), "countries": countries}, f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(tmp, path)
+
+
+def build_snapshot(responses: list[list[dict]], path: Path | str = DEFAULT_SNAPSHOT_PATH) -> CountryIndex:
+    """Indexa as respostas do /all e grava o snapshot (se o disco permitir)."""
+    countries = merge_snapshot(responses)
+    try:
+        save_snapshot(countries, path)
+    except OSError as e:
+        logger.warning(f"Não foi possível gravar o snapshot de países em {path}: {str(e)}")
+    return CountryIndex(countries, time.time())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Snapshot offline de países (RestCountries)")
+    parser.add_argument("--refresh", action="store_true", help="Baixa e grava um novo snapshot")
+    parser.add_argument("--path", default=os.getenv("COUNTRY_SNAPSHOT_PATH", str(DEFAULT_SNAPSHOT_PATH)))
+    parser.add_argument("query", nargs="?", help="País a consultar no índice local")
+    args = parser.parse_args()
+
+    if args.refresh:
+        countries = fetch_snapshot()
+        save_snapshot(countries, args.path)
+        print(f"Snapshot atualizado: {len(countries)} países em {args.path}")
+
+    if args.query:
+        index = CountryIndex.load(args.path)
+        if index is None:
+            print("Snapshot não encontrado. Execute: python countries.py --refresh")
+            return
+        start = time.perf_counter()
+        info = index.lookup(args.query)
+        elapsed = (time.perf_counter() - start) * 1e6
+        print(json.dumps(info, ensure_ascii=False, indent=2) if info else "Não encontrado")
+        print(f"Consulta em {elapsed:.0f} µs")
+
+
+if __name__ == "__main__":
+    main()
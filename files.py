@@ -0,0 +1,469 @@
+"""
+Operações de arquivo de baixo nível usadas pelas ferramentas read_file e
+list_directory. Todas são síncronas e limitam a memória ao tamanho da
+janela pedida, independentemente do tamanho do arquivo.
+"""
+
+import base64
+import codecs
+import heapq
+import io
+import json
+import mmap
+import os
+import re
+from contextlib import contextmanager
+from dataclasses import dataclass
+from fnmatch import fnmatch
+from operator import itemgetter
+from typing import Iterator, Optional, Union
+
+# Arquivos a partir deste tamanho são lidos via mmap em vez de carregados
+MMAP_THRESHOLD = int(os.getenv("READ_FILE_MMAP_THRESHOLD", str(1024 * 1024)))
+
+Buffer = Union[bytes, mmap.mmap]
+
+
+def encode_cursor(state: dict) -> str:
+    """Codifica o estado de paginação em um cursor opaco."""
+    raw = json.dumps(state, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> dict:
+    """Decodifica um cursor gerado por encode_cursor (ValueError se inválido)."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        state = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except Exception:
+        raise ValueError("cursor inválido")
+    if not isinstance(state, dict):
+        raise ValueError("cursor inválido")
+    return state
+
+
+@contextmanager
+def open_buffer(path: str, size: int) -> Iterator[Buffer]:
+    """Abre o arquivo como bytes (pequenos) ou mmap somente leitura (grandes)."""
+    with open(path, "rb") as f:
+        if size < MMAP_THRESHOLD or size == 0:
+            yield f.read()
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            yield mm
+
+
+@dataclass
+class Window:
+    """Trecho lido de um arquivo."""
+
+    text: str
+    start: int          # byte inicial
+    end: int            # byte seguinte ao último consumido
+    first_line: Optional[int]
+    next_line: Optional[int]
+    size: int
+
+    @property
+    def eof(self) -> bool:
+        return self.end >= self.size
+
+
+def skip_lines(buf: Buffer, pos: int, count: int) -> int:
+    """Avança ``count`` linhas a partir de ``pos`` sem copiar dados."""
+    for _ in range(count):
+        nl = buf.find(b"\n", pos)
+        if nl < 0:
+            return len(buf)
+        pos = nl + 1
+    return pos
+
+
+def count_lines(buf: Buffer, pos: int = 0, base_line: int = 0) -> int:
+    """Total de linhas do arquivo, contando a partir de ``pos`` (linha ``base_line``)."""
+    size = len(buf)
+    unterminated = size > pos and buf[size - 1:size] != b"\n"
+    return base_line + buf[pos:size].count(b"\n") + unterminated
+
+
+def decode_window(
+    buf: Buffer, start: int, end: int, encoding: str, exact_end: bool
+) -> tuple[str, int]:
+    """Decodifica ``buf[start:end]``; se o fim cortar um caractere multibyte,
+    recua até o último caractere completo (a menos que ``exact_end``)."""
+    decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+    final = exact_end or end >= len(buf)
+    text = decoder.decode(buf[start:end], final=final)
+    if not final:
+        pending = decoder.getstate()[0]
+        if len(pending) < end - start:
+            end -= len(pending)
+        else:
+            # Janela menor que um caractere: emite o substituto para não travar a paginação
+            text += decoder.decode(b"", final=True)
+    return text, end
+
+
+def read_window(
+    buf: Buffer,
+    offset: int,
+    length: int,
+    unit: str = "bytes",
+    encoding: str = "utf-8",
+    max_bytes: int = 1024 * 1024,
+    line_base: Optional[tuple[int, int]] = None,
+) -> Window:
+    """Lê uma janela de ``length`` bytes ou linhas a partir de ``offset``.
+
+    ``line_base`` = (byte, linha) permite retomar a leitura por linhas de um
+    cursor sem reescanear o início do arquivo.
+    """
+    size = len(buf)
+
+    if unit == "lines":
+        base_pos, base_line = line_base or (0, 0)
+        start = skip_lines(buf, base_pos, max(0, offset - base_line))
+        end = skip_lines(buf, start, length)
+        # Linhas gigantes não podem estourar o limite de memória da janela
+        truncated = end - start > max_bytes
+        if truncated:
+            end = start + max_bytes
+        text, end = decode_window(buf, start, end, encoding, exact_end=not truncated)
+        # Linhas realmente lidas: o EOF pode chegar antes de ``length``
+        consumed = buf[start:end].count(b"\n")
+        if end >= size and end > start and buf[end - 1:end] != b"\n":
+            consumed += 1  # última linha sem quebra final
+        first_line = max(offset, base_line)
+        if start >= size:
+            first_line = min(first_line, count_lines(buf, base_pos, base_line))
+        return Window(text, start, end, first_line, first_line + consumed, size)
+
+    start = min(offset, size)
+    end = min(start + min(length, max_bytes), size)
+    text, end = decode_window(buf, start, end, encoding, exact_end=False)
+    return Window(text, start, end, None, None, size)
+
+
+def tail_start(f, size: int, lines: int, block_size: int = 64 * 1024) -> int:
+    """Byte onde começam as últimas ``lines`` linhas, lendo blocos de trás
+    para frente a partir do fim do arquivo (custo independe do tamanho)."""
+    if lines <= 0 or size == 0:
+        return size
+
+    # Uma quebra de linha final não conta como linha vazia
+    end = size
+    f.seek(size - 1)
+    if f.read(1) == b"\n":
+        end -= 1
+
+    pos = end
+    found = 0
+    while pos > 0:
+        read_size = min(block_size, pos)
+        pos -= read_size
+        f.seek(pos)
+        chunk = f.read(read_size)
+        idx = len(chunk)
+        while True:
+            idx = chunk.rfind(b"\n", 0, idx)
+            if idx < 0:
+                break
+            found += 1
+            if found == lines:
+                return pos + idx + 1
+    return 0
+
+
+def read_range(path: str, start: int, length: int) -> bytes:
+    """Lê ``length`` bytes a partir de ``start``."""
+    with open(path, "rb") as f:
+        f.seek(start)
+        return f.read(length)
+
+
+def read_tail(
+    source: Union[str, bytes], lines: int, encoding: str = "utf-8", max_bytes: int = 1024 * 1024
+) -> Window:
+    """Lê as últimas ``lines`` linhas de um arquivo (caminho) ou de um
+    conteúdo já em memória (bytes), limitado a ``max_bytes``."""
+    with (io.BytesIO(source) if isinstance(source, bytes) else open(source, "rb")) as f:
+        size = f.seek(0, os.SEEK_END)
+        start = max(tail_start(f, size, lines), size - max_bytes)
+        f.seek(start)
+        data = f.read(size - start)
+    text = codecs.decode(data, encoding, errors="replace")
+    return Window(text, start, size, None, None, size)
+
+
+def entry_is_dir(entry: os.DirEntry) -> bool:
+    """Tipo da entrada a partir do cache do scandir (sem seguir symlinks)."""
+    try:
+        return entry.is_dir(follow_symlinks=False)
+    except OSError:
+        return False
+
+
+def entry_size(entry: os.DirEntry) -> Optional[int]:
+    try:
+        return entry.stat(follow_symlinks=False).st_size
+    except OSError:
+        return None
+
+
+def sort_key(entry: os.DirEntry) -> tuple[bool, str, str]:
+    """Diretórios primeiro, depois nome sem diferenciar caixa."""
+    return (not entry_is_dir(entry), entry.name.lower(), entry.name)
+
+
+@dataclass
+class Page:
+    """Página de uma listagem de diretório."""
+
+    entries: list[tuple[str, os.DirEntry]]  # (caminho relativo, entrada)
+    total: Optional[int]                    # total de itens (só em listagens não recursivas)
+    next_cursor: Optional[str]
+
+
+def list_page(
+    path: str, page_size: int, cursor: Optional[str] = None, pattern: Optional[str] = None
+) -> Page:
+    """Lista um diretório em uma única passada do scandir.
+
+    Só os ``page_size`` primeiros itens na ordem de exibição são mantidos
+    (seleção parcial com heap); o cursor guarda a chave do último item
+    exibido, então cada página custa O(n log k) sem ordenar tudo.
+    """
+    after = None
+    if cursor:
+        state = decode_cursor(cursor)
+        if not isinstance(state.get("k"), list):
+            raise ValueError("cursor de outra listagem (gerado com recursive=true)")
+        after = tuple(state["k"])
+    counts = {"total": 0, "remaining": 0}
+
+    with os.scandir(path) as it:
+        def candidates():
+            for entry in it:
+                if pattern and not fnmatch(entry.name, pattern):
+                    continue
+                counts["total"] += 1
+                key = sort_key(entry)
+                if after is not None and key <= after:
+                    continue
+                counts["remaining"] += 1
+                yield key, entry
+
+        page = heapq.nsmallest(page_size, candidates(), key=itemgetter(0))
+
+    next_cursor = None
+    if counts["remaining"] > page_size:
+        next_cursor = encode_cursor({"k": list(page[-1][0])})
+    return Page([(entry.name, entry) for _, entry in page], counts["total"], next_cursor)
+
+
+def walk(
+    path: str,
+    max_depth: int,
+    pattern: Optional[str] = None,
+    exclude_dirs: frozenset = frozenset(),
+) -> Iterator[tuple[str, os.DirEntry]]:
+    """Percorre a árvore com scandir, gerando (caminho relativo, entrada)
+    na ordem do sistema de arquivos, sem montar a listagem completa.
+
+    ``pattern`` é comparado com o nome do item ou, se contiver '/', com o
+    caminho relativo. Diretórios são percorridos mesmo que não casem com o
+    padrão; links simbólicos para diretórios não são seguidos.
+    """
+    stack = [(path, "", 0)]
+    while stack:
+        current, prefix, depth = stack.pop()
+        subdirs = []
+        try:
+            with os.scandir(current) as it:
+                for entry in it:
+                    rel = f"{prefix}{entry.name}"
+                    target = rel if pattern and "/" in pattern else entry.name
+                    if not pattern or fnmatch(target, pattern):
+                        yield rel, entry
+                    if entry_is_dir(entry) and depth + 1 < max_depth and entry.name not in exclude_dirs:
+                        subdirs.append((entry.path, f"{rel}/", depth + 1))
+        except OSError:
+            continue
+
+        # Pilha LIFO: empilhar ao contrário preserva a ordem de descoberta
+        stack.extend(reversed(subdirs))
+
+
+def walk_page(
+    path: str, page_size: int, max_depth: int,
+    cursor: Optional[str] = None, pattern: Optional[str] = None
+) -> Page:
+    """Página de uma listagem recursiva.
+
+    Cada diretório é lido na ordem de exibição (sort_key). O cursor guarda
+    os diretórios pendentes e a chave do último item exibido no diretório
+    atual, então a página seguinte retoma dali sem percorrer de novo o que
+    já foi listado, e mudanças na árvore não deslocam nem repetem itens.
+    """
+    stack: list[list] = [["", 0]]  # (prefixo relativo, profundidade), LIFO
+    after = None
+    if cursor:
+        stack, after = _decode_walk_cursor(cursor, max_depth)
+
+    items: list[tuple[str, os.DirEntry]] = []
+    resume = None
+    while stack:
+        prefix, depth = stack.pop()
+        try:
+            with os.scandir(os.path.join(path, prefix)) as it:
+                entries = sorted(((sort_key(entry), entry) for entry in it), key=itemgetter(0))
+        except OSError:
+            after = None
+            continue
+
+        subdirs = []
+        for key, entry in entries:
+            rel = f"{prefix}{entry.name}"
+            if entry_is_dir(entry) and depth + 1 < max_depth:
+                subdirs.append([f"{rel}/", depth + 1])
+            if after is not None and key <= after:
+                continue
+            target = rel if pattern and "/" in pattern else entry.name
+            if pattern and not fnmatch(target, pattern):
+                continue
+            if resume is not None:
+                # Há um item além da página: retomar depois do último exibido
+                return Page(items, None, encode_cursor(resume))
+            items.append((rel, entry))
+            if len(items) == page_size:
+                resume = {"s": stack + [[prefix, depth]], "a": list(key)}
+        after = None
+
+        # Pilha LIFO: empilhar ao contrário preserva a ordem de exibição
+        stack.extend(reversed(subdirs))
+    return Page(items, None, None)
+
+
+def _decode_walk_cursor(cursor: str, max_depth: int) -> tuple[list[list], tuple]:
+    state = decode_cursor(cursor)
+    stack, after = state.get("s"), state.get("a")
+    if not isinstance(stack, list) or not isinstance(after, list):
+        raise ValueError("cursor de outra listagem (gerado com recursive=false)")
+    if [type(part) for part in after] != [bool, str, str]:
+        raise ValueError("cursor inválido")
+    for item in stack:
+        valid = (
+            isinstance(item, list) and len(item) == 2
+            and isinstance(item[0], str) and isinstance(item[1], int)
+            and 0 <= item[1] < max_depth
+            # O prefixo vem do cliente: nunca sair da raiz listada
+            and not os.path.isabs(item[0]) and ".." not in item[0].split("/")
+        )
+        if not valid:
+            raise ValueError("cursor inválido")
+    return stack, tuple(after)
+
+
+# Busca de conteúdo
+BINARY_SNIFF_BYTES = 8192
+SEARCH_TEXT_BLOCK = 4 * 1024 * 1024  # bytes decodificados por vez nas buscas em texto
+SEARCH_EXCLUDED_DIRS = frozenset({".git", ".hg", ".svn", "node_modules", "__pycache__", ".venv", "venv"})
+
+
+@dataclass
+class FileMatches:
+    """Ocorrências de um padrão em um arquivo."""
+
+    path: str
+    count: int
+    lines: list[tuple[int, str]]  # (número da linha, texto)
+
+
+def looks_binary(chunk: bytes) -> bool:
+    """Heurística do grep: um byte nulo no início indica arquivo binário."""
+    return b"\0" in chunk
+
+
+def search_file(
+    path: str,
+    regex: "re.Pattern",
+    max_lines: int = 20,
+    max_count: int = 1000,
+    max_size: int = 256 * 1024 * 1024,
+) -> Optional[FileMatches]:
+    """Procura ``regex`` em um arquivo via mmap; None se não houver ocorrência
+    ou se o arquivo for binário, grande demais ou ilegível.
+
+    Padrões ``bytes`` rodam direto no mmap; padrões ``str`` (busca sem
+    diferenciar maiúsculas com texto não ASCII) rodam no texto decodificado,
+    em blocos de linhas inteiras."""
+    try:
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if size == 0 or size > max_size or looks_binary(f.read(BINARY_SNIFF_BYTES)):
+                return None
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                search = _search_text if isinstance(regex.pattern, str) else _search_bytes
+                count, lines = search(buf, regex, max_lines, max_count)
+    except (OSError, ValueError):
+        return None
+
+    if not count:
+        return None
+    return FileMatches(path, count, lines)
+
+
+def _search_bytes(buf: Buffer, regex: "re.Pattern[bytes]", max_lines: int, max_count: int):
+    count = 0
+    lines: list[tuple[int, str]] = []
+    line_no, scanned = 1, 0
+    last_line_start = -1
+
+    for match in regex.finditer(buf):
+        count += 1
+        start = match.start()
+        line_start = buf.rfind(b"\n", 0, start) + 1
+        if len(lines) < max_lines and line_start != last_line_start:
+            line_no += buf[scanned:line_start].count(b"\n")
+            scanned = line_start
+            line_end = buf.find(b"\n", start)
+            if line_end < 0:
+                line_end = len(buf)
+            text = buf[line_start:min(line_end, line_start + 200)]
+            lines.append((line_no, text.decode("utf-8", errors="replace").rstrip("\r")))
+            last_line_start = line_start
+        if count >= max_count:
+            break
+    return count, lines
+
+
+def _search_text(buf: Buffer, regex: "re.Pattern[str]", max_lines: int, max_count: int):
+    count = 0
+    lines: list[tuple[int, str]] = []
+    line_no, offset = 1, 0
+
+    # Blocos terminam em "\n", que nunca aparece dentro de um caractere UTF-8
+    while offset < len(buf) and count < max_count:
+        end = buf.find(b"\n", min(offset + SEARCH_TEXT_BLOCK, len(buf)))
+        end = len(buf) if end < 0 else end + 1
+        text = buf[offset:end].decode("utf-8", errors="replace")
+        block_line, scanned = line_no, 0
+        last_line_start = -1
+
+        for match in regex.finditer(text):
+            count += 1
+            start = match.start()
+            line_start = text.rfind("\n", 0, start) + 1
+            if len(lines) < max_lines and line_start != last_line_start:
+                block_line += text.count("\n", scanned, line_start)
+                scanned = line_start
+                line_end = text.find("\n", start)
+                if line_end < 0:
+                    line_end = len(text)
+                lines.append((block_line, text[line_start:min(line_end, line_start + 200)].rstrip("\r")))
+                last_line_start = line_start
+            if count >= max_count:
+                break
+        line_no += text.count("\n")
+        offset = end
+    return count, lines
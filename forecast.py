@@ -0,0 +1,145 @@
+"""
+Série temporal compacta da previsão de 5 dias / 3 horas da OpenWeatherMap.
+
+Cada grandeza fica em um buffer ``array`` contíguo (uma coluna por
+variável) em vez de uma lista de dicts; as agregações percorrem fatias
+dessas colunas com as funções nativas (min, max, sum), sem criar objetos
+intermediários por ponto.
+"""
+
+import time
+from array import array
+from bisect import bisect_left
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+STEP_SECONDS = 3 * 3600  # resolução da previsão
+
+PERIODS = {
+    "today": "hoje",
+    "tomorrow": "amanhã",
+    "week": "próximos 5 dias",
+}
+
+
+@dataclass
+class Summary:
+    """Agregados de um intervalo da previsão."""
+
+    points: int
+    temp_min: Optional[float]
+    temp_max: Optional[float]
+    temp_mean: Optional[float]
+    humidity_mean: Optional[float]
+    wind_max: Optional[float]
+    rain_mm: float
+    rain_hours: int
+    pop_max: float
+
+
+class ForecastSeries:
+    """Previsão de uma cidade, em colunas."""
+
+    __slots__ = (
+        "city_id", "name", "country", "tz_offset", "fetched_at",
+        "times", "temp", "temp_min", "temp_max", "humidity", "wind", "pop", "rain", "conditions",
+    )
+
+    def __init__(self, city_id: int, name: str, country: str, tz_offset: int, fetched_at: float):
+        self.city_id = city_id
+        self.name = name
+        self.country = country
+        self.tz_offset = tz_offset
+        self.fetched_at = fetched_at
+        self.times = array("q")       # epoch (UTC) do início de cada passo
+        self.temp = array("f")
+        self.temp_min = array("f")
+        self.temp_max = array("f")
+        self.humidity = array("B")    # %
+        self.wind = array("f")        # m/s
+        self.pop = array("f")         # probabilidade de precipitação (0-1)
+        self.rain = array("f")        # mm no passo de 3h (chuva + neve)
+        self.conditions = array("H")  # código de condição da OpenWeatherMap
+
+    def __len__(self) -> int:
+        return len(self.times)
+
+    @classmethod
+    def from_owm(cls, data: dict, fetched_at: Optional[float] = None) -> "ForecastSeries":
+        """Converte a resposta de /forecast em colunas."""
+        city = data.get("city", {})
+        series = cls(
+            city.get("id", 0),
+            city.get("name", ""),
+            city.get("country", ""),
+            city.get("timezone", 0),
+            time.time() if fetched_at is None else fetched_at,
+        )
+        for item in sorted(data.get("list", []), key=lambda i: i["dt"]):
+            main = item.get("main", {})
+            series.times.append(item["dt"])
+            series.temp.append(main.get("temp", 0.0))
+            series.temp_min.append(main.get("temp_min", main.get("temp", 0.0)))
+            series.temp_max.append(main.get("temp_max", main.get("temp", 0.0)))
+            series.humidity.append(int(main.get("humidity", 0)))
+            series.wind.append(item.get("wind", {}).get("speed", 0.0))
+            series.pop.append(item.get("pop", 0.0))
+            series.rain.append(item.get("rain", {}).get("3h", 0.0) + item.get("snow", {}).get("3h", 0.0))
+            series.conditions.append((item.get("weather") or [{}])[0].get("id", 0))
+        return series
+
+    @property
+    def nbytes(self) -> int:
+        """Memória ocupada pelas colunas."""
+        columns = (self.times, self.temp, self.temp_min, self.temp_max, self.humidity,
+                   self.wind, self.pop, self.rain, self.conditions)
+        return sum(c.itemsize * len(c) for c in columns)
+
+    def local_date(self, ts: float):
+        return datetime.fromtimestamp(ts + self.tz_offset, timezone.utc).date()
+
+    def period_bounds(self, period: str, now: Optional[float] = None) -> tuple[int, int]:
+        """Intervalo [início, fim) em epoch UTC para today, tomorrow ou week."""
+        now = time.time() if now is None else now
+        if period == "week":
+            return int(now) - STEP_SECONDS, int(now) + 6 * 86400
+        day = self.local_date(now) + timedelta(days=1 if period == "tomorrow" else 0)
+        start = int(datetime(day.year, day.month, day.day, tzinfo=timezone.utc).timestamp()) - self.tz_offset
+        return start, start + 86400
+
+    def _slice(self, start: int, end: int) -> slice:
+        return slice(bisect_left(self.times, start), bisect_left(self.times, end))
+
+    def summary(self, start: int, end: int) -> Summary:
+        """Agregados dos passos que começam em [start, end)."""
+        window = self._slice(start, end)
+        temp = self.temp[window]
+        if not temp:
+            return Summary(0, None, None, None, None, None, 0.0, 0, 0.0)
+        rain = self.rain[window]
+        return Summary(
+            points=len(temp),
+            temp_min=min(self.temp_min[window]),
+            temp_max=max(self.temp_max[window]),
+            temp_mean=sum(temp) / len(temp),
+            humidity_mean=sum(self.humidity[window]) / len(temp),
+            wind_max=max(self.wind[window]),
+            rain_mm=sum(rain),
+            rain_hours=3 * (len(rain) - rain.count(0.0)),
+            pop_max=max(self.pop[window]),
+        )
+
+    def daily(self, start: int, end: int) -> list[tuple]:
+        """Agregados por dia local: [(data, Summary), ...]."""
+        window = self._slice(start, end)
+        days = []
+        i, stop = window.start, window.stop
+        while i < stop:
+            day = self.local_date(self.times[i])
+            j = i
+            while j < stop and self.local_date(self.times[j]) == day:
+                j += 1
+            days.append((day, self.summary(self.times[i], self.times[j - 1] + 1)))
+            i = j
+        return days
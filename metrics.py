@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""
+Métricas em memória do MCP Weather & Files Server.
+
+Contadores, gauges e histogramas com rótulos, expostos no formato texto do
+Prometheus (``GET /metrics``) e como dicionário (ferramenta
+``get_server_stats``). Cada série é criada na primeira observação e fica em
+um dict indexado pela tupla de rótulos; registrar um valor é uma busca no
+dict, uma ``bisect`` nos limites dos buckets e algumas somas.
+
+Para medir o custo no caminho quente:
+    python metrics.py
+"""
+
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Iterable, Optional
+
+# Limites dos buckets de latência, em segundos
+DEFAULT_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Value:
+    """Série de um contador ou gauge."""
+
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, amount: float):
+        with self._lock:
+            self.value += amount
+
+
+class _Histogram:
+    """Série de um histograma: contagem por bucket, soma e total."""
+
+    __slots__ = ("bounds", "counts", "sum", "count", "_lock")
+
+    def __init__(self, bounds: tuple):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # o último é o bucket +Inf
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        i = bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Estimativa do quantil por interpolação linear dentro do bucket."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if n and seen + n >= rank:
+                if i == len(self.bounds):
+                    return self.bounds[-1]
+                lower = self.bounds[i - 1] if i else 0.0
+                return lower + (self.bounds[i] - lower) * (rank - seen) / n
+            seen += n
+        return self.bounds[-1]
+
+
+class Family:
+    """Métrica com nome, tipo e nomes de rótulos; uma série por combinação."""
+
+    def __init__(self, name: str, kind: str, help: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.kind = kind
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series: dict[tuple, object] = {}
+
+    def _get(self, values: tuple):
+        series = self._series.get(values)
+        if series is None:
+            series = _Histogram(self.buckets) if self.kind == "histogram" else _Value()
+            series = self._series.setdefault(values, series)
+        return series
+
+    def inc(self, *values):
+        self._get(values).add(1)
+
+    def dec(self, *values):
+        self._get(values).add(-1)
+
+    def add(self, amount: float, *values):
+        self._get(values).add(amount)
+
+    def set(self, value: float, *values):
+        self._get(values).value = value
+
+    def observe(self, value: float, *values):
+        self._get(values).observe(value)
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} {self.kind}"
+        for values, series in list(self._series.items()):
+            if self.kind != "histogram":
+                yield f"{self.name}{_format_labels(self.labels, values)} {_format_value(series.value)}"
+                continue
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), series.counts):
+                cumulative += n
+                le = f'le="{_format_value(bound)}"'
+                yield f"{self.name}_bucket{_format_labels(self.labels, values, le)} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labels, values)} {_format_value(series.sum)}"
+            yield f"{self.name}_count{_format_labels(self.labels, values)} {series.count}"
+
+    def snapshot(self) -> dict:
+        """Valores por série (rótulos unidos por '|'); histogramas viram resumos."""
+        result = {}
+        for values, series in list(self._series.items()):
+            key = "|".join(str(v) for v in values) or "total"
+            if self.kind != "histogram":
+                result[key] = series.value
+                continue
+            result[key] = {
+                "count": series.count,
+                "mean": series.sum / series.count if series.count else None,
+                "p50": series.quantile(0.5),
+                "p95": series.quantile(0.95),
+                "p99": series.quantile(0.99),
+            }
+        return result
+
+
+# Coletor: função chamada na exportação que devolve
+# [(nome, tipo, ajuda, nomes de rótulos, [(valores dos rótulos, valor), ...]), ...]
+Collector = Callable[[], Iterable[tuple]]
+
+
+class Metrics:
+    """Conjunto de métricas de um processo."""
+
+    def __init__(self):
+        self._families: dict[str, Family] = {}
+        self._collectors: list[Collector] = []
+
+    def _register(self, family: Family) -> Family:
+        if family.name in self._families:
+            raise ValueError(f"Métrica duplicada: '{family.name}'")
+        self._families[family.name] = family
+        return family
+
+    def counter(self, name: str, help: str, labels: tuple = ()) -> Family:
+        return self._register(Family(name, "counter", help, labels))
+
+    def gauge(self, name: str, help: str, labels: tuple = ()) -> Family:
+        return self._register(Family(name, "gauge", help, labels))
+
+    def histogram(self, name: str, help: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS) -> Family:
+        return self._register(Family(name, "histogram", help, labels, buckets))
+
+    def collector(self, func: Collector) -> Collector:
+        """Registra valores derivados, calculados só na exportação (ex: caches)."""
+        self._collectors.append(func)
+        return func
+
+    def _collected(self) -> list[Family]:
+        families = []
+        for collect in self._collectors:
+            for name, kind, help, labels, samples in collect():
+                family = Family(name, kind, help, labels)
+                for values, value in samples:
+                    family.set(value, *values)
+                families.append(family)
+        return families
+
+    def render(self) -> str:
+        """Texto no formato de exposição do Prometheus."""
+        lines = []
+        for family in list(self._families.values()) + self._collected():
+            lines.extend(family.render())
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> dict:
+        return {
+            family.name: family.snapshot()
+            for family in list(self._families.values()) + self._collected()
+        }
+
+
+def _benchmark(iterations: int = 200_000) -> dict:
+    """Custo médio, em microssegundos, das operações do caminho quente."""
+    metrics = Metrics()
+    latency = metrics.histogram("bench_seconds", "bench", ("tool",))
+    errors = metrics.counter("bench_errors_total", "bench", ("tool", "type"))
+    inflight = metrics.gauge("bench_in_flight", "bench", ("tool",))
+
+    def measure(func) -> float:
+        start = time.perf_counter()
+        for _ in range(iterations):
+            func()
+        return (time.perf_counter() - start) / iterations * 1e6
+
+    def tool_call():
+        inflight.inc("get_weather")
+        started = time.perf_counter()
+        inflight.dec("get_weather")
+        latency.observe(time.perf_counter() - started, "get_weather")
+
+    return {
+        "observe_us": measure(lambda: latency.observe(0.042, "get_weather")),
+        "inc_us": measure(lambda: errors.inc("get_weather", "TimeoutError")),
+        "tool_call_us": measure(tool_call),
+    }
+
+
+if __name__ == "__main__":
+    for name, value in _benchmark().items():
+        print(f"{name:>14}: {value:.2f} µs")
@@ -0,0 +1,424 @@
+"""
+Primitivas de resiliência para chamadas a serviços externos.
+"""
+
+import asyncio
+import heapq
+import itertools
+import math
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+from typing import Any, Awaitable, Callable, Optional
+
+# Estados do CircuitBreaker
+CIRCUIT_CLOSED = "closed"
+CIRCUIT_OPEN = "open"
+CIRCUIT_HALF_OPEN = "half_open"
+
+# Prioridades do QuotaScheduler (menor valor é atendido primeiro)
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 1
+PRIORITY_PREFETCH = 2
+
+
+class LatencyTracker:
+    """Janela deslizante das últimas latências observadas (em segundos)."""
+
+    def __init__(self, window: int = 200, min_samples: int = 20):
+        self.min_samples = min_samples
+        self._samples: deque[float] = deque(maxlen=window)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def record(self, seconds: float) -> None:
+        self._samples.append(seconds)
+
+    def percentile(self, q: float) -> Optional[float]:
+        """Percentil ``q`` (0-1) da janela, ou None com amostras insuficientes."""
+        if len(self._samples) < self.min_samples:
+            return None
+        ordered = sorted(self._samples)
+        index = min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))
+        return ordered[index]
+
+    def stats(self) -> dict:
+        return {
+            "samples": len(self._samples),
+            "p50": self.percentile(0.5),
+            "p95": self.percentile(0.95),
+            "p99": self.percentile(0.99),
+        }
+
+
+class HedgeBudget:
+    """Limita a fração das requisições recentes que podem ser duplicadas (hedged).
+
+    Cada requisição recebe um número em ``allow()``; o hedge, que só acontece
+    depois do atraso, marca a posição dessa requisição em ``spend(ticket)``.
+    Assim requisições concorrentes não marcam a posição umas das outras.
+    """
+
+    def __init__(self, fraction: float = 0.1, window: int = 200):
+        self.fraction = fraction
+        self._decisions: deque[bool] = deque(maxlen=window)
+        self._next_ticket = 0
+        self.requests = 0
+        self.hedged = 0
+
+    def _has_budget(self, extra: int = 0) -> bool:
+        return sum(self._decisions) < self.fraction * (len(self._decisions) + extra)
+
+    def allow(self) -> Optional[int]:
+        """Registra uma requisição; retorna o seu número se ela ainda cabe no
+        orçamento de hedge, senão None."""
+        allowed = self._has_budget(extra=1)
+        self._decisions.append(False)
+        ticket = self._next_ticket
+        self._next_ticket += 1
+        self.requests += 1
+        return ticket if allowed else None
+
+    def spend(self, ticket: int) -> bool:
+        """Marca a requisição ``ticket`` como hedged, se o orçamento ainda permitir.
+
+        O orçamento é conferido de novo aqui porque, durante o atraso do
+        hedge, outras requisições em andamento podem tê-lo gasto.
+        """
+        if not self._has_budget():
+            return False
+        position = ticket - (self._next_ticket - len(self._decisions))
+        if 0 <= position < len(self._decisions):
+            self._decisions[position] = True
+        self.hedged += 1
+        return True
+
+    def stats(self) -> dict:
+        return {
+            "fraction": self.fraction,
+            "requests": self.requests,
+            "hedged": self.hedged,
+            "recent_hedge_ratio": round(sum(self._decisions) / len(self._decisions), 4) if self._decisions else 0.0,
+        }
+
+
+class AllProvidersFailed(Exception):
+    """Nenhum dos provedores consultados respondeu com sucesso."""
+
+    def __init__(self, errors: dict[str, str]):
+        self.errors = errors
+        super().__init__("; ".join(f"{provider}: {error}" for provider, error in errors.items()))
+
+
+class CircuitOpenError(Exception):
+    """Chamada recusada porque o circuito do serviço está aberto."""
+
+    def __init__(self, name: str, retry_after: float):
+        self.name = name
+        self.retry_after = retry_after
+        super().__init__(
+            f"{name} temporariamente indisponível (circuito aberto, nova tentativa em {retry_after:.0f}s)"
+        )
+
+
+class CircuitBreaker:
+    """Disjuntor por serviço externo, acionado por taxa de erro e de lentidão.
+
+    Fechado, registra o resultado das últimas ``window`` chamadas; com pelo
+    menos ``min_calls`` resultados, abre se a fração de falhas passar de
+    ``failure_rate`` ou a de chamadas mais lentas que ``slow_call_seconds``
+    passar de ``slow_call_rate``. Aberto, recusa chamadas na hora
+    (CircuitOpenError) por ``open_seconds``; depois fica meio aberto e deixa
+    passar ``half_open_calls`` sondagens: se todas forem bem-sucedidas e
+    rápidas o circuito fecha, senão volta a abrir.
+
+    ``is_failure`` decide quais exceções contam como falha do serviço (ex:
+    um 404 é erro do chamador, não do upstream).
+    """
+
+    def __init__(
+        self,
+        name: str,
+        window: int = 20,
+        min_calls: int = 5,
+        failure_rate: float = 0.5,
+        slow_call_seconds: float = 5.0,
+        slow_call_rate: float = 0.8,
+        open_seconds: float = 30.0,
+        half_open_calls: int = 1,
+        is_failure: Callable[[BaseException], bool] = lambda error: True,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.name = name
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_rate = slow_call_rate
+        self.open_seconds = open_seconds
+        self.half_open_calls = half_open_calls
+        self.is_failure = is_failure
+        self._clock = clock
+
+        self.latency = LatencyTracker()
+        self._outcomes: deque[tuple[bool, bool]] = deque(maxlen=window)  # (falhou, lenta)
+        self._state = CIRCUIT_CLOSED
+        self._opened_at = 0.0
+        self._probes = 0
+        self._probe_successes = 0
+
+        self.rejected = 0
+        self.times_opened = 0
+
+    @property
+    def state(self) -> str:
+        if self._state == CIRCUIT_OPEN and self._clock() - self._opened_at >= self.open_seconds:
+            self._state = CIRCUIT_HALF_OPEN
+            self._probes = 0
+            self._probe_successes = 0
+        return self._state
+
+    def acquire(self) -> None:
+        """Autoriza uma chamada ou levanta CircuitOpenError."""
+        state = self.state
+        if state == CIRCUIT_CLOSED:
+            return
+        if state == CIRCUIT_HALF_OPEN and self._probes < self.half_open_calls:
+            self._probes += 1
+            return
+        self.rejected += 1
+        retry_after = max(0.0, self.open_seconds - (self._clock() - self._opened_at))
+        raise CircuitOpenError(self.name, retry_after)
+
+    def release(self) -> None:
+        """Devolve uma autorização cuja chamada foi abandonada sem resultado."""
+        if self._state == CIRCUIT_HALF_OPEN and self._probes > 0:
+            self._probes -= 1
+
+    def record_success(self, elapsed: float) -> None:
+        self.latency.record(elapsed)
+        self._record(False, elapsed >= self.slow_call_seconds)
+
+    def record_failure(self, elapsed: float) -> None:
+        self._record(True, elapsed >= self.slow_call_seconds)
+
+    def _record(self, failed: bool, slow: bool) -> None:
+        if self._state == CIRCUIT_HALF_OPEN:
+            if failed or slow:
+                self._open()
+                return
+            self._probe_successes += 1
+            if self._probe_successes >= self.half_open_calls:
+                self._state = CIRCUIT_CLOSED
+                self._outcomes.clear()
+            return
+
+        if self._state == CIRCUIT_OPEN:
+            return  # resultado de chamada iniciada antes de abrir
+
+        self._outcomes.append((failed, slow))
+        calls = len(self._outcomes)
+        if calls < self.min_calls:
+            return
+        failures = sum(1 for f, _ in self._outcomes if f)
+        slow_calls = sum(1 for _, s in self._outcomes if s)
+        if failures / calls >= self.failure_rate or slow_calls / calls >= self.slow_call_rate:
+            self._open()
+
+    def _open(self) -> None:
+        self._state = CIRCUIT_OPEN
+        self._opened_at = self._clock()
+        self._outcomes.clear()
+        self.times_opened += 1
+
+    async def call(self, factory: Callable[[], Awaitable[Any]]) -> Any:
+        """Executa ``factory()`` sob o disjuntor, registrando resultado e latência."""
+        self.acquire()
+        started = time.perf_counter()
+        try:
+            result = await factory()
+        except Exception as e:
+            if self.is_failure(e):
+                self.record_failure(time.perf_counter() - started)
+            else:
+                self.record_success(time.perf_counter() - started)
+            raise
+        except BaseException:
+            # Cancelamento não diz nada sobre a saúde do serviço
+            self.release()
+            raise
+        self.record_success(time.perf_counter() - started)
+        return result
+
+    def stats(self) -> dict:
+        calls = len(self._outcomes)
+        return {
+            "state": self.state,
+            "window_calls": calls,
+            "failure_rate": round(sum(1 for f, _ in self._outcomes if f) / calls, 4) if calls else 0.0,
+            "slow_call_rate": round(sum(1 for _, s in self._outcomes if s) / calls, 4) if calls else 0.0,
+            "times_opened": self.times_opened,
+            "rejected": self.rejected,
+            "latency": self.latency.stats(),
+        }
+
+
+class QuotaExceededError(Exception):
+    """Requisição descartada: a fila da cota não seria atendida a tempo."""
+
+    def __init__(self, name: str, wait: float, max_wait: float):
+        self.name = name
+        self.wait = wait
+        self.max_wait = max_wait
+        super().__init__(
+            f"Cota da API {name} esgotada no momento: a espera estimada ({wait:.1f}s) "
+            f"passa do limite de {max_wait:.0f}s. Tente novamente em instantes."
+        )
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Segundos indicados por um cabeçalho Retry-After (número ou data HTTP)."""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class QuotaScheduler:
+    """Token bucket com fila de prioridade para a cota de um serviço externo.
+
+    O balde recebe ``rate_per_minute`` fichas por minuto, até ``burst``.
+    Com ficha disponível (e ninguém na fila) a requisição segue na hora;
+    senão espera na fila, onde prioridades menores (interativas) passam na
+    frente de lotes e prefetch. Se a espera estimada passar de ``max_wait``
+    a requisição é descartada com QuotaExceededError em vez de enfileirar;
+    o mesmo prazo vale dentro da fila, para que um fluxo contínuo de
+    interativas não deixe lotes e prefetch esperando para sempre.
+    ``pause()`` suspende o balde, ex: ao receber um Retry-After.
+    ``rate_per_minute <= 0`` desativa o controle.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        rate_per_minute: float,
+        burst: Optional[float] = None,
+        max_wait: float = 10.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.name = name
+        self.rate = rate_per_minute / 60.0
+        self.burst = max(1.0, burst if burst is not None else rate_per_minute)
+        self.max_wait = max_wait
+        self._clock = clock
+
+        self._tokens = self.burst
+        self._updated = clock()
+        self._paused_until = 0.0
+        self._waiters: list[tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._dispatcher: Optional[asyncio.Task] = None
+
+        self.granted = 0
+        self.queued = 0
+        self.shed = 0
+        self.pauses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    def _refill(self) -> float:
+        now = self._clock()
+        # Durante uma pausa (_updated no futuro) o balde não acumula fichas
+        self._tokens = min(self.burst, self._tokens + max(0.0, now - self._updated) * self.rate)
+        self._updated = max(now, self._updated)
+        return now
+
+    def estimated_wait(self, position: int) -> float:
+        """Tempo até a ``position``-ésima requisição da fila ser atendida."""
+        now = self._refill()
+        paused = max(0.0, self._paused_until - now)
+        missing = position - self._tokens
+        return paused + (max(0.0, missing) / self.rate if missing > 0 else 0.0)
+
+    def _queue_position(self, priority: int) -> int:
+        return 1 + sum(1 for p, _, fut in self._waiters if p <= priority and not fut.done())
+
+    async def acquire(self, priority: int = PRIORITY_INTERACTIVE, max_wait: Optional[float] = None) -> None:
+        """Aguarda uma ficha ou levanta QuotaExceededError."""
+        if not self.enabled:
+            return
+        max_wait = self.max_wait if max_wait is None else max_wait
+
+        now = self._refill()
+        if not self._waiters and now >= self._paused_until and self._tokens >= 1:
+            self._tokens -= 1
+            self.granted += 1
+            return
+
+        wait = self.estimated_wait(self._queue_position(priority))
+        if wait > max_wait:
+            self.shed += 1
+            raise QuotaExceededError(self.name, wait, max_wait)
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+        self.queued += 1
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        try:
+            await asyncio.wait_for(future, max(0.0, max_wait - (self._clock() - now)))
+        except asyncio.TimeoutError:
+            # wait_for cancela o future: a entrada é ignorada pelo despachante
+            self.shed += 1
+            raise QuotaExceededError(self.name, self._clock() - now, max_wait) from None
+
+    async def _dispatch(self) -> None:
+        """Libera os que estão na fila, por prioridade, conforme as fichas chegam."""
+        while self._waiters:
+            now = self._refill()
+            if now < self._paused_until:
+                await asyncio.sleep(self._paused_until - now)
+                continue
+            if self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                continue
+            _, _, future = heapq.heappop(self._waiters)
+            if future.done():
+                continue
+            self._tokens -= 1
+            self.granted += 1
+            future.set_result(None)
+
+    def pause(self, seconds: float) -> None:
+        """Suspende a liberação de fichas (ex: o serviço respondeu 429 com Retry-After)."""
+        if not self.enabled or seconds <= 0:
+            return
+        self._refill()
+        self._paused_until = max(self._paused_until, self._clock() + seconds)
+        # Ao fim da pausa só uma requisição passa; as demais voltam a seguir a taxa
+        self._tokens = min(self._tokens, 1.0)
+        self._updated = self._paused_until
+        self.pauses += 1
+
+    def stats(self) -> dict:
+        self._refill()
+        return {
+            "rate_per_minute": self.rate * 60,
+            "burst": self.burst,
+            "tokens": round(self._tokens, 2),
+            "queue": sum(1 for _, _, fut in self._waiters if not fut.done()),
+            "paused_for": round(max(0.0, self._paused_until - self._clock()), 2),
+            "granted": self.granted,
+            "queued": self.queued,
+            "shed": self.shed,
+            "pauses": self.pauses,
+        }
@@ -5,12 +5,21 @@ Um servidor MCP avançado que conecta Claude/Gemini a APIs externas e sistemas l
 """
 
 import asyncio
+import codecs
+import functools
+import importlib
 import json
 import logging
 import os
+import re
+import stat
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import aclosing
+from itertools import islice
 from pathlib import Path
-from typing import Any, Optional
+from typing import Any, AsyncIterator, Optional
 
 import httpx
 from dotenv import load_dotenv
@@ -18,6 +27,53 @@ from mcp.server import Server
 from mcp.server.stdio import stdio_server
 from mcp.types import Tool, TextContent
 
+from cache import (
+    CACHE_FRESH,
+    CACHE_STALE,
+    AIResponseCache,
+    FileContentCache,
+    HotKeys,
+    SingleFlight,
+    TTLCache,
+)
+from cities import DEFAULT_CITY_LIST_PATH, City, CityIndex
+from countries import DEFAULT_SNAPSHOT_PATH, RESTCOUNTRIES_API_BASE, SNAPSHOT_FIELDS, CountryIndex, build_snapshot
+from files import (
+    SEARCH_EXCLUDED_DIRS,
+    FileMatches,
+    decode_cursor,
+    encode_cursor,
+    entry_is_dir,
+    entry_size,
+    list_page,
+    open_buffer,
+    read_range,
+    read_tail,
+    read_window,
+    search_file,
+    walk,
+    walk_page,
+)
+from forecast import PERIODS, ForecastSeries, Summary
+from metrics import Metrics
+from resilience import (
+    CIRCUIT_CLOSED,
+    CIRCUIT_HALF_OPEN,
+    CIRCUIT_OPEN,
+    PRIORITY_BATCH,
+    PRIORITY_INTERACTIVE,
+    PRIORITY_PREFETCH,
+    AllProvidersFailed,
+    CircuitBreaker,
+    CircuitOpenError,
+    HedgeBudget,
+    QuotaExceededError,
+    QuotaScheduler,
+    parse_retry_after,
+)
+from tools import ToolArgumentError, ToolFailure, ToolRegistry, ToolSpec, UnknownToolError
+from tracing import Tracer, detached_context
+
 # Configuração de logging
 logging.basicConfig(
     level=logging.INFO,
@@ -26,18 +82,10 @@ logging.basicConfig(
 logger = logging.getLogger("mcp-weather-server")
 
 try:
-    from openai import AsyncOpenAI
-    OPENAI_AVAILABLE = True
+    import h2  # noqa: F401  (suporte a HTTP/2 do httpx)
+    H2_AVAILABLE = True
 except ImportError:
-    OPENAI_AVAILABLE = False
-    logger.warning("OpenAI SDK não instalado")
-
-try:
-    from anthropic import AsyncAnthropic
-    ANTHROPIC_AVAILABLE = True
-except ImportError:
-    ANTHROPIC_AVAILABLE = False
-    logger.warning("Anthropic SDK não instalado")
+    H2_AVAILABLE = False
 
 
 # Carregar variáveis de ambiente
@@ -45,12 +93,130 @@ load_dotenv()
 
 # Configurações
 WEATHER_API_KEY = os.getenv("WEATHER_API_KEY", "")
-WEATHER_API_BASE = "https://api.openweathermap.org/data/2.5"
+WEATHER_API_BASE = os.getenv("WEATHER_API_BASE", "https://api.openweathermap.org/data/2.5")
+WEATHER_UNITS = "metric"
+WEATHER_LANG = "pt_br"
+
+# Cache de clima (segundos / número de entradas)
+WEATHER_CACHE_TTL = float(os.getenv("WEATHER_CACHE_TTL", "600"))
+WEATHER_CACHE_STALE_TTL = float(os.getenv("WEATHER_CACHE_STALE_TTL", "300"))
+WEATHER_CACHE_SIZE = int(os.getenv("WEATHER_CACHE_SIZE", "512"))
+
+# Consultas de clima em lote
+WEATHER_BATCH_MAX = int(os.getenv("WEATHER_BATCH_MAX", "500"))
+WEATHER_BATCH_CONCURRENCY = int(os.getenv("WEATHER_BATCH_CONCURRENCY", "10"))
+WEATHER_GROUP_SIZE = 20  # limite de IDs por chamada do endpoint /group
+
+# Previsão de 5 dias / 3 horas, guardada em colunas por cidade
+FORECAST_CACHE_TTL = float(os.getenv("FORECAST_CACHE_TTL", "1800"))
+FORECAST_CACHE_SIZE = int(os.getenv("FORECAST_CACHE_SIZE", "256"))
+FORECAST_COMPARE_MAX = 10
+
+# Lista de cidades da OpenWeatherMap (gere com: python cities.py --refresh)
+CITY_LIST_PATH = os.getenv("CITY_LIST_PATH", str(DEFAULT_CITY_LIST_PATH))
+CITY_AUTOCOMPLETE_LIMIT = 10
+
+# Prefetch das cidades mais consultadas: revalida as top-K antes de expirarem,
+# usando no máximo WEATHER_PREFETCH_QUOTA_SHARE da cota da OpenWeatherMap
+WEATHER_PREFETCH_ENABLED = os.getenv("WEATHER_PREFETCH_ENABLED", "true").lower() in ("1", "true", "yes")
+WEATHER_PREFETCH_TOP_K = int(os.getenv("WEATHER_PREFETCH_TOP_K", "50"))
+WEATHER_PREFETCH_MIN_HITS = int(os.getenv("WEATHER_PREFETCH_MIN_HITS", "3"))
+WEATHER_PREFETCH_INTERVAL = float(os.getenv("WEATHER_PREFETCH_INTERVAL", "30"))
+WEATHER_PREFETCH_LEAD = float(os.getenv("WEATHER_PREFETCH_LEAD", "60"))  # segundos antes de expirar
+WEATHER_PREFETCH_QUOTA_SHARE = float(os.getenv("WEATHER_PREFETCH_QUOTA_SHARE", "0.2"))
+
+# Leitura de arquivos (janela padrão e máxima, em bytes ou linhas)
+READ_FILE_DEFAULT_BYTES = 10000
+READ_FILE_DEFAULT_LINES = 200
+READ_FILE_MAX_BYTES = int(os.getenv("READ_FILE_MAX_BYTES", str(1024 * 1024)))
+
+# Pool de threads para operações de arquivo (tamanho e timeout em segundos)
+FILE_WORKERS = int(os.getenv("FILE_WORKERS", "4"))
+FILE_OP_TIMEOUT = float(os.getenv("FILE_OP_TIMEOUT", "30"))
+
+# Cache de conteúdo de arquivos (orçamento total e tamanho máximo por arquivo, em bytes)
+FILE_CACHE_MAX_BYTES = int(os.getenv("FILE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+FILE_CACHE_MAX_ENTRY_BYTES = int(os.getenv("FILE_CACHE_MAX_ENTRY_BYTES", str(1024 * 1024)))
+
+# Busca de conteúdo (threads, limite de resultados e tempo máximo em segundos)
+SEARCH_WORKERS = int(os.getenv("SEARCH_WORKERS", str(min(8, (os.cpu_count() or 2)))))
+SEARCH_MAX_RESULTS = 100
+SEARCH_TIMEOUT = float(os.getenv("SEARCH_TIMEOUT", "60"))
+
+# Listagem de diretórios
+LIST_DIR_PAGE_SIZE = 100
+LIST_DIR_MAX_PAGE_SIZE = 1000
+LIST_DIR_MAX_DEPTH = 10
+
+# Snapshot offline de países (idade máxima em segundos antes de voltar à API)
+COUNTRY_SNAPSHOT_PATH = os.getenv("COUNTRY_SNAPSHOT_PATH", str(DEFAULT_SNAPSHOT_PATH))
+COUNTRY_SNAPSHOT_MAX_AGE = float(os.getenv("COUNTRY_SNAPSHOT_MAX_AGE", str(30 * 24 * 3600)))
+COUNTRY_SNAPSHOT_RETRY = float(os.getenv("COUNTRY_SNAPSHOT_RETRY", "600"))  # intervalo entre tentativas de gerar
 
 # Configurações de IA
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
 OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
 ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY", "")
+ANTHROPIC_MODEL = os.getenv("ANTHROPIC_MODEL", "claude-3-5-sonnet-20241022")
+AI_TEMPERATURE = 0.7
+AI_MAX_TOKENS = 1000
+AI_PROVIDER_NAMES = {"openai": "OpenAI", "anthropic": "Anthropic"}
+# SDK de cada provedor (módulo, classe do cliente). Os SDKs levam mais tempo
+# para importar que o resto do servidor, então só são carregados no primeiro
+# uso de analyze_with_ai, e não na subida do processo
+AI_SDKS = {"openai": ("openai", "AsyncOpenAI"), "anthropic": ("anthropic", "AsyncAnthropic")}
+AI_SYSTEM_PROMPT = (
+    "Você é um assistente inteligente especializado em análise de dados, "
+    "clima, geografia e recomendações de viagem. Forneça respostas claras, "
+    "concisas e úteis em português."
+)
+
+# Cache persistente de respostas de IA (SQLite compartilhado entre processos)
+AI_CACHE_ENABLED = os.getenv("AI_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+AI_CACHE_PATH = os.getenv("AI_CACHE_PATH", str(Path(__file__).parent / "data" / "ai_cache.sqlite3"))
+AI_CACHE_TTL = float(os.getenv("AI_CACHE_TTL", str(24 * 3600)))
+AI_CACHE_MAX_ENTRIES = int(os.getenv("AI_CACHE_MAX_ENTRIES", "5000"))
+
+# Hedging entre provedores de IA: se a primária não responder até o percentil
+# observado da sua latência, a mesma requisição vai para a secundária
+AI_HEDGE_ENABLED = os.getenv("AI_HEDGE_ENABLED", "true").lower() in ("1", "true", "yes")
+AI_HEDGE_PERCENTILE = float(os.getenv("AI_HEDGE_PERCENTILE", "0.95"))
+AI_HEDGE_BUDGET = float(os.getenv("AI_HEDGE_BUDGET", "0.1"))  # fração máxima de requisições duplicadas
+AI_HEDGE_DEFAULT_DELAY = float(os.getenv("AI_HEDGE_DEFAULT_DELAY", "5"))  # até haver amostras suficientes
+AI_HEDGE_MIN_DELAY = float(os.getenv("AI_HEDGE_MIN_DELAY", "0.5"))
+
+# Disjuntores por serviço externo: abrem com muitas falhas ou chamadas lentas
+CIRCUIT_WINDOW = int(os.getenv("CIRCUIT_WINDOW", "20"))
+CIRCUIT_MIN_CALLS = int(os.getenv("CIRCUIT_MIN_CALLS", "5"))
+CIRCUIT_FAILURE_RATE = float(os.getenv("CIRCUIT_FAILURE_RATE", "0.5"))
+CIRCUIT_SLOW_CALL_RATE = float(os.getenv("CIRCUIT_SLOW_CALL_RATE", "0.8"))
+CIRCUIT_SLOW_CALL_SECONDS = float(os.getenv("CIRCUIT_SLOW_CALL_SECONDS", "3"))
+AI_CIRCUIT_SLOW_CALL_SECONDS = float(os.getenv("AI_CIRCUIT_SLOW_CALL_SECONDS", "30"))
+CIRCUIT_OPEN_SECONDS = float(os.getenv("CIRCUIT_OPEN_SECONDS", "30"))
+
+# Cotas das APIs externas (requisições por minuto; 0 = sem controle). Excesso
+# espera na fila por prioridade até QUOTA_MAX_WAIT segundos
+WEATHER_QUOTA_PER_MINUTE = float(os.getenv("WEATHER_QUOTA_PER_MINUTE", "60"))
+WEATHER_QUOTA_BURST = float(os.getenv("WEATHER_QUOTA_BURST", str(WEATHER_QUOTA_PER_MINUTE)))
+RESTCOUNTRIES_QUOTA_PER_MINUTE = float(os.getenv("RESTCOUNTRIES_QUOTA_PER_MINUTE", "0"))
+QUOTA_MAX_WAIT = float(os.getenv("QUOTA_MAX_WAIT", "10"))
+QUOTA_DEFAULT_BACKOFF = 1.0  # pausa após um 429 sem Retry-After
+
+# Cliente HTTP compartilhado com as APIs externas
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "10"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60"))
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "true").lower() in ("1", "true", "yes")
+HTTP_PREWARM = os.getenv("HTTP_PREWARM", "true").lower() in ("1", "true", "yes")
+
+# Rastreamento por chamada (JSONL); chamadas acima de TRACE_SLOW_SECONDS gravam
+# a árvore completa de spans e, com TRACE_PROFILE, um perfil do cProfile
+TRACE_ENABLED = os.getenv("TRACE_ENABLED", "false").lower() in ("1", "true", "yes")
+TRACE_PATH = os.getenv("TRACE_PATH", str(Path(__file__).parent / "data" / "traces.jsonl"))
+TRACE_SLOW_SECONDS = float(os.getenv("TRACE_SLOW_SECONDS", "2"))
+TRACE_PROFILE = os.getenv("TRACE_PROFILE", "false").lower() in ("1", "true", "yes")
 
 # Validações
 if not WEATHER_API_KEY:
@@ -64,155 +230,524 @@ elif ANTHROPIC_API_KEY:
     logger.info("Anthropic configurada como provedor único")
 
 
+# Ferramentas expostas via MCP e pelo dashboard (api.py)
+TOOLS = ToolRegistry([
+    ToolSpec(
+        name="get_weather",
+        description=(
+            "Obtém informações meteorológicas em tempo real para qualquer cidade. "
+            "Retorna temperatura, condições, umidade e velocidade do vento."
+        ),
+        input_schema={
+            "type": "object",
+            "properties": {
+                "city": {
+                    "type": "string",
+                    "description": "Nome da cidade (ex: 'São Paulo', 'New York') ou ID da OpenWeatherMap"
+                },
+                "country_code": {
+                    "type": "string",
+                    "description": "Código do país opcional (ex: 'BR', 'US')",
+                    "default": ""
+                }
+            },
+            "required": ["city"]
+        },
+        handler="_get_weather",
+        summary="Dados meteorológicos em tempo real"
+    ),
+    ToolSpec(
+        name="get_weather_batch",
+        description=(
+            "Obtém o clima atual de várias cidades em uma única chamada. "
+            "Falhas em cidades individuais são reportadas sem interromper o lote."
+        ),
+        input_schema={
+            "type": "object",
+            "properties": {
+                "cities": {
+                    "type": "array",
+                    "items": {"type": "string"},
+                    "maxItems": WEATHER_BATCH_MAX,
+                    "description": (
+                        "Lista de cidades no formato 'Cidade' ou 'Cidade,PAÍS' "
+                        "(ex: ['São Paulo,BR', 'Tokyo,JP']) ou IDs da OpenWeatherMap"
+                    )
+                },
+                "concurrency": {
+                    "type": "integer",
+                    "description": (
+                        "Número máximo de requisições simultâneas "
+                        f"(padrão e limite: {WEATHER_BATCH_CONCURRENCY})"
+                    ),
+                    "minimum": 1
+                }
+            },
+            "required": ["cities"]
+        },
+        handler="_get_weather_batch",
+        summary="Clima de várias cidades em uma única chamada"
+    ),
+    ToolSpec(
+        name="get_forecast",
+        description=(
+            "Previsão de 5 dias (passos de 3 horas) para uma cidade, com agregados "
+            "como máxima de amanhã ou horas de chuva na semana, e comparação entre "
+            "cidades. A previsão fica em cache: perguntas seguintes não consultam a API."
+        ),
+        input_schema={
+            "type": "object",
+            "properties": {
+                "city": {
+                    "type": "string",
+                    "description": "Nome da cidade ou ID da OpenWeatherMap"
+                },
+                "country_code": {
+                    "type": "string",
+                    "description": "Código do país opcional (ex: 'BR', 'US')",
+                    "default": ""
+                },
+                "period": {
+                    "type": "string",
+                    "enum": list(PERIODS),
+                    "description": "Período agregado: hoje, amanhã ou os próximos 5 dias",
+                    "default": "week"
+                },
+                "compare_with": {
+                    "type": "array",
+                    "items": {"type": "string"},
+                    "maxItems": FORECAST_COMPARE_MAX,
+                    "description": "Outras cidades ('Cidade' ou 'Cidade,PAÍS') para comparar no mesmo período"
+                }
+            },
+            "required": ["city"]
+        },
+        handler="_get_forecast",
+        summary="Previsão de 5 dias com agregados e comparação entre cidades"
+    ),
+    ToolSpec(
+        name="read_file",
+        description=(
+            "Lê o conteúdo de um arquivo local em janelas (bytes ou linhas), "
+            "sem carregar o arquivo inteiro. Suporta arquivos de texto "
+            "(txt, json, py, md, log, etc.) e paginação por cursor."
+        ),
+        input_schema={
+            "type": "object",
+            "properties": {
+                "file_path": {
+                    "type": "string",
+                    "description": "Caminho completo ou relativo do arquivo"
+                },
+                "offset": {
+                    "type": "integer",
+                    "description": "Posição inicial (em bytes ou linhas, conforme 'unit')",
+                    "default": 0,
+                    "minimum": 0
+                },
+                "length": {
+                    "type": "integer",
+                    "description": (
+                        f"Tamanho da janela (padrão: {READ_FILE_DEFAULT_BYTES} bytes "
+                        f"ou {READ_FILE_DEFAULT_LINES} linhas)"
+                    ),
+                    "minimum": 1
+                },
+                "unit": {
+                    "type": "string",
+                    "enum": ["bytes", "lines"],
+                    "description": "Unidade de 'offset' e 'length'",
+                    "default": "bytes"
+                },
+                "encoding": {
+                    "type": "string",
+                    "description": "Encoding do arquivo (ex: 'utf-8', 'latin-1')",
+                    "default": "utf-8"
+                },
+                "cursor": {
+                    "type": "string",
+                    "description": "Cursor de continuação retornado por uma leitura anterior"
+                },
+                "mode": {
+                    "type": "string",
+                    "enum": ["range", "head", "tail"],
+                    "description": (
+                        "'range' lê a janela indicada; 'head' e 'tail' leem as primeiras "
+                        "ou últimas 'length' linhas (ideal para logs)"
+                    ),
+                    "default": "range"
+                }
+            },
+            "required": ["file_path"]
+        },
+        handler="_read_file",
+        summary="Leitura segura de arquivos locais"
+    ),
+    ToolSpec(
+        name="list_directory",
+        description=(
+            "Lista arquivos e pastas de um diretório em páginas, opcionalmente de forma "
+            "recursiva e filtrando por glob. "
+            "Útil para explorar o sistema de arquivos antes de ler arquivos específicos."
+        ),
+        input_schema={
+            "type": "object",
+            "properties": {
+                "directory_path": {
+                    "type": "string",
+                    "description": "Caminho do diretório a ser listado"
+                },
+                "cursor": {
+                    "type": "string",
+                    "description": "Cursor de continuação retornado pela página anterior"
+                },
+                "page_size": {
+                    "type": "integer",
+                    "description": f"Itens por página (padrão {LIST_DIR_PAGE_SIZE}, máximo {LIST_DIR_MAX_PAGE_SIZE})",
+                    "minimum": 1
+                },
+                "recursive": {
+                    "type": "boolean",
+                    "description": "Inclui subdiretórios",
+                    "default": False
+                },
+                "max_depth": {
+                    "type": "integer",
+                    "description": f"Profundidade máxima na listagem recursiva (máximo {LIST_DIR_MAX_DEPTH})",
+                    "default": 3,
+                    "minimum": 1
+                },
+                "pattern": {
+                    "type": "string",
+                    "description": "Filtro glob (ex: '*.py'; com '/' compara o caminho relativo)"
+                }
+            },
+            "required": ["directory_path"]
+        },
+        handler="_list_directory",
+        summary="Navegação em diretórios locais"
+    ),
+    ToolSpec(
+        name="search_files",
+        description=(
+            "Procura um texto ou expressão regular no conteúdo dos arquivos de um "
+            "diretório (recursivamente), como o grep. Arquivos binários são ignorados. "
+            "Retorna os arquivos com mais ocorrências primeiro, com as linhas encontradas."
+        ),
+        input_schema={
+            "type": "object",
+            "properties": {
+                "directory_path": {
+                    "type": "string",
+                    "description": "Diretório raiz da busca"
+                },
+                "pattern": {
+                    "type": "string",
+                    "description": "Texto ou expressão regular a procurar"
+                },
+                "regex": {
+                    "type": "boolean",
+                    "description": "Interpreta 'pattern' como expressão regular",
+                    "default": False
+                },
+                "case_sensitive": {
+                    "type": "boolean",
+                    "description": "Diferencia maiúsculas de minúsculas",
+                    "default": False
+                },
+                "glob": {
+                    "type": "string",
+                    "description": "Filtro de nomes de arquivo (ex: '*.py')"
+                },
+                "max_results": {
+                    "type": "integer",
+                    "description": f"Máximo de linhas retornadas (padrão {SEARCH_MAX_RESULTS})",
+                    "minimum": 1
+                },
+                "max_depth": {
+                    "type": "integer",
+                    "description": f"Profundidade máxima (padrão e limite {LIST_DIR_MAX_DEPTH})",
+                    "minimum": 1
+                }
+            },
+            "required": ["directory_path", "pattern"]
+        },
+        handler="_search_files",
+        summary="Busca de texto ou regex no conteúdo dos arquivos"
+    ),
+    ToolSpec(
+        name="get_location_facts",
+        description=(
+            "Retorna fatos interessantes sobre um país, incluindo "
+            "população, capital, idiomas, moeda e região."
+        ),
+        input_schema={
+            "type": "object",
+            "properties": {
+                "country": {
+                    "type": "string",
+                    "description": "Nome do país (ex: 'Brasil', 'Japan')"
+                }
+            },
+            "required": ["country"]
+        },
+        handler="_get_location_facts",
+        summary="Informações geográficas de países"
+    ),
+    ToolSpec(
+        name="analyze_with_ai",
+        description=(
+            "Usa IA generativa (OpenAI primária, Anthropic fallback) para analisar, "
+            "responder perguntas complexas, fazer recomendações ou processar dados. "
+            "Ideal para análises de clima, interpretação de dados geográficos, sugestões de viagem, etc."
+        ),
+        input_schema={
+            "type": "object",
+            "properties": {
+                "prompt": {
+                    "type": "string",
+                    "description": "Pergunta ou prompt de análise"
+                },
+                "context": {
+                    "type": "string",
+                    "description": "Contexto adicional ou dados para análise (opcional)",
+                    "default": ""
+                },
+                "use_cache": {
+                    "type": "boolean",
+                    "description": "Reutiliza respostas anteriores idênticas (false força uma nova resposta)",
+                    "default": True
+                }
+            },
+            "required": ["prompt"]
+        },
+        handler="_analyze_with_ai",
+        summary="Análise inteligente com provedores de IA",
+        progress_handler="_analyze_with_progress"
+    ),
+    ToolSpec(
+        name="get_server_stats",
+        description=(
+            "Estatísticas do próprio servidor: latência (p50/p95/p99) e erros por ferramenta "
+            "e por serviço externo, chamadas em andamento, taxas de acerto dos caches, "
+            "bytes lidos de arquivos, disjuntores e cotas."
+        ),
+        input_schema={
+            "type": "object",
+            "properties": {
+                "section": {
+                    "type": "string",
+                    "enum": ["all", "metrics", "caches", "circuits", "quotas", "prometheus"],
+                    "description": "Parte das estatísticas ('prometheus' retorna o texto de /metrics)",
+                    "default": "all"
+                }
+            },
+            "required": []
+        },
+        handler="_get_server_stats",
+        summary="Latências, erros e caches do servidor"
+    )
+])
+
+
 class WeatherFilesServer:
     """Servidor MCP que oferece clima, arquivos e fatos geográficos."""
     
     def __init__(self):
         self.server = Server("weather-files-ai-server")
         self.http_client: Optional[httpx.AsyncClient] = None
+        self._prewarmed = False
         
-        # Configurar clientes de IA
-        self.openai_client: Optional[AsyncOpenAI] = None
-        self.anthropic_client: Optional[AsyncAnthropic] = None
+        # Cache de respostas da OpenWeatherMap
+        self.weather_cache = TTLCache(
+            maxsize=WEATHER_CACHE_SIZE,
+            ttl=WEATHER_CACHE_TTL,
+            stale_ttl=WEATHER_CACHE_STALE_TTL,
+        )
+        self._refreshing: set[tuple] = set()
         
-        if OPENAI_AVAILABLE and OPENAI_API_KEY:
-            self.openai_client = AsyncOpenAI(api_key=OPENAI_API_KEY)
-            
-        if ANTHROPIC_AVAILABLE and ANTHROPIC_API_KEY:
-            self.anthropic_client = AsyncAnthropic(api_key=ANTHROPIC_API_KEY)
+        # Previsões já baixadas (ForecastSeries por cidade)
+        self.forecast_cache = TTLCache(maxsize=FORECAST_CACHE_SIZE, ttl=FORECAST_CACHE_TTL)
+        self._background_tasks: set[asyncio.Task] = set()
+        
+        # Deduplicação de chamadas upstream idênticas em andamento
+        self._inflight = SingleFlight()
+        
+        # IDs de cidades aprendidos das respostas (permitem usar o endpoint /group)
+        self._city_ids: dict[tuple[str, str], int] = {}
+        
+        # Índice local de cidades (nome -> ID), carregado em segundo plano
+        self._city_index: Optional[CityIndex] = None
+        self._city_index_loaded = False
+        
+        # Popularidade das consultas de clima, para o prefetch
+        self.hot_cities = HotKeys(k=WEATHER_PREFETCH_TOP_K)
+        self._prefetch_task: Optional[asyncio.Task] = None
+        self.prefetch_runs = 0
+        self.prefetch_calls = 0
+        
+        # Operações de arquivo bloqueantes rodam fora do event loop
+        self._file_executor = ThreadPoolExecutor(
+            max_workers=FILE_WORKERS,
+            thread_name_prefix="mcp-files"
+        )
+        
+        # Conteúdo de arquivos lidos recentemente, validado por stat()
+        self.file_cache = FileContentCache(
+            max_bytes=FILE_CACHE_MAX_BYTES,
+            max_entry_bytes=FILE_CACHE_MAX_ENTRY_BYTES
+        )
+        
+        # Busca de conteúdo usa um pool separado para não disputar com read_file
+        self._search_executor = ThreadPoolExecutor(
+            max_workers=SEARCH_WORKERS,
+            thread_name_prefix="mcp-search"
+        )
+        
+        # Índice offline de países, carregado no primeiro uso
+        self._country_index: Optional[CountryIndex] = None
+        self._country_index_loaded = False
+        self._country_refresh_after = 0.0
+        
+        # Cache persistente de respostas de IA
+        self.ai_cache: Optional[AIResponseCache] = None
+        if AI_CACHE_ENABLED:
+            self.ai_cache = AIResponseCache(AI_CACHE_PATH, AI_CACHE_TTL, AI_CACHE_MAX_ENTRIES)
+        
+        # Disjuntor (e latências observadas) por serviço externo
+        self.breakers = {
+            name: CircuitBreaker(
+                name,
+                window=CIRCUIT_WINDOW,
+                min_calls=CIRCUIT_MIN_CALLS,
+                failure_rate=CIRCUIT_FAILURE_RATE,
+                slow_call_seconds=slow_call_seconds,
+                slow_call_rate=CIRCUIT_SLOW_CALL_RATE,
+                open_seconds=CIRCUIT_OPEN_SECONDS,
+                is_failure=self._is_upstream_failure,
+            )
+            for name, slow_call_seconds in (
+                ("openweathermap", CIRCUIT_SLOW_CALL_SECONDS),
+                ("restcountries", CIRCUIT_SLOW_CALL_SECONDS),
+                ("openai", AI_CIRCUIT_SLOW_CALL_SECONDS),
+                ("anthropic", AI_CIRCUIT_SLOW_CALL_SECONDS),
+            )
+        }
+        
+        # Cota de cada API externa, com fila por prioridade
+        self.quotas = {
+            "openweathermap": QuotaScheduler(
+                "OpenWeatherMap", WEATHER_QUOTA_PER_MINUTE, WEATHER_QUOTA_BURST, QUOTA_MAX_WAIT
+            ),
+            "restcountries": QuotaScheduler(
+                "RestCountries", RESTCOUNTRIES_QUOTA_PER_MINUTE, max_wait=QUOTA_MAX_WAIT
+            ),
+        }
+        
+        # Orçamento de hedging entre provedores de IA
+        self.hedge_budget = HedgeBudget(AI_HEDGE_BUDGET)
+        
+        # Métricas expostas em /metrics (api.py) e pela ferramenta get_server_stats
+        self.metrics = Metrics()
+        self.tool_latency = self.metrics.histogram(
+            "mcp_tool_duration_seconds", "Duração das chamadas de ferramentas", ("tool",)
+        )
+        self.tool_in_flight = self.metrics.gauge(
+            "mcp_tool_in_flight", "Chamadas de ferramentas em andamento", ("tool",)
+        )
+        self.tool_errors = self.metrics.counter(
+            "mcp_tool_errors_total", "Falhas nas chamadas de ferramentas (levantadas ou respondidas em texto), por tipo", ("tool", "type")
+        )
+        self.upstream_latency = self.metrics.histogram(
+            "mcp_upstream_duration_seconds", "Duração das chamadas a serviços externos", ("upstream",)
+        )
+        self.upstream_in_flight = self.metrics.gauge(
+            "mcp_upstream_in_flight", "Chamadas a serviços externos em andamento", ("upstream",)
+        )
+        self.upstream_errors = self.metrics.counter(
+            "mcp_upstream_errors_total", "Falhas nas chamadas a serviços externos, por tipo", ("upstream", "type")
+        )
+        self.file_bytes = self.metrics.counter(
+            "mcp_file_bytes_total", "Bytes lidos por read_file e listados por list_directory", ("tool",)
+        )
+        self.metrics.collector(self._collect_cache_metrics)
+        
+        # Traces por chamada de ferramenta, com as chamadas externas aninhadas
+        self.tracer = Tracer(TRACE_PATH, TRACE_ENABLED, TRACE_SLOW_SECONDS, TRACE_PROFILE)
+        
+        # Clientes de IA, criados no primeiro uso (None = provedor indisponível)
+        self._ai_clients: dict[str, Any] = {}
         
         self._setup_handlers()
     
+    @staticmethod
+    def _ai_api_key(provider: str) -> str:
+        return OPENAI_API_KEY if provider == "openai" else ANTHROPIC_API_KEY
+    
+    def _create_ai_client(self, provider: str) -> Any:
+        """Importa o SDK e cria o cliente (None sem chave ou sem o SDK); roda fora do event loop."""
+        api_key = self._ai_api_key(provider)
+        if not api_key:
+            return None
+        module_name, class_name = AI_SDKS[provider]
+        try:
+            module = importlib.import_module(module_name)
+        except ImportError:
+            logger.warning(f"{AI_PROVIDER_NAMES[provider]} SDK não instalado")
+            return None
+        return getattr(module, class_name)(api_key=api_key)
+    
+    async def _ai_client(self, provider: str) -> Any:
+        """Cliente do provedor, criado na primeira chamada em uma thread para que a
+        importação do SDK não trave o event loop (as outras ferramentas seguem respondendo)."""
+        if provider not in self._ai_clients:
+            async def load():
+                started = time.perf_counter()
+                client = await asyncio.to_thread(self._create_ai_client, provider)
+                logger.info(f"Cliente {AI_PROVIDER_NAMES[provider]} carregado em {time.perf_counter() - started:.2f}s")
+                return self._ai_clients.setdefault(provider, client)
+            
+            return await self._inflight.do(("ai-client", provider), load)
+        return self._ai_clients[provider]
+    
+    # Só os clientes já criados por _ai_client (None antes disso); nunca importam o SDK
+    @property
+    def openai_client(self) -> Any:
+        return self._ai_clients.get("openai")
+    
+    @openai_client.setter
+    def openai_client(self, client: Any):
+        self._ai_clients["openai"] = client
+    
+    @property
+    def anthropic_client(self) -> Any:
+        return self._ai_clients.get("anthropic")
+    
+    @anthropic_client.setter
+    def anthropic_client(self, client: Any):
+        self._ai_clients["anthropic"] = client
+    
     def _setup_handlers(self):
         """Configura os handlers do servidor MCP."""
         
         @self.server.list_tools()
         async def list_tools() -> list[Tool]:
             """Lista todas as ferramentas disponíveis."""
-            return [
-                Tool(
-                    name="get_weather",
-                    description=(
-                        "Obtém informações meteorológicas em tempo real para qualquer cidade. "
-                        "Retorna temperatura, condições, umidade e velocidade do vento."
-                    ),
-                    inputSchema={
-                        "type": "object",
-                        "properties": {
-                            "city": {
-                                "type": "string",
-                                "description": "Nome da cidade (ex: 'São Paulo', 'New York')"
-                            },
-                            "country_code": {
-                                "type": "string",
-                                "description": "Código do país opcional (ex: 'BR', 'US')",
-                                "default": ""
-                            }
-                        },
-                        "required": ["city"]
-                    }
-                ),
-                Tool(
-                    name="read_file",
-                    description=(
-                        "Lê o conteúdo de um arquivo local. "
-                        "Suporta arquivos de texto (txt, json, py, md, etc.)."
-                    ),
-                    inputSchema={
-                        "type": "object",
-                        "properties": {
-                            "file_path": {
-                                "type": "string",
-                                "description": "Caminho completo ou relativo do arquivo"
-                            }
-                        },
-                        "required": ["file_path"]
-                    }
-                ),
-                Tool(
-                    name="list_directory",
-                    description=(
-                        "Lista todos os arquivos e pastas em um diretório. "
-                        "Útil para explorar o sistema de arquivos antes de ler arquivos específicos."
-                    ),
-                    inputSchema={
-                        "type": "object",
-                        "properties": {
-                            "directory_path": {
-                                "type": "string",
-                                "description": "Caminho do diretório a ser listado"
-                            }
-                        },
-                        "required": ["directory_path"]
-                    }
-                ),
-                Tool(
-                    name="get_location_facts",
-                    description=(
-                        "Retorna fatos interessantes sobre um país, incluindo "
-                        "população, capital, idiomas, moeda e região."
-                    ),
-                    inputSchema={
-                        "type": "object",
-                        "properties": {
-                            "country": {
-                                "type": "string",
-                                "description": "Nome do país (ex: 'Brasil', 'Japan')"
-                            }
-                        },
-                        "required": ["country"]
-                    }
-                ),
-                Tool(
-                    name="analyze_with_ai",
-                    description=(
-                        "Usa IA generativa (OpenAI primária, Anthropic fallback) para analisar, "
-                        "responder perguntas complexas, fazer recomendações ou processar dados. "
-                        "Ideal para análises de clima, interpretação de dados geográficos, sugestões de viagem, etc."
-                    ),
-                    inputSchema={
-                        "type": "object",
-                        "properties": {
-                            "prompt": {
-                                "type": "string",
-                                "description": "Pergunta ou prompt de análise"
-                            },
-                            "context": {
-                                "type": "string",
-                                "description": "Contexto adicional ou dados para análise (opcional)",
-                                "default": ""
-                            }
-                        },
-                        "required": ["prompt"]
-                    }
-                )
-            ]
+            return TOOLS.mcp_tools
         
-        @self.server.call_tool()
+        # Os argumentos são validados pelo registro (TOOLS), com os modelos
+        # compilados na importação, em vez de um jsonschema a cada chamada
+        @self.server.call_tool(validate_input=False)
         async def call_tool(name: str, arguments: Any) -> list[TextContent]:
             """Executa uma ferramenta específica."""
             try:
-                if name == "get_weather":
-                    result = await self._get_weather(
-                        arguments.get("city"),
-                        arguments.get("country_code", "")
-                    )
-                elif name == "read_file":
-                    result = await self._read_file(arguments.get("file_path"))
-                elif name == "list_directory":
-                    result = await self._list_directory(arguments.get("directory_path"))
-                elif name == "get_location_facts":
-                    result = await self._get_location_facts(arguments.get("country"))
-                elif name == "analyze_with_ai":
-                    result = await self._analyze_with_ai(
-                        arguments.get("prompt"),
-                        arguments.get("context", "")
-                    )
-                else:
-                    result = f"Erro: Ferramenta '{name}' não encontrada"
-                
+                result = await self.execute_tool(name, arguments, self._progress_reporter())
                 return [TextContent(type="text", text=result)]
             
+            except UnknownToolError as e:
+                return [TextContent(type="text", text=f"Erro: {e}")]
+            except ToolArgumentError as e:
+                return [TextContent(type="text", text=f" {e}")]
             except Exception as e:
                 logger.error(f"Erro ao executar {name}: {str(e)}", exc_info=True)
                 return [TextContent(
@@ -220,30 +755,82 @@ class WeatherFilesServer:
                     text=f"Erro ao executar {name}: {str(e)}"
                 )]
     
+    async def execute_tool(self, name: str, arguments: Optional[dict], progress=None) -> str:
+        """Valida os argumentos e executa a ferramenta registrada em TOOLS.
+        
+        Levanta UnknownToolError ou ToolArgumentError antes de qualquer I/O.
+        Com ``progress`` (função assíncrona que recebe um texto), ferramentas
+        com ``progress_handler`` enviam o resultado parcial por ela.
+        """
+        spec = TOOLS.get(name)
+        self.tool_in_flight.inc(name)
+        started = time.perf_counter()
+        try:
+            with self.tracer.span(f"tool {name}"):
+                kwargs = spec.validate(arguments)
+                if progress is not None and spec.progress_handler:
+                    with self.tracer.span(spec.progress_handler):
+                        result = await getattr(self, spec.progress_handler)(progress, **kwargs)
+                else:
+                    with self.tracer.span(spec.handler):
+                        result = await getattr(self, spec.handler)(**kwargs)
+            # Falhas tratadas pelo handler voltam como texto, com o tipo do erro
+            if isinstance(result, ToolFailure):
+                self.tool_errors.inc(name, result.error_type)
+            return result
+        except Exception as e:
+            self.tool_errors.inc(name, type(e).__name__)
+            raise
+        finally:
+            self.tool_in_flight.dec(name)
+            self.tool_latency.observe(time.perf_counter() - started, name)
+    
+    def _progress_token(self):
+        """progressToken da requisição MCP atual, se o cliente pediu progresso."""
+        try:
+            meta = self.server.request_context.meta
+        except LookupError:
+            return None
+        return getattr(meta, "progressToken", None) if meta else None
+    
+    def _progress_reporter(self):
+        """Função que envia notificações de progresso MCP, se o cliente pediu."""
+        progress_token = self._progress_token()
+        if progress_token is None:
+            return None
+        session = self.server.request_context.session
+        sent = 0  # o progresso MCP precisa crescer a cada notificação
+        
+        async def report(message: str):
+            nonlocal sent
+            sent += 1
+            await session.send_progress_notification(progress_token, sent, message=message)
+        
+        return report
+    
+    async def _analyze_with_progress(
+        self, report, prompt: str, context: str = "", use_cache: bool = True
+    ) -> str:
+        """Executa analyze_with_ai em streaming, enviando cada trecho por
+        ``report``, e retorna o texto final."""
+        async for event in self._stream_analysis(prompt, context, use_cache):
+            if event["type"] == "delta":
+                await report(event["text"])
+            elif event["type"] == "fallback":
+                await report(f"\n[{event['error']}; usando {event['provider']}]\n")
+            elif event["type"] == "done":
+                return event["result"]
+            elif event["type"] == "error":
+                return ToolFailure(event["message"], event["error_type"]) if "error_type" in event else event["message"]
+        return " A análise terminou sem resposta."
+    
     async def _get_weather(self, city: str, country_code: str = "") -> str:
         """Obtém dados meteorológicos da OpenWeatherMap."""
         if not WEATHER_API_KEY:
             return "WEATHER_API_KEY não configurada. Configure a variável de ambiente."
         
         try:
-            # Construir query
-            query = f"{city},{country_code}" if country_code else city
-            
-            # Fazer requisição
-            url = f"{WEATHER_API_BASE}/weather"
-            params = {
-                "appid": WEATHER_API_KEY,
-                "q": query,
-                "units": "metric",
-                "lang": "pt_br"
-            }
-            
-            if not self.http_client:
-                self.http_client = httpx.AsyncClient(timeout=10.0)
-            
-            response = await self.http_client.get(url, params=params)
-            response.raise_for_status()
-            data = response.json()
+            data = await self._weather_data(city, country_code)
             
             # Processar dados
             name = data.get("name", city)
@@ -278,57 +865,748 @@ Localização: {name}, {country}
             logger.info(f"Clima obtido com sucesso para {city}")
             return result
         
-        except httpx.HTTPStatusError as e:
-            if e.response.status_code == 404:
-                return f" Cidade '{city}' não encontrada no OpenWeatherMap. Verifique o nome."
-            return f" Erro na API OpenWeatherMap (HTTP {e.response.status_code})"
         except Exception as e:
-            logger.error(f"Erro ao obter clima: {str(e)}")
-            return f" Erro ao obter clima: {str(e)}"
+            return self._weather_error(e, city)
+    
+    @staticmethod
+    def _weather_error(error: Exception, city: str) -> ToolFailure:
+        """Converte uma falha de consulta de clima em mensagem para o usuário."""
+        if isinstance(error, httpx.HTTPStatusError):
+            if error.response.status_code == 404:
+                return ToolFailure(f" Cidade '{city}' não encontrada no OpenWeatherMap. Verifique o nome.", error)
+            if error.response.status_code == 429:
+                return ToolFailure(" Cota da API OpenWeatherMap excedida (HTTP 429). Tente novamente em instantes.", error)
+            return ToolFailure(f" Erro na API OpenWeatherMap (HTTP {error.response.status_code})", error)
+        if isinstance(error, (QuotaExceededError, CircuitOpenError)):
+            logger.warning(f"Clima de {city} recusado: {str(error)}")
+            return ToolFailure(f" {str(error)}", error)
+        logger.error(f"Erro ao obter clima: {str(error)}")
+        return ToolFailure(f" Erro ao obter clima: {str(error)}", error)
+    
+    @staticmethod
+    def _weather_key(city: str, country_code: str = "") -> tuple[str, str, str, str]:
+        """Chave normalizada do cache de clima: (cidade, país, unidades, idioma).
+        
+        Um ID numérico de cidade já identifica o país, então o código é descartado."""
+        city = " ".join((city or "").split()).casefold()
+        return (
+            city,
+            "" if city.isdigit() else (country_code or "").strip().upper(),
+            WEATHER_UNITS,
+            WEATHER_LANG,
+        )
+    
+    async def _weather_data(self, city: str, country_code: str = "") -> dict:
+        """Retorna o JSON da OpenWeatherMap, servindo do cache quando possível."""
+        key = self._weather_key(city, country_code)
+        self.hot_cities.add(key)
+        
+        # Serviço fora do ar: qualquer resposta já vista é melhor que esperar o timeout
+        if self.breakers["openweathermap"].state == CIRCUIT_OPEN:
+            data = self.weather_cache.peek(key)
+            if data is not None:
+                logger.warning(f"OpenWeatherMap indisponível; servindo clima antigo de {city}")
+                return data
+        
+        data, state = self.weather_cache.get(key)
+        
+        if state == CACHE_FRESH:
+            return data
+        
+        if state == CACHE_STALE:
+            # Serve o valor antigo imediatamente e revalida em segundo plano
+            self._refresh_weather_in_background(key)
+            return data
+        
+        return await self._load_weather(key)
+    
+    async def _load_weather(self, key: tuple[str, str, str, str], priority: int = PRIORITY_INTERACTIVE) -> dict:
+        """Busca o clima e atualiza o cache, compartilhando chamadas concorrentes."""
+        async def load():
+            data = await self._fetch_weather(key, priority)
+            self._store_weather(key, data)
+            return data
+        
+        return await self._inflight.do(("weather", key), load)
+    
+    async def _fetch_weather(self, key: tuple[str, str, str, str], priority: int = PRIORITY_INTERACTIVE) -> dict:
+        """Consulta a OpenWeatherMap (sem cache)."""
+        city, country_code, units, lang = key
+        
+        url = f"{WEATHER_API_BASE}/weather"
+        params = {
+            "appid": WEATHER_API_KEY,
+            "units": units,
+            "lang": lang
+        }
+        city_id = self._resolve_city_id(key)
+        if city_id is not None:
+            params["id"] = city_id
+        else:
+            params["q"] = f"{city},{country_code}" if country_code else city
+        
+        return await self._get_json("openweathermap", url, params, priority)
+    
+    def _store_weather(self, key: tuple[str, str, str, str], data: dict):
+        """Grava uma resposta no cache e memoriza o ID da cidade."""
+        self.weather_cache.set(key, data)
+        if data.get("id"):
+            self._city_ids[key[:2]] = data["id"]
+    
+    def _resolve_city_id(self, key: tuple[str, str, str, str]) -> Optional[int]:
+        """ID da OpenWeatherMap para a chave: a própria consulta, um ID já
+        aprendido de uma resposta ou o índice local de cidades (sem ambiguidade)."""
+        city, country_code = key[:2]
+        if city.isdigit():
+            return int(city)
+        city_id = self._city_ids.get((city, country_code))
+        if city_id is None and self._city_index is not None:
+            match = self._city_index.resolve(city, country_code)
+            if match is not None:
+                city_id = self._city_ids[(city, country_code)] = match.id
+        return city_id
+    
+    async def _get_city_index(self) -> Optional[CityIndex]:
+        """Carrega a lista de cidades uma única vez, fora do event loop."""
+        if not self._city_index_loaded:
+            async def load():
+                index = await self._run_file_op(CityIndex.load, CITY_LIST_PATH, timeout=120.0)
+                self._city_index, self._city_index_loaded = index, True
+                return index
+            
+            return await self._inflight.do(("cities",), load)
+        return self._city_index
+    
+    async def autocomplete_cities(
+        self, prefix: str, limit: int = CITY_AUTOCOMPLETE_LIMIT, country: str = ""
+    ) -> Optional[list[City]]:
+        """Sugestões de cidades pelo início do nome; None sem lista de cidades."""
+        index = await self._get_city_index()
+        if index is None:
+            return None
+        return index.complete(prefix, max(1, min(int(limit), 50)), country)
+    
+    @staticmethod
+    def _parse_city_spec(spec: Any) -> tuple[str, str]:
+        """Interpreta 'Cidade', 'Cidade,PAÍS' ou {'city': ..., 'country_code': ...}."""
+        if isinstance(spec, dict):
+            return str(spec.get("city", "")), str(spec.get("country_code", "") or "")
+        spec = str(spec).strip()
+        if "," in spec:
+            city, code = spec.rsplit(",", 1)
+            code = code.strip()
+            if len(code) == 2 and code.isalpha():
+                return city.strip(), code
+        return spec, ""
+    
+    async def _get_weather_batch(self, cities: Any, concurrency: Optional[int] = None) -> str:
+        """Obtém o clima de várias cidades com concorrência limitada."""
+        if not WEATHER_API_KEY:
+            return "WEATHER_API_KEY não configurada. Configure a variável de ambiente."
+        
+        # O dashboard envia as cidades como texto separado por ';' ou quebra de linha
+        if isinstance(cities, str):
+            cities = [c for c in cities.replace("\n", ";").split(";") if c.strip()]
+        if not cities:
+            return " Informe ao menos uma cidade."
+        if len(cities) > WEATHER_BATCH_MAX:
+            return f" Lote muito grande: {len(cities)} cidades (máximo {WEATHER_BATCH_MAX})."
+        
+        limit = min(int(concurrency or WEATHER_BATCH_CONCURRENCY), WEATHER_BATCH_CONCURRENCY)
+        semaphore = asyncio.Semaphore(max(1, limit))
+        
+        specs = [self._parse_city_spec(c) for c in cities]
+        keys = [self._weather_key(city, code) for city, code in specs]
+        results: dict[tuple, Any] = {}
+        
+        # 1. Servir o que já está em cache
+        for key in dict.fromkeys(keys):
+            self.hot_cities.add(key)
+            data, state = self.weather_cache.get(key)
+            if state == CACHE_STALE:
+                self._refresh_weather_in_background(key)
+            if data is not None:
+                results[key] = data
+        
+        # 2. Cidades com ID conhecido vão em grupos pelo endpoint /group
+        pending = [k for k in dict.fromkeys(keys) if k not in results]
+        by_id: dict[int, list[tuple]] = {}
+        for key in pending:
+            city_id = self._resolve_city_id(key)
+            if city_id is not None:
+                by_id.setdefault(city_id, []).append(key)
+        
+        async def fetch_group(ids: list[int]):
+            async with semaphore:
+                try:
+                    items = await self._fetch_weather_group(ids)
+                except Exception as e:
+                    logger.warning(f"Endpoint /group falhou, consultando individualmente: {str(e)}")
+                    return
+            for data in items:
+                for key in by_id.get(data.get("id"), []):
+                    self._store_weather(key, data)
+                    results[key] = data
+        
+        ids = list(by_id)
+        await asyncio.gather(*[
+            fetch_group(ids[i:i + WEATHER_GROUP_SIZE])
+            for i in range(0, len(ids), WEATHER_GROUP_SIZE)
+        ])
+        
+        # 3. O restante (ou o que o /group não retornou) é consultado individualmente
+        async def fetch_one(key: tuple):
+            async with semaphore:
+                try:
+                    results[key] = await self._load_weather(key, PRIORITY_BATCH)
+                except Exception as e:
+                    results[key] = e
+        
+        await asyncio.gather(*[fetch_one(k) for k in pending if k not in results])
+        
+        # Formatar resultado na ordem pedida
+        lines = [f"**Clima em lote ({len(keys)} cidades)**\n"]
+        failures = 0
+        for (city, _), key in zip(specs, keys):
+            data = results.get(key)
+            if isinstance(data, Exception) or data is None:
+                failures += 1
+                message = self._weather_error(data, city) if data else " Sem resposta"
+                lines.append(f"- {city}:{message}")
+                continue
+            
+            main = data.get("main", {})
+            weather = (data.get("weather") or [{}])[0]
+            country = data.get("sys", {}).get("country", "")
+            lines.append(
+                f"- {data.get('name', city)}, {country}: {main.get('temp')}°C, "
+                f"{weather.get('description', 'N/A')}, umidade {main.get('humidity')}%, "
+                f"vento {data.get('wind', {}).get('speed')} m/s"
+            )
+        
+        lines.append(f"\nResumo: {len(keys) - failures} com sucesso, {failures} com falha")
+        logger.info(f"Clima em lote obtido para {len(keys)} cidades ({failures} falhas)")
+        return "\n".join(lines)
+    
+    async def _fetch_weather_group(self, ids: list[int], priority: int = PRIORITY_BATCH) -> list[dict]:
+        """Consulta várias cidades por ID em uma única chamada (/group)."""
+        url = f"{WEATHER_API_BASE}/group"
+        params = {
+            "appid": WEATHER_API_KEY,
+            "id": ",".join(str(i) for i in ids),
+            "units": WEATHER_UNITS,
+            "lang": WEATHER_LANG
+        }
+        
+        data = await self._get_json("openweathermap", url, params, priority)
+        return data.get("list", [])
+    
+    def _refresh_weather_in_background(self, key: tuple[str, str, str, str]):
+        """Agenda a revalidação de uma entrada velha do cache de clima."""
+        if key in self._refreshing:
+            return
+        self._refreshing.add(key)
+        self._spawn(self._refresh_weather(key))
+    
+    def _spawn(self, coro) -> asyncio.Task:
+        """Agenda uma tarefa de segundo plano, cancelada em cleanup().
+        
+        A tarefa roda fora do trace de quem a criou (que pode terminar antes);
+        revalidações e rodadas de prefetch abrem o seu próprio trace.
+        """
+        task = detached_context().run(asyncio.create_task, coro)
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+        return task
+    
+    async def _refresh_weather(self, key: tuple[str, str, str, str]):
+        try:
+            with self.tracer.span("refresh weather", city=key[0]):
+                await self._load_weather(key, PRIORITY_PREFETCH)
+        except Exception as e:
+            logger.warning(f"Falha ao revalidar clima de {key[0]}: {str(e)}")
+        finally:
+            self._refreshing.discard(key)
+    
+    async def _prefetch_loop(self):
+        """Revalida periodicamente as cidades mais consultadas."""
+        while True:
+            await asyncio.sleep(WEATHER_PREFETCH_INTERVAL)
+            try:
+                with self.tracer.span("prefetch weather"):
+                    await self._prefetch_hot_cities()
+            except Exception as e:
+                logger.warning(f"Prefetch de clima falhou: {str(e)}")
+    
+    async def _prefetch_hot_cities(self) -> int:
+        """Atualiza as cidades quentes cuja entrada expira em breve (ou já saiu do cache).
+        
+        Cidades com ID conhecido são agrupadas no endpoint /group (até 20 por
+        chamada). O número de chamadas por rodada é limitado pela fração
+        WEATHER_PREFETCH_QUOTA_SHARE da cota. Retorna as chamadas feitas.
+        """
+        quota = self.quotas["openweathermap"]
+        if quota.enabled:
+            budget = int(quota.rate * WEATHER_PREFETCH_INTERVAL * WEATHER_PREFETCH_QUOTA_SHARE)
+        else:
+            budget = WEATHER_PREFETCH_TOP_K
+        
+        due = []
+        for key, _ in self.hot_cities.top(WEATHER_PREFETCH_TOP_K, WEATHER_PREFETCH_MIN_HITS):
+            age = self.weather_cache.age(key)
+            if key not in self._refreshing and (age is None or age >= self.weather_cache.ttl - WEATHER_PREFETCH_LEAD):
+                due.append(key)
+        
+        by_id: dict[int, list[tuple]] = {}
+        singles = []
+        for key in due:
+            city_id = self._resolve_city_id(key)
+            if city_id is not None:
+                by_id.setdefault(city_id, []).append(key)
+            else:
+                singles.append(key)
+        
+        async def refresh_group(ids: list[int]):
+            try:
+                items = await self._fetch_weather_group(ids, PRIORITY_PREFETCH)
+            except Exception as e:
+                logger.warning(f"Prefetch por /group falhou: {str(e)}")
+                return
+            for data in items:
+                for key in by_id.get(data.get("id"), []):
+                    self._store_weather(key, data)
+        
+        # Chamadas além do orçamento ficam para a próxima rodada
+        ids = list(by_id)
+        groups = [ids[i:i + WEATHER_GROUP_SIZE] for i in range(0, len(ids), WEATHER_GROUP_SIZE)][:budget]
+        singles = singles[:max(0, budget - len(groups))]
+        self._refreshing.update(singles)
+        calls = [refresh_group(group) for group in groups] + [self._refresh_weather(key) for key in singles]
+        
+        await asyncio.gather(*calls)
+        self.prefetch_runs += 1
+        self.prefetch_calls += len(calls)
+        if calls:
+            logger.info(f"Prefetch de clima: {len(due)} cidades em {len(calls)} chamadas")
+        return len(calls)
+    
+    async def _get_forecast(
+        self, city: str, country_code: str = "", period: str = "week", compare_with: Any = None
+    ) -> str:
+        """Previsão agregada de uma cidade (ou comparação entre cidades)."""
+        if not WEATHER_API_KEY:
+            return "WEATHER_API_KEY não configurada. Configure a variável de ambiente."
+        if period not in PERIODS:
+            return f" Período inválido: '{period}'. Use: {', '.join(PERIODS)}"
+        
+        if isinstance(compare_with, str):
+            compare_with = [c for c in compare_with.replace("\n", ";").split(";") if c.strip()]
+        specs = [(city, country_code)] + [self._parse_city_spec(c) for c in compare_with or []]
+        if len(specs) > FORECAST_COMPARE_MAX + 1:
+            return f" Muitas cidades para comparar (máximo {FORECAST_COMPARE_MAX})."
+        
+        results = await asyncio.gather(
+            *(self._forecast_data(name, code) for name, code in specs), return_exceptions=True
+        )
+        
+        if len(specs) == 1:
+            series = results[0]
+            if isinstance(series, Exception):
+                return self._weather_error(series, city)
+            return self._format_forecast(series, period)
+        return self._format_forecast_comparison(specs, results, period)
+    
+    async def _forecast_data(self, city: str, country_code: str = "") -> ForecastSeries:
+        """Previsão da cidade, baixada no máximo uma vez por FORECAST_CACHE_TTL."""
+        key = self._weather_key(city, country_code)
+        series, state = self.forecast_cache.get(key)
+        if state == CACHE_FRESH:
+            return series
+        
+        async def load():
+            params = {"appid": WEATHER_API_KEY, "units": WEATHER_UNITS, "lang": WEATHER_LANG}
+            city_id = self._resolve_city_id(key)
+            if city_id is not None:
+                params["id"] = city_id
+            else:
+                params["q"] = f"{key[0]},{key[1]}" if key[1] else key[0]
+            data = await self._get_json("openweathermap", f"{WEATHER_API_BASE}/forecast", params)
+            series = ForecastSeries.from_owm(data)
+            self.forecast_cache.set(key, series)
+            if series.city_id:
+                self._city_ids[key[:2]] = series.city_id
+            return series
+        
+        return await self._inflight.do(("forecast", key), load)
+    
+    @staticmethod
+    def _format_summary(summary: Summary) -> str:
+        return (
+            f"{summary.temp_min:.1f}–{summary.temp_max:.1f}°C, "
+            f"chuva {summary.rain_mm:.1f} mm ({summary.rain_hours}h), "
+            f"vento até {summary.wind_max:.1f} m/s"
+        )
+    
+    def _format_forecast(self, series: ForecastSeries, period: str) -> str:
+        start, end = series.period_bounds(period)
+        summary = series.summary(start, end)
+        if not summary.points:
+            return f" Sem previsão para {series.name} no período '{PERIODS[period]}'."
+        
+        lines = [
+            f"**Previsão para {series.name}, {series.country} ({PERIODS[period]})**",
+            "",
+            f"- Máxima: {summary.temp_max:.1f}°C",
+            f"- Mínima: {summary.temp_min:.1f}°C",
+            f"- Média: {summary.temp_mean:.1f}°C",
+            f"- Umidade média: {summary.humidity_mean:.0f}%",
+            f"- Vento máximo: {summary.wind_max:.1f} m/s",
+            f"- Chuva: {summary.rain_mm:.1f} mm em {summary.rain_hours}h "
+            f"(probabilidade máxima {summary.pop_max:.0%})",
+        ]
+        days = series.daily(start, end)
+        if len(days) > 1:
+            lines += ["", "**Por dia**"]
+            lines += [f"- {day:%d/%m}: {self._format_summary(day_summary)}" for day, day_summary in days]
+        return "\n".join(lines)
+    
+    def _format_forecast_comparison(self, specs: list[tuple[str, str]], results: list, period: str) -> str:
+        rows = []
+        errors = []
+        for (city, _), series in zip(specs, results):
+            if isinstance(series, Exception):
+                errors.append(f"- {city}:{self._weather_error(series, city)}")
+                continue
+            summary = series.summary(*series.period_bounds(period))
+            if summary.points:
+                rows.append((f"{series.name}, {series.country}", summary))
+        
+        rows.sort(key=lambda row: row[1].temp_max, reverse=True)
+        lines = [
+            f"**Comparação de previsão ({PERIODS[period]})**",
+            "",
+            "| Cidade | Mín (°C) | Máx (°C) | Média (°C) | Chuva (mm) | Horas de chuva |",
+            "|---|---|---|---|---|---|",
+        ]
+        lines += [
+            f"| {label} | {s.temp_min:.1f} | {s.temp_max:.1f} | {s.temp_mean:.1f} | {s.rain_mm:.1f} | {s.rain_hours} |"
+            for label, s in rows
+        ]
+        if errors:
+            lines += ["", "**Falhas**"] + errors
+        return "\n".join(lines)
+    
+    def cache_stats(self) -> dict:
+        """Contadores dos caches do servidor."""
+        return {
+            "weather": self.weather_cache.stats(),
+            "forecast": self.forecast_cache.stats(),
+            "inflight": self._inflight.stats(),
+            "files": self.file_cache.stats(),
+            "ai": self.ai_cache.stats() if self.ai_cache else None,
+            "hot_cities": {
+                **self.hot_cities.stats(),
+                "prefetch_runs": self.prefetch_runs,
+                "prefetch_calls": self.prefetch_calls,
+            },
+        }
+    
+    def ai_stats(self) -> dict:
+        """Latências por provedor de IA e uso do orçamento de hedging."""
+        return {
+            "hedge_enabled": AI_HEDGE_ENABLED,
+            "hedge": self.hedge_budget.stats(),
+            "latency": {provider: self.breakers[provider].latency.stats() for provider in ("openai", "anthropic")},
+        }
+    
+    def _collect_cache_metrics(self) -> list[tuple]:
+        """Acertos, falhas e taxa de acerto dos caches, para o coletor de métricas."""
+        caches = {
+            "weather": self.weather_cache.stats(),
+            "forecast": self.forecast_cache.stats(),
+            "files": self.file_cache.stats(),
+        }
+        if self.ai_cache:
+            caches["ai"] = self.ai_cache.stats()
+        labels = ("cache",)
+        return [
+            ("mcp_cache_hits_total", "counter", "Acertos do cache", labels,
+             [((name,), s["hits"] + s.get("stale_hits", 0)) for name, s in caches.items()]),
+            ("mcp_cache_misses_total", "counter", "Falhas do cache", labels,
+             [((name,), s["misses"]) for name, s in caches.items()]),
+            ("mcp_cache_hit_ratio", "gauge", "Taxa de acerto do cache", labels,
+             [((name,), s["hit_ratio"]) for name, s in caches.items()]),
+        ]
+    
+    def server_stats(self) -> dict:
+        """Métricas, caches, disjuntores e cotas em um único dicionário."""
+        return {
+            "metrics": self.metrics.snapshot(),
+            "caches": self.cache_stats(),
+            "circuits": self.circuit_stats(),
+            "quotas": self.quota_stats(),
+            "tracing": self.tracer.stats(),
+        }
+    
+    async def _get_server_stats(self, section: str = "all") -> str:
+        """Estatísticas do servidor em JSON (ou texto do Prometheus)."""
+        if section == "prometheus":
+            return self.metrics.render()
+        stats = self.server_stats()
+        if section != "all":
+            stats = stats[section]
+        return json.dumps(stats, ensure_ascii=False, indent=2, default=str)
+    
+    def circuit_stats(self) -> dict:
+        """Estado e contadores do disjuntor de cada serviço externo."""
+        return {name: breaker.stats() for name, breaker in self.breakers.items()}
+    
+    def quota_stats(self) -> dict:
+        """Fichas, fila e descartes da cota de cada serviço externo."""
+        return {name: quota.stats() for name, quota in self.quotas.items()}
+    
+    async def _run_file_op(self, func, *args, timeout: Optional[float] = None):
+        """Executa uma operação de arquivo bloqueante no pool dedicado.
+        
+        Em caso de timeout o chamador é liberado, mas a thread só termina quando
+        a chamada de sistema retornar (não é possível interrompê-la).
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self._file_executor, functools.partial(func, *args))
+        return await asyncio.wait_for(future, timeout or FILE_OP_TIMEOUT)
     
-    async def _read_file(self, file_path: str) -> str:
-        """Lê o conteúdo de um arquivo de forma segura."""
+    async def _read_file(
+        self,
+        file_path: str,
+        offset: int = 0,
+        length: Optional[int] = None,
+        unit: str = "bytes",
+        encoding: str = "utf-8",
+        cursor: Optional[str] = None,
+        mode: str = "range"
+    ) -> str:
+        """Lê uma janela de um arquivo de forma segura, sem carregá-lo inteiro."""
         try:
-            # Normalizar caminho
-            path = Path(file_path).resolve()
+            return await self._run_file_op(
+                self._read_file_sync, file_path, offset, length, unit, encoding, cursor, mode
+            )
+        except asyncio.TimeoutError as e:
+            logger.warning(f"Tempo esgotado ao ler arquivo: {file_path}")
+            return ToolFailure(f" Tempo esgotado ({FILE_OP_TIMEOUT:.0f}s) ao ler o arquivo: {file_path}", e)
+    
+    def _read_file_sync(
+        self,
+        file_path: str,
+        offset: int,
+        length: Optional[int],
+        unit: str,
+        encoding: str,
+        cursor: Optional[str],
+        mode: str
+    ) -> str:
+        try:
+            path, st, error = self._stat_file(file_path)
+            if error:
+                return error
             
-            # Validações de segurança
-            if not path.exists():
-                return f" Arquivo não encontrado: {file_path}"
+            mode = mode or "range"
+            if mode not in ("range", "head", "tail"):
+                return f" Modo inválido: '{mode}' (use 'range', 'head' ou 'tail')"
+            if mode != "range":
+                unit, offset, cursor = "lines", 0, None
+            
+            # Validar parâmetros da janela
+            line_base = None
+            if cursor:
+                state = decode_cursor(cursor)
+                unit = state.get("u", unit)
+                offset = state.get("l", state.get("p", 0)) if unit == "lines" else state.get("p", 0)
+                if unit == "lines":
+                    line_base = (state.get("p", 0), state.get("l", 0))
+            
+            unit = unit or "bytes"
+            if unit not in ("bytes", "lines"):
+                return f" Unidade inválida: '{unit}' (use 'bytes' ou 'lines')"
             
-            if not path.is_file():
-                return f" O caminho não é um arquivo: {file_path}"
+            offset = max(0, int(offset or 0))
+            default_length = READ_FILE_DEFAULT_LINES if unit == "lines" else READ_FILE_DEFAULT_BYTES
+            length = max(1, int(length or default_length))
+            if unit == "bytes":
+                length = min(length, READ_FILE_MAX_BYTES)
+            
+            encoding = encoding or "utf-8"
+            codecs.lookup(encoding)
+            
+            # Arquivos pequenos são servidos da memória enquanto não mudarem
+            data = None
+            if self.file_cache.cacheable(st):
+                data = self.file_cache.get(str(path), st)
+                if data is None:
+                    data = path.read_bytes()
+                    self.file_cache.put(str(path), st, data)
+            
+            # Ler apenas a janela pedida
+            if mode == "tail":
+                source = data if data is not None else str(path)
+                window = read_tail(source, length, encoding, max_bytes=READ_FILE_MAX_BYTES)
+            elif data is not None:
+                window = read_window(
+                    data, offset, length, unit, encoding,
+                    max_bytes=READ_FILE_MAX_BYTES, line_base=line_base
+                )
+            else:
+                with open_buffer(str(path), st.st_size) as buf:
+                    window = read_window(
+                        buf, offset, length, unit, encoding,
+                        max_bytes=READ_FILE_MAX_BYTES, line_base=line_base
+                    )
+            size = window.size
+            self.file_bytes.add(window.end - window.start, "read_file")
             
-            # Ler arquivo
-            content = path.read_text(encoding='utf-8', errors='replace')
+            if mode == "tail":
+                span = f"últimas {length} linhas (bytes {window.start}-{window.end})"
+            elif unit == "lines":
+                span = f"linhas {window.first_line}-{window.next_line} (bytes {window.start}-{window.end})"
+            else:
+                span = f"bytes {window.start}-{window.end}"
             
-            # Limitar tamanho da resposta
-            max_chars = 10000
-            if len(content) > max_chars:
-                content = content[:max_chars] + f"\n\n... (truncado, arquivo tem {len(content)} caracteres)"
+            content = window.text
+            if not window.eof:
+                next_cursor = encode_cursor({"u": unit, "p": window.end, "l": window.next_line})
+                content += f'\n\n... (trecho parcial; para continuar use cursor="{next_cursor}")'
             
             result = f"""
 **Arquivo: {path.name}**
 Caminho: {path}
-Tamanho: {path.stat().st_size} bytes
+Tamanho: {size} bytes
+Trecho: {span}
 
 ---
 {content}
             """.strip()
             
-            logger.info(f"Arquivo lido com sucesso: {file_path}")
+            logger.info(f"Arquivo lido com sucesso: {file_path} ({span})")
             return result
         
-        except PermissionError:
-            return f" Sem permissão para ler o arquivo: {file_path}"
-        except UnicodeDecodeError:
-            return f" Arquivo não é de texto ou usa encoding não suportado: {file_path}"
+        except PermissionError as e:
+            return ToolFailure(f" Sem permissão para ler o arquivo: {file_path}", e)
+        except UnicodeDecodeError as e:
+            return ToolFailure(f" Arquivo não é de texto ou usa encoding não suportado: {file_path}", e)
+        except ValueError as e:
+            return ToolFailure(f" Parâmetro inválido para leitura: {str(e)}", e)
+        except LookupError as e:
+            return ToolFailure(f" Encoding desconhecido: {encoding}", e)
         except Exception as e:
             logger.error(f"Erro ao ler arquivo: {str(e)}")
-            return f" Erro ao ler arquivo: {str(e)}"
+            return ToolFailure(f" Erro ao ler arquivo: {str(e)}", e)
+    
+    @staticmethod
+    def _stat_file(file_path: str) -> tuple[Optional[Path], Optional[os.stat_result], Optional[str]]:
+        """Normaliza o caminho e valida, com um único stat(), que é um arquivo.
+        
+        Retorna (caminho, stat, None) ou (None, None, mensagem de erro).
+        """
+        # Normalizar caminho
+        path = Path(file_path).resolve()
+        
+        # Validações de segurança
+        try:
+            st = path.stat()
+        except FileNotFoundError:
+            return None, None, f" Arquivo não encontrado: {file_path}"
+        
+        if not stat.S_ISREG(st.st_mode):
+            return None, None, f" O caminho não é um arquivo: {file_path}"
+        
+        return path, st, None
+    
+    @classmethod
+    def _resolve_file(cls, file_path: str) -> tuple[Optional[Path], Optional[str]]:
+        """Como _stat_file, retornando apenas (caminho, erro)."""
+        path, _, error = cls._stat_file(file_path)
+        return path, error
+    
+    def invalidate_file_cache(self, path: Optional[str] = None) -> int:
+        """Descarta do cache um arquivo ou tudo sob um diretório (ou o cache
+        inteiro, sem argumento). Pode ser chamado por um watcher de diretório."""
+        if path is not None:
+            path = str(Path(path).resolve())
+        return self.file_cache.invalidate(path)
+    
+    async def _follow_file(
+        self,
+        file_path: str,
+        lines: int = 10,
+        interval: float = 0.5,
+        encoding: str = "utf-8"
+    ):
+        """Gera as últimas linhas do arquivo e depois cada linha nova anexada a ele."""
+        path, error = await self._run_file_op(self._resolve_file, file_path)
+        if error:
+            raise FileNotFoundError(error.strip())
+        
+        window = await self._run_file_op(read_tail, str(path), lines, encoding, READ_FILE_MAX_BYTES)
+        for line in window.text.splitlines():
+            yield line
+        
+        position = window.end
+        decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+        pending = ""
+        
+        while True:
+            await asyncio.sleep(interval)
+            size = (await self._run_file_op(path.stat)).st_size
+            
+            if size < position:
+                # Arquivo truncado ou rotacionado: recomeçar do início
+                yield f"--- arquivo truncado ({path.name}), reiniciando leitura ---"
+                position, pending = 0, ""
+                decoder.reset()
+            if size == position:
+                continue
+            
+            data = await self._run_file_op(
+                read_range, str(path), position, min(size - position, READ_FILE_MAX_BYTES)
+            )
+            position += len(data)
+            
+            pending += decoder.decode(data)
+            *complete, pending = pending.split("\n")
+            for line in complete:
+                yield line.rstrip("\r")
+            
+            # Uma linha sem fim não pode crescer sem limite
+            if len(pending) > READ_FILE_MAX_BYTES:
+                yield pending
+                pending = ""
     
-    async def _list_directory(self, directory_path: str) -> str:
-        """Lista conteúdo de um diretório."""
+    async def _list_directory(
+        self,
+        directory_path: str,
+        cursor: Optional[str] = None,
+        page_size: int = LIST_DIR_PAGE_SIZE,
+        recursive: bool = False,
+        max_depth: int = 3,
+        pattern: Optional[str] = None
+    ) -> str:
+        """Lista conteúdo de um diretório em páginas."""
+        try:
+            return await self._run_file_op(
+                self._list_directory_sync, directory_path, cursor, page_size, recursive, max_depth, pattern
+            )
+        except asyncio.TimeoutError as e:
+            logger.warning(f"Tempo esgotado ao listar diretório: {directory_path}")
+            return ToolFailure(f" Tempo esgotado ({FILE_OP_TIMEOUT:.0f}s) ao listar o diretório: {directory_path}", e)
+    
+    def _list_directory_sync(
+        self,
+        directory_path: str,
+        cursor: Optional[str],
+        page_size: int,
+        recursive: bool,
+        max_depth: int,
+        pattern: Optional[str]
+    ) -> str:
         try:
             path = Path(directory_path).resolve()
             
@@ -338,59 +1616,212 @@ Tamanho: {path.stat().st_size} bytes
             if not path.is_dir():
                 return f" O caminho não é um diretório: {directory_path}"
             
-            # Listar conteúdo
-            items = sorted(path.iterdir(), key=lambda x: (not x.is_dir(), x.name.lower()))
+            page_size = min(max(1, int(page_size or LIST_DIR_PAGE_SIZE)), LIST_DIR_MAX_PAGE_SIZE)
+            
+            # Listar conteúdo (uma única passada do scandir)
+            if recursive:
+                max_depth = min(max(1, int(max_depth or 1)), LIST_DIR_MAX_DEPTH)
+                page = walk_page(str(path), page_size, max_depth, cursor, pattern or None)
+            else:
+                page = list_page(str(path), page_size, cursor, pattern or None)
             
-            if not items:
+            if not page.entries and not cursor:
+                if pattern:
+                    return f"Nenhum item corresponde a '{pattern}' em: {path}"
                 return f"Diretório vazio: {path}"
             
             # Formatar resultado
             lines = [f"**Conteúdo de: {path}**\n"]
             
-            for item in items[:100]:  # Limitar a 100 itens
-                prefix = "[DIR]" if item.is_dir() else "[FILE]"
+            for rel, entry in page.entries:
+                prefix = "[DIR]" if entry_is_dir(entry) else "[FILE]"
                 size = ""
-                if item.is_file():
-                    size_bytes = item.stat().st_size
-                    if size_bytes < 1024:
-                        size = f" ({size_bytes} bytes)"
-                    elif size_bytes < 1024 * 1024:
-                        size = f" ({size_bytes / 1024:.1f} KB)"
-                    else:
-                        size = f" ({size_bytes / (1024 * 1024):.1f} MB)"
+                if entry.is_file():
+                    size_bytes = entry_size(entry)
+                    if size_bytes is not None:
+                        size = f" ({self._format_size(size_bytes)})"
                 
-                lines.append(f"{prefix} {item.name}{size}")
+                lines.append(f"{prefix} {rel}{size}")
             
-            if len(list(path.iterdir())) > 100:
-                lines.append(f"\n... e mais {len(list(path.iterdir())) - 100} itens")
+            if page.next_cursor:
+                if page.total is not None:
+                    shown = len(page.entries)
+                    lines.append(f"\n... mais itens ({page.total} no total, {shown} nesta página)")
+                else:
+                    lines.append("\n... mais itens disponíveis")
+                lines.append(f'Para continuar use cursor="{page.next_cursor}"')
             
+            result = "\n".join(lines)
+            self.file_bytes.add(len(result.encode("utf-8")), "list_directory")
             logger.info(f"Diretório listado com sucesso: {directory_path}")
-            return "\n".join(lines)
+            return result
         
-        except PermissionError:
-            return f" Sem permissão para acessar o diretório: {directory_path}"
+        except ValueError as e:
+            return ToolFailure(f" Parâmetro inválido para listagem: {str(e)}", e)
+        except PermissionError as e:
+            return ToolFailure(f" Sem permissão para acessar o diretório: {directory_path}", e)
         except Exception as e:
             logger.error(f"Erro ao listar diretório: {str(e)}")
-            return f" Erro ao listar diretório: {str(e)}"
+            return ToolFailure(f" Erro ao listar diretório: {str(e)}", e)
+    
+    @staticmethod
+    def _compile_search(pattern: str, regex: bool = False, case_sensitive: bool = False) -> "re.Pattern":
+        """Compila o padrão de busca (re.error se inválido).
+        
+        Em bytes o IGNORECASE só iguala letras ASCII ("ação" não acharia
+        "AÇÃO"); sem diferenciar maiúsculas, um padrão com texto não ASCII é
+        compilado como str e aplicado ao conteúdo decodificado.
+        """
+        if not pattern:
+            raise re.error("padrão vazio")
+        if not case_sensitive and not pattern.isascii():
+            return re.compile(pattern if regex else re.escape(pattern), re.IGNORECASE)
+        source = pattern.encode("utf-8")
+        if not regex:
+            source = re.escape(source)
+        return re.compile(source, 0 if case_sensitive else re.IGNORECASE)
+    
+    async def _iter_search(
+        self,
+        root: Path,
+        compiled: "re.Pattern",
+        glob: Optional[str] = None,
+        max_depth: int = LIST_DIR_MAX_DEPTH,
+        progress: Optional[dict] = None
+    ) -> AsyncIterator[FileMatches]:
+        """Procura em paralelo no pool de busca, gerando cada arquivo com
+        ocorrências assim que sua busca termina (ordem de conclusão).
+        
+        O ``re`` segura o GIL enquanto casa o padrão: as threads sobrepõem a
+        abertura e a leitura dos arquivos (o que domina em discos lentos e
+        NFS), mas o casamento em si usa um núcleo por vez.
+        """
+        loop = asyncio.get_running_loop()
+        files = (
+            entry.path
+            for _, entry in walk(str(root), max_depth, glob, SEARCH_EXCLUDED_DIRS)
+            if entry.is_file(follow_symlinks=False)
+        )
+        progress = progress if progress is not None else {}
+        progress.setdefault("files", 0)
+        
+        pending: set[asyncio.Future] = set()
+        exhausted = False
+        try:
+            while True:
+                # Manter a fila do pool cheia sem materializar a árvore inteira
+                if not exhausted and len(pending) < SEARCH_WORKERS * 4:
+                    batch = await loop.run_in_executor(
+                        self._search_executor, lambda: list(islice(files, 128))
+                    )
+                    exhausted = len(batch) < 128
+                    progress["files"] += len(batch)
+                    pending.update(
+                        loop.run_in_executor(self._search_executor, search_file, path, compiled)
+                        for path in batch
+                    )
+                    continue
+                
+                if not pending:
+                    break
+                
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    matches = future.result()
+                    if matches:
+                        yield matches
+        finally:
+            for future in pending:
+                future.cancel()
+    
+    async def _search_files(
+        self,
+        directory_path: str,
+        pattern: str,
+        regex: bool = False,
+        case_sensitive: bool = False,
+        glob: Optional[str] = None,
+        max_results: int = SEARCH_MAX_RESULTS,
+        max_depth: int = LIST_DIR_MAX_DEPTH
+    ) -> str:
+        """Procura um padrão no conteúdo dos arquivos de um diretório."""
+        try:
+            root = await self._run_file_op(Path(directory_path).resolve)
+            if not await self._run_file_op(root.is_dir):
+                return f" Diretório não encontrado: {directory_path}"
+            
+            compiled = self._compile_search(pattern, regex, case_sensitive)
+            max_results = max(1, int(max_results or SEARCH_MAX_RESULTS))
+            max_depth = min(max(1, int(max_depth or LIST_DIR_MAX_DEPTH)), LIST_DIR_MAX_DEPTH)
+            
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + SEARCH_TIMEOUT
+            progress: dict = {}
+            found: list[FileMatches] = []
+            lines_found = 0
+            stopped = ""
+            
+            async with aclosing(self._iter_search(root, compiled, glob or None, max_depth, progress)) as results:
+                async for matches in results:
+                    found.append(matches)
+                    lines_found += len(matches.lines)
+                    if lines_found >= max_results:
+                        stopped = f"limite de {max_results} resultados atingido"
+                        break
+                    if loop.time() > deadline:
+                        stopped = f"tempo máximo de {SEARCH_TIMEOUT:.0f}s atingido"
+                        break
+            
+            if not found:
+                return f"Nenhuma ocorrência de '{pattern}' em {root} ({progress['files']} arquivos analisados)"
+            
+            # Ranking: arquivos com mais ocorrências primeiro
+            found.sort(key=lambda m: (-m.count, m.path))
+            total = sum(m.count for m in found)
+            lines = [
+                f"**Busca por '{pattern}' em: {root}**",
+                f"{total} ocorrências em {len(found)} arquivos ({progress['files']} arquivos analisados)\n"
+            ]
+            remaining = max_results
+            for matches in found:
+                if remaining <= 0:
+                    break
+                rel = os.path.relpath(matches.path, root)
+                lines.append(f"**{rel}** ({matches.count} ocorrências)")
+                for line_no, text in matches.lines[:remaining]:
+                    lines.append(f"  L{line_no}: {text}")
+                remaining -= len(matches.lines)
+            
+            if stopped:
+                lines.append(f"\n... busca interrompida ({stopped})")
+            
+            logger.info(f"Busca concluída em {directory_path}: {total} ocorrências")
+            return "\n".join(lines)
+        
+        except re.error as e:
+            return ToolFailure(f" Padrão de busca inválido: {str(e)}", e)
+        except asyncio.TimeoutError as e:
+            return ToolFailure(f" Tempo esgotado ao acessar o diretório: {directory_path}", e)
+        except Exception as e:
+            logger.error(f"Erro na busca: {str(e)}")
+            return ToolFailure(f" Erro na busca: {str(e)}", e)
+    
+    @staticmethod
+    def _format_size(size_bytes: int) -> str:
+        if size_bytes < 1024:
+            return f"{size_bytes} bytes"
+        elif size_bytes < 1024 * 1024:
+            return f"{size_bytes / 1024:.1f} KB"
+        return f"{size_bytes / (1024 * 1024):.1f} MB"
     
     async def _get_location_facts(self, country: str) -> str:
         """Obtém fatos sobre um país usando RestCountries API."""
         try:
-            if not self.http_client:
-                self.http_client = httpx.AsyncClient(timeout=10.0)
+            info = await self._country_info(country)
             
-            # Buscar informações do país
-            url = f"https://restcountries.com/v3.1/name/{country}"
-            response = await self.http_client.get(url)
-            response.raise_for_status()
-            data = response.json()
-            
-            if not data:
+            if not info:
                 return f" País '{country}' não encontrado"
             
-            # Pegar o primeiro resultado
-            info = data[0]
-            
             # Extrair dados
             name = info["name"]["common"]
             official_name = info["name"]["official"]
@@ -443,125 +1874,570 @@ Tamanho: {path.stat().st_size} bytes
         
         except httpx.HTTPStatusError as e:
             if e.response.status_code == 404:
-                return f" País '{country}' não encontrado. Verifique o nome."
-            return f" Erro na API (HTTP {e.response.status_code})"
+                return ToolFailure(f" País '{country}' não encontrado. Verifique o nome.", e)
+            if e.response.status_code == 429:
+                return ToolFailure(" Cota da API RestCountries excedida (HTTP 429). Tente novamente em instantes.", e)
+            return ToolFailure(f" Erro na API (HTTP {e.response.status_code})", e)
+        except QuotaExceededError as e:
+            return ToolFailure(f" {str(e)}", e)
         except Exception as e:
             logger.error(f"Erro ao obter fatos: {str(e)}")
-            return f" Erro ao obter fatos: {str(e)}"
+            return ToolFailure(f" Erro ao obter fatos: {str(e)}", e)
+    
+    async def _get_country_index(self) -> Optional[CountryIndex]:
+        """Carrega o snapshot de países uma única vez, fora do event loop."""
+        if not self._country_index_loaded:
+            async def load():
+                index = await self._run_file_op(CountryIndex.load, COUNTRY_SNAPSHOT_PATH)
+                self._country_index, self._country_index_loaded = index, True
+                if index is None or not index.is_fresh(COUNTRY_SNAPSHOT_MAX_AGE):
+                    logger.info("Snapshot de países ausente ou desatualizado; gerando em segundo plano")
+                    self._refresh_countries_in_background()
+                return index
+            
+            return await self._inflight.do(("countries-snapshot",), load)
+        return self._country_index
+    
+    async def _country_info(self, country: str) -> Optional[dict]:
+        """Resolve um país pelo índice local; a API só é usada sem snapshot recente."""
+        index = await self._get_country_index()
+        fresh = index is not None and index.is_fresh(COUNTRY_SNAPSHOT_MAX_AGE)
+        
+        if fresh:
+            info = index.lookup(country)
+            if info:
+                return info
+        else:
+            self._refresh_countries_in_background()
+        
+        try:
+            return await self._inflight.do(
+                ("countries", " ".join((country or "").split()).casefold()),
+                lambda: self._fetch_country(country)
+            )
+        except Exception:
+            # Sem rede: um snapshot antigo ainda é melhor que nada
+            if index is not None and not fresh:
+                info = index.lookup(country)
+                if info:
+                    logger.warning(f"RestCountries indisponível; usando snapshot antigo para {country}")
+                    return info
+            raise
+    
+    def _refresh_countries_in_background(self):
+        """Agenda a geração do snapshot, no máximo uma tentativa por COUNTRY_SNAPSHOT_RETRY."""
+        now = time.monotonic()
+        if now < self._country_refresh_after:
+            return
+        self._country_refresh_after = now + COUNTRY_SNAPSHOT_RETRY
+        self._spawn(self._refresh_country_snapshot())
+    
+    async def _refresh_country_snapshot(self) -> Optional[CountryIndex]:
+        """Baixa todos os países (duas chamadas ao /all), grava o snapshot e passa a usá-lo.
+        
+        Um checkout novo não tem ``data/countries.json``; sem isso cada consulta
+        de país iria à RestCountries.
+        """
+        try:
+            with self.tracer.span("refresh countries"):
+                responses = [
+                    await self._get_json(
+                        "restcountries", f"{RESTCOUNTRIES_API_BASE}/all",
+                        {"fields": ",".join(fields)}, PRIORITY_PREFETCH
+                    )
+                    for fields in SNAPSHOT_FIELDS
+                ]
+                index = await self._run_file_op(build_snapshot, responses, COUNTRY_SNAPSHOT_PATH, timeout=120.0)
+        except Exception as e:
+            logger.warning(f"Não foi possível gerar o snapshot de países: {str(e)}")
+            return None
+        
+        self._country_index, self._country_index_loaded = index, True
+        logger.info(f"Snapshot de países gerado: {len(index)} países em {COUNTRY_SNAPSHOT_PATH}")
+        return index
+    
+    async def _fetch_country(self, country: str) -> Optional[dict]:
+        """Consulta a RestCountries e retorna o primeiro resultado."""
+        url = f"{RESTCOUNTRIES_API_BASE}/name/{country}"
+        data = await self._get_json("restcountries", url)
+        return data[0] if data else None
+    
+    async def _get_json(
+        self, upstream: str, url: str, params: Optional[dict] = None, priority: int = PRIORITY_INTERACTIVE
+    ) -> Any:
+        """GET em um serviço externo, respeitando a cota e o disjuntor do serviço.
+        
+        Um 429 suspende a cota pelo tempo do Retry-After e a requisição é
+        repetida uma vez (ou descartada, se a espera passar do limite).
+        """
+        client = self._get_http_client()
+        quota = self.quotas[upstream]
+        
+        async def request():
+            response = await client.get(url, params=params)
+            response.raise_for_status()
+            return response.json()
+        
+        for attempt in range(2):
+            await quota.acquire(priority)
+            try:
+                return await self._call_upstream(upstream, request)
+            except httpx.HTTPStatusError as e:
+                if e.response.status_code != 429 or not quota.enabled or attempt:
+                    raise
+                retry_after = parse_retry_after(e.response.headers.get("Retry-After"))
+                delay = QUOTA_DEFAULT_BACKOFF if retry_after is None else retry_after
+                quota.pause(delay)
+                logger.warning(f"{quota.name} respondeu 429; aguardando {delay:.1f}s")
+    
+    async def _call_upstream(self, upstream: str, factory):
+        """Chama um serviço externo pelo seu disjuntor, medindo latência e falhas."""
+        self.upstream_in_flight.inc(upstream)
+        started = time.perf_counter()
+        try:
+            with self.tracer.child(f"upstream {upstream}"):
+                try:
+                    return await self.breakers[upstream].call(factory)
+                except Exception as e:
+                    # Sem resposta, o hook do httpx não encerra o span da requisição
+                    self.tracer.finish_request(e)
+                    raise
+        except Exception as e:
+            self.upstream_errors.inc(upstream, type(e).__name__)
+            raise
+        finally:
+            self.upstream_in_flight.dec(upstream)
+            self.upstream_latency.observe(time.perf_counter() - started, upstream)
+    
+    @staticmethod
+    def _is_upstream_failure(error: BaseException) -> bool:
+        """Erros do chamador (ex: cidade inexistente) não indicam serviço doente."""
+        if isinstance(error, httpx.HTTPStatusError):
+            status = error.response.status_code
+        else:
+            status = getattr(error, "status_code", None)
+        if isinstance(status, int) and 400 <= status < 500:
+            return status in (408, 429)
+        return True
     
-    async def _analyze_with_ai(self, prompt: str, context: str = "") -> str:
+    async def _analyze_with_ai(self, prompt: str, context: str = "", use_cache: bool = True) -> str:
         """Usa IA generativa para análise (OpenAI primária, Anthropic fallback)."""
         
         # Construir mensagem completa
-        full_prompt = prompt
-        if context:
-            full_prompt = f"Contexto: {context}\n\nPergunta: {prompt}"
+        full_prompt = self._build_prompt(prompt, context)
+        
+        # Provedores do mais saudável para o menos saudável
+        providers = await self._ai_providers()
+        if not providers:
+            return " Nenhum provedor de IA configurado. Configure OPENAI_API_KEY ou ANTHROPIC_API_KEY."
         
-        # Tentar OpenAI primeiro
-        if self.openai_client:
+        # Com os dois provedores, a secundária entra se a primária demorar
+        if AI_HEDGE_ENABLED and len(providers) > 1:
             try:
-                logger.info("🤖 Usando OpenAI para análise...")
-                response = await self.openai_client.chat.completions.create(
-                    model=OPENAI_MODEL,
-                    messages=[
-                        {
-                            "role": "system",
-                            "content": (
-                                "Você é um assistente inteligente especializado em análise de dados, "
-                                "clima, geografia e recomendações de viagem. Forneça respostas claras, "
-                                "concisas e úteis em português."
-                            )
-                        },
-                        {"role": "user", "content": full_prompt}
-                    ],
-                    temperature=0.7,
-                    max_tokens=1000
-                )
-                
-                result = response.choices[0].message.content
-                logger.info("✅ Análise OpenAI concluída com sucesso")
-                
-                return f"""**Análise de IA (OpenAI {OPENAI_MODEL})**
+                provider, result, cached = await self._hedged_completion(full_prompt, use_cache)
+            except AllProvidersFailed as e:
+                logger.error(f"Ambos provedores de IA falharam: {str(e)}")
+                return ToolFailure(" Erro em ambos provedores de IA:\n" + self._format_errors(e.errors), e)
+            logger.info(f"✅ Análise {provider} concluída com sucesso")
+            return self._format_analysis(result, provider, fallback=provider != providers[0], cached=cached)
+        
+        # Failover sequencial
+        errors: dict[str, str] = {}
+        error: Optional[Exception] = None
+        for position, provider in enumerate(providers):
+            try:
+                logger.info(f"🤖 Usando {AI_PROVIDER_NAMES[provider]}{' (fallback)' if position else ''}...")
+                with self.tracer.child(f"attempt {provider}", fallback=position > 0):
+                    result, cached = await self._cached_completion(provider, full_prompt, use_cache)
+                logger.info(f"✅ Análise {AI_PROVIDER_NAMES[provider]} concluída com sucesso")
+                return self._format_analysis(result, provider, fallback=position > 0, cached=cached)
+            except Exception as e:
+                logger.warning(f"{AI_PROVIDER_NAMES[provider]} falhou: {str(e)}")
+                errors[provider], error = str(e), e
+        
+        if len(providers) == 1:
+            return ToolFailure(f" Erro ao usar {AI_PROVIDER_NAMES[providers[0]]}: {errors[providers[0]]}", error)
+        return ToolFailure(" Erro em ambos provedores de IA:\n" + self._format_errors(errors), AllProvidersFailed.__name__)
+    
+    @staticmethod
+    def _format_errors(errors: dict[str, str]) -> str:
+        return "\n".join(f"{AI_PROVIDER_NAMES[provider]}: {error}" for provider, error in errors.items())
+    
+    @staticmethod
+    def _build_prompt(prompt: str, context: str = "") -> str:
+        if context:
+            return f"Contexto: {context}\n\nPergunta: {prompt}"
+        return prompt
+    
+    @staticmethod
+    def _format_analysis(result: str, provider: str, fallback: bool = False, cached: bool = False) -> str:
+        """Formata a resposta de IA com o cabeçalho do provedor que respondeu."""
+        suffix = ", cache" if cached else ""
+        if provider == "openai":
+            label = f"OpenAI {OPENAI_MODEL} - Fallback" if fallback else f"OpenAI {OPENAI_MODEL}"
+            return f"""**Análise de IA ({label}{suffix})**
 
 {result}
 
 ---
 Nota: Resposta gerada por IA - verifique informações críticas.""".strip()
-            
-            except Exception as e:
-                logger.warning(f"OpenAI falhou, tentando fallback: {str(e)}")
-                
-                # Fallback para Anthropic
-                if self.anthropic_client:
-                    try:
-                        logger.info("🤖 Usando Anthropic (fallback)...")
-                        response = await self.anthropic_client.messages.create(
-                            model="claude-3-5-sonnet-20241022",
-                            max_tokens=1000,
-                            messages=[
-                                {"role": "user", "content": full_prompt}
-                            ]
-                        )
-                        
-                        result = response.content[0].text
-                        logger.info("✅ Análise Anthropic concluída com sucesso")
-                        
-                        return f"""🤖 **Análise de IA (Claude via Anthropic - Fallback)**
+        
+        label = "Claude via Anthropic - Fallback" if fallback else "Claude via Anthropic"
+        return f"""🤖 **Análise de IA ({label}{suffix})**
 
 {result}
 
 ---
 💡 *Resposta gerada por IA - sempre verifique informações críticas*""".strip()
-                    
-                    except Exception as e2:
-                        logger.error(f"Anthropic fallback também falhou: {str(e2)}")
-                        return f" Erro em ambos provedores de IA:\nOpenAI: {str(e)}\nAnthropic: {str(e2)}"
-                
-                return f" OpenAI falhou e não há fallback configurado: {str(e)}"
+    
+    async def _ai_providers(self) -> list[str]:
+        """Provedores configurados, do mais saudável para o menos saudável.
+        
+        Circuitos fechados vêm antes de meio abertos e abertos; entre
+        provedores igualmente saudáveis, o de menor latência mediana recente
+        vai primeiro (com amostras de ambos), senão vale a ordem padrão
+        (OpenAI, depois Anthropic).
+        """
+        clients = await asyncio.gather(*(self._ai_client(provider) for provider in AI_SDKS))
+        providers = [provider for provider, client in zip(AI_SDKS, clients) if client]
         
-        # Se não tem OpenAI, tentar Anthropic diretamente
-        elif self.anthropic_client:
+        rank = {CIRCUIT_CLOSED: 0, CIRCUIT_HALF_OPEN: 1, CIRCUIT_OPEN: 2}
+        medians = {p: self.breakers[p].latency.percentile(0.5) for p in providers}
+        compare_latency = None not in medians.values()
+        providers.sort(key=lambda p: (rank[self.breakers[p].state], medians[p] if compare_latency else 0.0))
+        return providers
+    
+    async def _stream_analysis(
+        self, prompt: str, context: str = "", use_cache: bool = True
+    ) -> AsyncIterator[dict]:
+        """Versão em streaming de _analyze_with_ai.
+        
+        Gera eventos ``{"type": ...}``: ``start`` (provedor escolhido), ``delta``
+        (trecho de texto), ``fallback`` (o provedor falhou no meio; o texto
+        parcial deve ser descartado), ``done`` (texto final formatado) ou
+        ``error``. A ordem de provedores e o fallback são os mesmos da versão
+        sem streaming.
+        """
+        full_prompt = self._build_prompt(prompt, context)
+        providers = await self._ai_providers()
+        if not providers:
+            yield {"type": "error", "message": "Nenhum provedor de IA configurado. Configure OPENAI_API_KEY ou ANTHROPIC_API_KEY."}
+            return
+        
+        errors = []
+        for position, provider in enumerate(providers):
+            fallback = position > 0
+            yield {"type": "start", "provider": provider, "fallback": fallback}
+            
+            cache_key = self._ai_cache_key(provider, full_prompt)
+            if use_cache and self.ai_cache:
+                try:
+                    cached = await self._run_file_op(self.ai_cache.get, cache_key)
+                except Exception as e:
+                    logger.warning(f"Cache de IA indisponível: {str(e)}")
+                    cached = None
+                if cached is not None:
+                    yield {"type": "delta", "text": cached}
+                    yield {"type": "done", "provider": provider, "cached": True,
+                           "result": self._format_analysis(cached, provider, fallback, cached=True)}
+                    return
+            
+            chunks: list[str] = []
             try:
-                logger.info("🤖 Usando Anthropic...")
-                response = await self.anthropic_client.messages.create(
-                    model="claude-3-5-sonnet-20241022",
-                    max_tokens=1000,
-                    messages=[
-                        {"role": "user", "content": full_prompt}
-                    ]
+                logger.info(f"🤖 Usando {provider} em streaming...")
+                async for text in self._stream_completion(provider, full_prompt):
+                    chunks.append(text)
+                    yield {"type": "delta", "text": text}
+            except Exception as e:
+                logger.warning(f"{provider} falhou durante o streaming: {str(e)}")
+                self.tracer.event("fallback", provider=provider, error=str(e))
+                errors.append(f"{provider}: {str(e)}")
+                if position + 1 < len(providers):
+                    yield {"type": "fallback", "provider": providers[position + 1], "error": str(e)}
+                continue
+            
+            result = "".join(chunks)
+            if self.ai_cache:
+                try:
+                    await self._run_file_op(self.ai_cache.put, cache_key, result)
+                except Exception as e:
+                    logger.warning(f"Falha ao gravar no cache de IA: {str(e)}")
+            
+            logger.info(f"✅ Análise {provider} (streaming) concluída com sucesso")
+            yield {"type": "done", "provider": provider, "cached": False,
+                   "result": self._format_analysis(result, provider, fallback)}
+            return
+        
+        yield {"type": "error", "message": " Erro nos provedores de IA:\n" + "\n".join(errors),
+               "error_type": AllProvidersFailed.__name__}
+    
+    async def _stream_completion(self, provider: str, full_prompt: str) -> AsyncIterator[str]:
+        """Trechos de texto da resposta do provedor, à medida que chegam."""
+        request = self._ai_request(provider, full_prompt)
+        client = await self._ai_client(provider)
+        breaker = self.breakers[provider]
+        breaker.acquire()
+        self.upstream_in_flight.inc(provider)
+        # Span sem virar o atual: o corpo do gerador roda no contexto de quem consome
+        span = self.tracer.start(f"stream {provider}")
+        started = time.perf_counter()
+        try:
+            if provider == "openai":
+                stream = await client.chat.completions.create(**request, stream=True)
+                async for chunk in stream:
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        yield chunk.choices[0].delta.content
+            else:
+                async with client.messages.stream(**request) as stream:
+                    async for text in stream.text_stream:
+                        yield text
+        except Exception as e:
+            self.upstream_errors.inc(provider, type(e).__name__)
+            span.finish(f"{type(e).__name__}: {e}")
+            if breaker.is_failure(e):
+                breaker.record_failure(time.perf_counter() - started)
+            else:
+                breaker.record_success(time.perf_counter() - started)
+            raise
+        except BaseException:
+            # Consumidor desistiu (cancelamento ou aclose)
+            breaker.release()
+            raise
+        else:
+            breaker.record_success(time.perf_counter() - started)
+        finally:
+            span.finish()
+            self.upstream_in_flight.dec(provider)
+            self.upstream_latency.observe(time.perf_counter() - started, provider)
+    
+    def _ai_request(self, provider: str, full_prompt: str) -> dict:
+        """Parâmetros da chamada ao provedor (também usados na chave do cache)."""
+        if provider == "openai":
+            return {
+                "model": OPENAI_MODEL,
+                "messages": [
+                    {"role": "system", "content": AI_SYSTEM_PROMPT},
+                    {"role": "user", "content": full_prompt}
+                ],
+                "temperature": AI_TEMPERATURE,
+                "max_tokens": AI_MAX_TOKENS
+            }
+        return {
+            "model": ANTHROPIC_MODEL,
+            "max_tokens": AI_MAX_TOKENS,
+            "messages": [
+                {"role": "user", "content": full_prompt}
+            ]
+        }
+    
+    async def _complete(self, provider: str, full_prompt: str) -> str:
+        """Chama o provedor de IA e retorna o texto da resposta."""
+        request = self._ai_request(provider, full_prompt)
+        client = await self._ai_client(provider)
+        
+        async def create():
+            if provider == "openai":
+                response = await client.chat.completions.create(**request)
+                return response.choices[0].message.content
+            response = await client.messages.create(**request)
+            return response.content[0].text
+        
+        return await self._call_upstream(provider, create)
+    
+    def _hedge_delay(self, provider: str) -> float:
+        """Tempo de espera pela primária antes de acionar a secundária."""
+        observed = self.breakers[provider].latency.percentile(AI_HEDGE_PERCENTILE)
+        if observed is None:
+            return AI_HEDGE_DEFAULT_DELAY
+        return max(AI_HEDGE_MIN_DELAY, observed)
+    
+    async def _hedged_completion(self, full_prompt: str, use_cache: bool = True) -> tuple[str, str, bool]:
+        """Resposta do primeiro provedor a concluir, com hedging.
+        
+        A primária recebe a requisição; se não responder dentro do percentil
+        ``AI_HEDGE_PERCENTILE`` da sua latência recente (e houver orçamento),
+        a mesma requisição é enviada à secundária. Vence a primeira resposta
+        bem-sucedida e a outra chamada é cancelada. Se a primária falhar antes
+        disso, a secundária é acionada imediatamente (fallback normal).
+        
+        Retorna (provedor, texto, veio_do_cache); levanta AllProvidersFailed.
+        """
+        primary, secondary = (await self._ai_providers())[:2]
+        hedge_ticket = self.hedge_budget.allow()
+        
+        async def attempt(provider: str, role: str) -> tuple[str, bool]:
+            with self.tracer.child(f"attempt {provider}", role=role):
+                return await self._cached_completion(provider, full_prompt, use_cache)
+        
+        def launch(provider: str, role: str) -> asyncio.Task:
+            task = asyncio.create_task(attempt(provider, role))
+            pending[task] = provider
+            return task
+        
+        pending: dict[asyncio.Task, str] = {}
+        errors: dict[str, str] = {}
+        started = time.perf_counter()
+        launch(primary, "primary")
+        try:
+            delay = self._hedge_delay(primary)
+            while pending:
+                hedge_pending = (
+                    hedge_ticket is not None and secondary not in pending.values() and secondary not in errors
+                )
+                done, _ = await asyncio.wait(
+                    pending, timeout=delay if hedge_pending else None, return_when=asyncio.FIRST_COMPLETED
                 )
                 
-                result = response.content[0].text
-                logger.info("✅ Análise Anthropic concluída com sucesso")
+                if not done:
+                    if not self.hedge_budget.spend(hedge_ticket):
+                        # Outras requisições gastaram o orçamento durante o atraso
+                        hedge_ticket = None
+                        continue
+                    logger.info(f"{primary} não respondeu em {delay:.2f}s, acionando {secondary} (hedge)")
+                    self.tracer.event("hedge", provider=secondary, after_s=round(delay, 3))
+                    launch(secondary, "hedge")
+                    continue
                 
-                return f"""🤖 **Análise de IA (Claude via Anthropic)**
-
-{result}
-
----
-💡 *Resposta gerada por IA - sempre verifique informações críticas*""".strip()
+                for task in done:
+                    provider = pending.pop(task)
+                    if task.exception() is None:
+                        result, cached = task.result()
+                        if primary in pending.values():
+                            # A primária cancelada demoraria pelo menos o tempo decorrido;
+                            # sem essa amostra o percentil só veria as respostas rápidas
+                            # e o atraso do hedge cairia a cada vitória da secundária.
+                            self.breakers[primary].latency.record(time.perf_counter() - started)
+                        return provider, result, cached
+                    errors[provider] = str(task.exception())
+                    logger.warning(f"{provider} falhou: {errors[provider]}")
+                    if provider == primary and secondary not in pending.values() and secondary not in errors:
+                        self.tracer.event("fallback", provider=secondary, error=errors[provider])
+                        launch(secondary, "fallback")
             
+            raise AllProvidersFailed(errors)
+        finally:
+            for task in pending:
+                task.cancel()
+    
+    def _ai_cache_key(self, provider: str, full_prompt: str) -> str:
+        request = self._ai_request(provider, full_prompt)
+        return AIResponseCache.make_key(
+            provider,
+            request["model"],
+            AI_SYSTEM_PROMPT if provider == "openai" else "",
+            full_prompt,
+            request.get("temperature"),
+            request["max_tokens"]
+        )
+    
+    async def _cached_completion(self, provider: str, full_prompt: str, use_cache: bool = True) -> tuple[str, bool]:
+        """Resposta do provedor passando pelo cache persistente.
+        
+        Retorna (texto, veio_do_cache). Com ``use_cache=False`` o cache não é
+        consultado, mas a resposta nova ainda é gravada.
+        """
+        if not self.ai_cache:
+            return await self._complete(provider, full_prompt), False
+        
+        key = self._ai_cache_key(provider, full_prompt)
+        
+        if use_cache:
+            try:
+                cached = await self._run_file_op(self.ai_cache.get, key)
+                if cached is not None:
+                    logger.info(f"Resposta de IA servida do cache ({provider})")
+                    return cached, True
             except Exception as e:
-                logger.error(f"Erro ao usar Anthropic: {str(e)}")
-                return f" Erro ao usar Anthropic: {str(e)}"
+                logger.warning(f"Cache de IA indisponível: {str(e)}")
         
-        else:
-            return " Nenhum provedor de IA configurado. Configure OPENAI_API_KEY ou ANTHROPIC_API_KEY."
+        result = await self._complete(provider, full_prompt)
+        
+        try:
+            await self._run_file_op(self.ai_cache.put, key, result)
+        except Exception as e:
+            logger.warning(f"Falha ao gravar no cache de IA: {str(e)}")
+        return result, False
+    
+    @staticmethod
+    def _create_http_client() -> httpx.AsyncClient:
+        """Cliente com pool de conexões persistentes (e HTTP/2, se disponível)."""
+        http2 = HTTP2_ENABLED and H2_AVAILABLE
+        if HTTP2_ENABLED and not H2_AVAILABLE:
+            logger.info("HTTP/2 indisponível (instale httpx[http2]); usando HTTP/1.1")
+        return httpx.AsyncClient(
+            timeout=httpx.Timeout(HTTP_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+                keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+            ),
+            http2=http2,
+        )
+    
+    def _get_http_client(self) -> httpx.AsyncClient:
+        """Cliente compartilhado; só é criado aqui se start() não foi chamado."""
+        if self.http_client is None:
+            self.http_client = self._create_http_client()
+            self.tracer.instrument(self.http_client)
+        return self.http_client
+    
+    async def start(self):
+        """Cria o cliente HTTP compartilhado e pré-aquece as conexões.
+        
+        Chamado por run() e pelo lifespan da API; pode ser chamado mais de uma vez.
+        """
+        self._get_http_client()
+        if HTTP_PREWARM and not self._prewarmed:
+            self._prewarmed = True
+            self._spawn(self._prewarm())
+        if not self._city_index_loaded:
+            self._spawn(self._get_city_index())
+        if not self._country_index_loaded:
+            self._spawn(self._get_country_index())
+        if WEATHER_PREFETCH_ENABLED and WEATHER_API_KEY and self._prefetch_task is None:
+            self._prefetch_task = self._spawn(self._prefetch_loop())
+    
+    async def _prewarm(self) -> int:
+        """Abre conexões (DNS, TCP e TLS) com os hosts das APIs externas.
+        
+        Qualquer resposta serve: o objetivo é deixar a conexão no pool para
+        que a primeira requisição real não pague o handshake. Retorna quantos
+        hosts responderam.
+        """
+        client = self._get_http_client()
+        origins = {
+            str(httpx.URL(base).copy_with(path="/", query=None))
+            for base in (WEATHER_API_BASE, RESTCOUNTRIES_API_BASE)
+        }
+        
+        async def warm(origin: str) -> bool:
+            try:
+                await client.head(origin, timeout=HTTP_CONNECT_TIMEOUT)
+                return True
+            except Exception as e:
+                logger.debug(f"Pré-aquecimento de {origin} falhou: {str(e)}")
+                return False
+        
+        warmed = sum(await asyncio.gather(*(warm(origin) for origin in sorted(origins))))
+        logger.info(f"Conexões pré-aquecidas: {warmed}/{len(origins)} hosts")
+        return warmed
     
     async def run(self):
         """Executa o servidor MCP."""
         logger.info("Iniciando MCP Weather & Files AI Server...")
         logger.info(f"Weather API: {'Configurada' if WEATHER_API_KEY else 'Não configurada'}")
         
-        # Status dos provedores de IA
-        if self.openai_client:
+        # Status dos provedores de IA (os clientes só são criados no primeiro uso)
+        if OPENAI_API_KEY:
             logger.info(f"OpenAI: Primária ({OPENAI_MODEL})")
-        if self.anthropic_client:
-            status = "Fallback" if self.openai_client else "Única"
+        if ANTHROPIC_API_KEY:
+            status = "Fallback" if OPENAI_API_KEY else "Única"
             logger.info(f"Anthropic: {status}")
-        if not self.openai_client and not self.anthropic_client:
+        if not OPENAI_API_KEY and not ANTHROPIC_API_KEY:
             logger.warning("IA: Nenhum provedor configurado")
         
+        await self.start()
+        
         async with stdio_server() as (read_stream, write_stream):
             await self.server.run(
                 read_stream,
@@ -571,14 +2447,22 @@ Nota: Resposta gerada por IA - verifique informações críticas.""".strip()
     
     async def cleanup(self):
         """Limpa recursos."""
+        for task in list(self._background_tasks):
+            task.cancel()
+        
+        self._file_executor.shutdown(wait=False, cancel_futures=True)
+        self._search_executor.shutdown(wait=False, cancel_futures=True)
+        
         if self.http_client:
             await self.http_client.aclose()
+            self.http_client = None
+        self.tracer.close()
         
-        # Fechar clientes de IA se necessário
-        if self.openai_client:
-            await self.openai_client.close()
-        if self.anthropic_client:
-            await self.anthropic_client.close()
+        # Fechar clientes de IA já criados
+        for client in self._ai_clients.values():
+            if client is not None:
+                await client.close()
+        self._ai_clients.clear()
 
 
 async def main():
@@ -11,6 +11,7 @@ document.addEventListener('DOMContentLoaded', () => {
 
     let currentTool = null;
     let toolsData = [];
+    let citySuggestions = new Map();  // rótulo exibido -> ID da OpenWeatherMap
 
     // Carregar ferramentas da API
     async function loadTools() {
@@ -66,7 +67,7 @@ document.addEventListener('DOMContentLoaded', () => {
             label.textContent = param.charAt(0).toUpperCase() + param.slice(1).replace('_', ' ');
 
             let input;
-            if (param === 'prompt' || param === 'context') {
+            if (param === 'prompt' || param === 'context' || param === 'cities' || param === 'compare_with') {
                 input = document.createElement('textarea');
                 input.rows = 3;
             } else {
@@ -76,14 +77,49 @@ document.addEventListener('DOMContentLoaded', () => {
 
             input.name = param;
             input.placeholder = `Digite o valor para ${param}...`;
-            input.required = param !== 'country_code' && param !== 'context';
+            input.required = tool.required.includes(param);
 
             group.appendChild(label);
             group.appendChild(input);
+            if (param === 'city') attachCityAutocomplete(group, input);
             formFields.appendChild(group);
         });
     }
 
+    // Autocompletar cidades pelo índice local (a consulta vai pelo ID da cidade)
+    function attachCityAutocomplete(group, input) {
+        const datalist = document.createElement('datalist');
+        datalist.id = 'city-suggestions';
+        input.setAttribute('list', datalist.id);
+        input.autocomplete = 'off';
+        group.appendChild(datalist);
+
+        let timer = null;
+        input.addEventListener('input', () => {
+            clearTimeout(timer);
+            const prefix = input.value.trim();
+            if (prefix.length < 2 || citySuggestions.has(prefix)) return;
+
+            timer = setTimeout(async () => {
+                try {
+                    const response = await fetch(`/api/cities/autocomplete?q=${encodeURIComponent(prefix)}&limit=10`);
+                    if (!response.ok) return;
+                    const cities = await response.json();
+
+                    citySuggestions = new Map(cities.map(city => [city.label, city.id]));
+                    datalist.innerHTML = '';
+                    cities.forEach(city => {
+                        const option = document.createElement('option');
+                        option.value = city.label;
+                        datalist.appendChild(option);
+                    });
+                } catch (error) {
+                    console.error('Erro ao buscar cidades:', error);
+                }
+            }, 150);
+        });
+    }
+
     toolForm.addEventListener('submit', async (e) => {
         e.preventDefault();
         if (!currentTool) return;
@@ -93,12 +129,21 @@ document.addEventListener('DOMContentLoaded', () => {
         formData.forEach((value, key) => {
             if (value) args[key] = value;
         });
+        if (args.city && citySuggestions.has(args.city)) {
+            args.city = String(citySuggestions.get(args.city));
+            delete args.country_code;  // o ID já identifica o país
+        }
 
         addToConsole(`Executando ${currentTool.name}...`, 'info');
         runBtn.disabled = true;
         runBtn.textContent = 'Executando...';
 
         try {
+            if (currentTool.name === 'analyze_with_ai') {
+                await streamAnalysis(args);
+                return;
+            }
+
             const response = await fetch('/api/execute', {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
@@ -127,6 +172,58 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     });
 
+    // Análise de IA em streaming (SSE): o texto aparece conforme é gerado
+    async function streamAnalysis(args) {
+        const response = await fetch('/api/analyze/stream', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({
+                prompt: args.prompt,
+                context: args.context || '',
+                use_cache: !['false', '0', 'nao', 'não'].includes(String(args.use_cache).toLowerCase())
+            })
+        });
+
+        if (!response.ok) {
+            const data = await response.json();
+            addToConsole(`Erro do Servidor: ${data.detail}`, 'error');
+            return;
+        }
+
+        const output = addToConsole('', 'success');
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+
+            const events = buffer.split('\n\n');
+            buffer = events.pop();
+            events.forEach(raw => {
+                if (!raw.startsWith('data: ')) return;
+                const event = JSON.parse(raw.slice(6));
+
+                if (event.type === 'delta') {
+                    output.textContent += event.text;
+                } else if (event.type === 'fallback') {
+                    output.textContent = '';
+                    addToConsole(`Provedor falhou (${event.error}), usando ${event.provider}...`, 'info');
+                } else if (event.type === 'done') {
+                    output.textContent = event.result;
+                } else if (event.type === 'error') {
+                    addToConsole(event.message, 'error');
+                }
+                consoleOutput.scrollTop = consoleOutput.scrollHeight;
+            });
+        }
+
+        const now = new Date();
+        lastRunTime.textContent = `Última execução: ${now.getHours()}:${now.getMinutes().toString().padStart(2, '0')}`;
+    }
+
     function addToConsole(text, type) {
         const welcome = consoleOutput.querySelector('.console-welcome');
         if (welcome) welcome.remove();
@@ -146,6 +243,7 @@ document.addEventListener('DOMContentLoaded', () => {
 
         consoleOutput.appendChild(entry);
         consoleOutput.scrollTop = consoleOutput.scrollHeight;
+        return content;
     }
 
     clearConsoleBtn.addEventListener('click', () => {
@@ -6,10 +6,40 @@ Executa testes básicos sem precisar do Claude Desktop.
 """
 
 import asyncio
+import gc
+import gzip
+import json
 import os
+import shutil
 import sys
+import tempfile
+import threading
+import time
 from pathlib import Path
+
+import httpx
+from mcp.shared.memory import create_connected_server_and_client_session
+
+import server as server_module
+from cache import AIResponseCache, SingleFlight
+from cities import CityIndex
+from countries import CountryIndex, save_snapshot
+from files import encode_cursor, walk_page
+from resilience import (
+    CIRCUIT_CLOSED,
+    CIRCUIT_HALF_OPEN,
+    CIRCUIT_OPEN,
+    PRIORITY_BATCH,
+    PRIORITY_INTERACTIVE,
+    PRIORITY_PREFETCH,
+    HedgeBudget,
+    LatencyTracker,
+    QuotaExceededError,
+    QuotaScheduler,
+)
 from server import WeatherFilesServer
+from tools import ToolArgumentError
+from tracing import Tracer, load_traces
 
 # Fix Windows encoding
 if sys.platform == "win32":
@@ -36,6 +66,559 @@ async def test_weather():
         await server.cleanup()
 
 
+async def test_weather_cache():
+    """Testa o cache de clima (sem acessar a rede)."""
+    print("\nTestando cache de get_weather...")
+    server = WeatherFilesServer()
+    calls = []
+    
+    async def fake_fetch(key, priority=None):
+        calls.append(key)
+        return {"name": key[0].title(), "main": {"temp": 25}}
+    
+    server._fetch_weather = fake_fetch
+    
+    try:
+        await server._weather_data("São Paulo", "BR")
+        await server._weather_data("  são   paulo ", "br")
+        stats = server.cache_stats()["weather"]
+        assert len(calls) == 1, f"esperava 1 chamada upstream, houve {len(calls)}"
+        assert stats["hits"] == 1 and stats["misses"] == 1, stats
+        
+        # Entrada velha: servida imediatamente e revalidada em segundo plano
+        server.weather_cache.ttl = 0
+        server.weather_cache.stale_ttl = 60
+        await server._weather_data("São Paulo", "BR")
+        await asyncio.sleep(0)
+        await asyncio.gather(*server._background_tasks)
+        assert len(calls) == 2, f"esperava revalidação em segundo plano, houve {len(calls)} chamadas"
+        print(f"Estatísticas: {server.cache_stats()['weather']}")
+        print("Teste de cache concluído com sucesso.")
+    except Exception as e:
+        print(f"Teste de cache falhou: {e}")
+    finally:
+        await server.cleanup()
+
+
+def fake_forecast(city_id: int, name: str, base_temp: float) -> dict:
+    """Resposta no formato de /forecast: 40 passos de 3h a partir de agora."""
+    start = int(time.time()) // 10800 * 10800
+    return {
+        "city": {"id": city_id, "name": name, "country": "BR", "timezone": -10800},
+        "list": [
+            {
+                "dt": start + i * 10800,
+                "main": {"temp": base_temp + i % 8, "humidity": 70},
+                "wind": {"speed": 3.0 + i % 3},
+                "pop": 0.8 if i % 2 == 0 else 0.1,
+                "rain": {"3h": 1.5} if i % 2 == 0 else {},
+                "weather": [{"id": 500}],
+            }
+            for i in range(40)
+        ],
+    }
+
+
+async def test_forecast():
+    """Testa get_forecast: uma chamada por cidade e agregados sobre as colunas."""
+    print("\nTestando get_forecast...")
+    original_key = server_module.WEATHER_API_KEY
+    server_module.WEATHER_API_KEY = server_module.WEATHER_API_KEY or "teste"
+    server = WeatherFilesServer()
+    requests = []
+    
+    def handler(request):
+        requests.append(request.url.params.get("q"))
+        if request.url.params.get("q") == "natal":
+            return httpx.Response(200, json=fake_forecast(3394023, "Natal", 25))
+        return httpx.Response(200, json=fake_forecast(3390760, "Recife", 20))
+    
+    server.http_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    try:
+        result = await server._get_forecast("Recife", period="tomorrow")
+        assert "Máxima: 27.0°C" in result and "Chuva: 6.0 mm em 12h" in result, result
+        
+        week = await server._get_forecast("Recife")
+        assert "**Por dia**" in week, week
+        
+        comparison = await server._get_forecast("Recife", period="week", compare_with="Natal")
+        assert comparison.index("Natal") < comparison.index("Recife, BR |"), comparison
+        
+        # Perguntas seguintes sobre a mesma cidade não consultam a API
+        assert requests == ["recife", "natal"], requests
+        series, _ = server.forecast_cache.get(server._weather_key("Recife"))
+        print(f"Previsão de {len(series)} passos em {series.nbytes} bytes")
+        print(comparison)
+        print("Teste de previsão concluído com sucesso.")
+    except Exception as e:
+        print(f"Teste de previsão falhou: {e!r}")
+    finally:
+        server_module.WEATHER_API_KEY = original_key
+        await server.cleanup()
+
+
+async def test_execute_batch():
+    """Testa /api/execute_batch: paralelismo, dependências e context_from."""
+    print("\nTestando /api/execute_batch...")
+    import api
+    
+    async def fake_weather(city, country_code=""):
+        await asyncio.sleep(0.2)
+        return f"Clima em {city}: 30°C"
+    
+    async def fake_facts(country):
+        await asyncio.sleep(0.2)
+        return f"{country}: 203 milhões de habitantes"
+    
+    async def fake_analyze(prompt, context="", use_cache=True):
+        await asyncio.sleep(0.1)
+        return f"Análise de '{prompt}' com contexto: {context}"
+    
+    server = api.mcp_server
+    originals = (server._get_weather, server._get_location_facts, server._analyze_with_ai)
+    server._get_weather, server._get_location_facts, server._analyze_with_ai = fake_weather, fake_facts, fake_analyze
+    
+    try:
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=api.app), base_url="http://test") as client:
+            response = await client.post("/api/execute_batch", json={"steps": [
+                {"id": "clima", "tool_name": "get_weather", "arguments": {"city": "Recife"}},
+                {"id": "pais", "tool_name": "get_location_facts", "arguments": {"country": "Brasil"}},
+                {"id": "ia", "tool_name": "analyze_with_ai", "arguments": {"prompt": "Vale viajar?"},
+                 "context_from": ["clima", "pais"]},
+                {"id": "quebrado", "tool_name": "ferramenta_inexistente"},
+                {"id": "depois", "tool_name": "get_weather", "arguments": {"city": "Natal"}, "depends_on": ["quebrado"]},
+            ]})
+            data = response.json()
+            steps = {step["id"]: step for step in data["steps"]}
+            assert response.status_code == 200, data
+            assert "30°C" in steps["ia"]["result"] and "203 milhões" in steps["ia"]["result"], steps["ia"]
+            assert steps["quebrado"]["status"] == "error" and steps["depois"]["status"] == "skipped", steps
+            # Clima e país rodam ao mesmo tempo; a IA só começa depois dos dois
+            end = {k: v["started_ms"] + v["duration_ms"] for k, v in steps.items() if "started_ms" in v}
+            assert max(steps["clima"]["started_ms"], steps["pais"]["started_ms"]) < min(end["clima"], end["pais"]), steps
+            assert steps["ia"]["started_ms"] >= max(end["clima"], end["pais"]) - 0.1, steps
+            print(f"Lote em {data['total_ms']} ms: " + ", ".join(f"{k}={v.get('duration_ms')}" for k, v in steps.items()))
+            
+            cycle = await client.post("/api/execute_batch", json={"steps": [
+                {"id": "a", "tool_name": "get_weather", "depends_on": ["b"]},
+                {"id": "b", "tool_name": "get_weather", "depends_on": ["a"]},
+            ]})
+            assert cycle.status_code == 400, cycle.text
+            
+            # context_from só vale para ferramentas com o argumento 'context'
+            no_context = await client.post("/api/execute_batch", json={"steps": [
+                {"id": "clima", "tool_name": "get_weather", "arguments": {"city": "Recife"}},
+                {"id": "outro", "tool_name": "get_weather", "arguments": {"city": "Natal"}, "context_from": ["clima"]},
+            ]})
+            assert no_context.status_code == 400 and "context" in no_context.json()["detail"], no_context.text
+        print("Teste de execução em lote concluído com sucesso.")
+    except Exception as e:
+        print(f"Teste de execução em lote falhou: {e!r}")
+    finally:
+        server._get_weather, server._get_location_facts, server._analyze_with_ai = originals
+
+
+async def test_tool_registry():
+    """Testa o registro de ferramentas: validação antes do handler e listagens."""
+    print("\nTestando registro de ferramentas...")
+    import api
+    server = api.mcp_server
+    calls = []
+    
+    async def fake_search(directory_path, pattern, **kwargs):
+        calls.append((directory_path, pattern, kwargs))
+        return "ok"
+    
+    original = server._search_files
+    server._search_files = fake_search
+    
+    try:
+        # Texto do dashboard é convertido antes de chegar ao handler
+        result = await server.execute_tool("search_files", {
+            "directory_path": ".", "pattern": "TODO", "regex": "sim", "max_results": "5"
+        })
+        assert result == "ok" and calls[-1][2] == {"regex": True, "case_sensitive": False, "max_results": 5}, calls
+        
+        # Argumentos inválidos não chegam ao handler
+        for bad in ({"pattern": "TODO"}, {"directory_path": ".", "pattern": "x", "max_results": 0}):
+            try:
+                await server.execute_tool("search_files", bad)
+                raise AssertionError(f"argumentos aceitos: {bad}")
+            except ToolArgumentError:
+                pass
+        assert len(calls) == 1, calls
+        
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=api.app), base_url="http://test") as client:
+            tools = (await client.get("/api/tools")).json()
+            missing = await client.post("/api/execute", json={"tool_name": "search_files", "arguments": {}})
+            unknown = await client.post("/api/execute", json={"tool_name": "nao_existe", "arguments": {}})
+        assert [t["name"] for t in tools] == [t.name for t in server_module.TOOLS.mcp_tools], tools
+        for entry, tool in zip(tools, server_module.TOOLS.mcp_tools):
+            assert entry["params"] == list(tool.inputSchema["properties"]), entry
+            assert entry["required"] == tool.inputSchema["required"], entry
+        assert missing.status_code == 422 and "directory_path" in missing.json()["detail"], missing.text
+        assert unknown.status_code == 404, unknown.text
+        
+        # Via MCP, o erro de validação volta como texto
+        async with create_connected_server_and_client_session(server.server) as client:
+            listed = await client.list_tools()
+            result = await client.call_tool("read_file", {"file_path": "x", "mode": "meio"})
+        assert len(listed.tools) == len(server_module.TOOLS), listed
+        assert "Argumentos inválidos" in result.content[0].text, result
+        print("Teste de registro de ferramentas concluído com sucesso.")
+    except Exception as e:
+        print(f"Teste de registro de ferramentas falhou: {e!r}")
+    finally:
+        server._search_files = original
+
+
+async def test_metrics():
+    """Testa as métricas por ferramenta e por serviço externo, /metrics e get_server_stats."""
+    print("\nTestando métricas...")
+    import api
+    from metrics import _benchmark
+    server = api.mcp_server
+    
+    async def fake_facts(country):
+        if country == "Atlântida":
+            raise RuntimeError("país lendário")
+        await server._call_upstream("restcountries", lambda: asyncio.sleep(0.01))
+        return f"{country}: ok"
+    
+    original = server._get_location_facts
+    server._get_location_facts = fake_facts
+    
+    def count(metric, key):
+        value = server.metrics.snapshot()[metric].get(key, 0)
+        return value["count"] if isinstance(value, dict) else value
+    
+    try:
+        # O servidor da API é compartilhado com outros testes: compara diferenças
+        calls_before = count("mcp_tool_duration_seconds", "get_location_facts")
+        errors_before = count("mcp_tool_errors_total", "get_location_facts|RuntimeError")
+        for country in ("Brasil", "Chile", "Atlântida"):
+            try:
+                await server.execute_tool("get_location_facts", {"country": country})
+            except RuntimeError:
+                pass
+        snapshot = server.metrics.snapshot()
+        assert count("mcp_tool_duration_seconds", "get_location_facts") == calls_before + 3, snapshot
+        assert count("mcp_tool_errors_total", "get_location_facts|RuntimeError") == errors_before + 1, snapshot
+        assert snapshot["mcp_tool_in_flight"]["get_location_facts"] == 0, snapshot
+        assert snapshot["mcp_upstream_duration_seconds"]["restcountries"]["p50"] >= 0.005, snapshot
+        
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=api.app), base_url="http://test") as client:
+            await client.get("/api/tools")
+            text = (await client.get("/metrics")).text
+        assert f'mcp_tool_duration_seconds_bucket{{tool="get_location_facts",le="+Inf"}} {calls_before + 3}' in text, text
+        assert 'mcp_cache_hit_ratio{cache="weather"}' in text, text
+        assert 'http_request_duration_seconds_count{method="GET",route="/api/tools",status="200"}' in text, text
+        
+        async with create_connected_server_and_client_session(server.server) as client:
+            result = await client.call_tool("get_server_stats", {"section": "metrics"})
+        assert "get_location_facts|RuntimeError" in json.loads(result.content[0].text)["mcp_tool_errors_total"], result
+        
+        # Falhas externas respondidas em texto pelo handler também contam, pelo tipo do erro
+        original_key = server_module.WEATHER_API_KEY
+        server_module.WEATHER_API_KEY = "teste"
+        failing = WeatherFilesServer()
+        failing.http_client = httpx.AsyncClient(transport=httpx.MockTransport(lambda request: httpx.Response(503)))
+        try:
+            result = await failing.execute_tool("get_weather", {"city": "Recife"})
+            assert "HTTP 503" in result, result
+            errors = failing.metrics.snapshot()["mcp_tool_errors_total"]
+            assert errors.get("get_weather|HTTPStatusError") == 1, errors
+        finally:
+            server_module.WEATHER_API_KEY = original_key
+            await failing.cleanup()
+        
+        # Custo de instrumentar uma chamada (gauge, relógio e histograma)
+        cost = _benchmark(20000)
+        assert cost["tool_call_us"] < 50, cost
+        print(f"Custo por chamada instrumentada: {cost['tool_call_us']:.2f} µs")
+        print("Teste de métricas concluído com sucesso.")
+    except Exception as e:
+        print(f"Teste de métricas falhou: {e!r}")
+    finally:
+        server._get_location_facts = original
+
+
+async def test_tracing():
+    """Testa os traces por chamada: resumo, árvore das lentas e perfil."""
+    print("\nTestando rastreamento de chamadas...")
+    tmp_dir = Path(tempfile.mkdtemp())
+    server = WeatherFilesServer()
+    server.tracer = Tracer(str(tmp_dir / "traces.jsonl"), slow_seconds=0.05, profile=True)
+    original_key = server_module.WEATHER_API_KEY
+    server_module.WEATHER_API_KEY = "teste"
+    
+    async def handler(request):
+        if request.url.params.get("q", "").startswith("lenta"):
+            await asyncio.sleep(0.08)
+        if request.url.params.get("q") == "falha":
+            await asyncio.sleep(0.08)
+            raise httpx.ConnectTimeout("timeout simulado", request=request)
+        return httpx.Response(200, json={"name": request.url.params["q"], "id": 1, "main": {"temp": 28}})
+    
+    server.http_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    server.tracer.instrument(server.http_client)
+    try:
+        for city in ("Rapida", "Lenta1", "Lenta2"):
+            result = await server.execute_tool("get_weather", {"city": city})
+            assert "28°C" in result, result
+        server.tracer.close()
+        
+        fast, slow, profiled = load_traces(str(tmp_dir / "traces.jsonl"))
+        assert not fast["slow"] and "upstream openweathermap" in fast["breakdown_ms"], fast
+        assert "http GET api.openweathermap.org" in fast["breakdown_ms"], fast
+        
+        # Lenta: árvore tool -> handler -> upstream -> http
+        tree = slow["spans"]
+        assert slow["slow"] and tree["name"] == "tool get_weather" and "profile" not in slow, slow
+        upstream = tree["children"][0]["children"][0]
+        assert upstream["name"] == "upstream openweathermap", tree
+        assert upstream["children"][0]["attrs"]["status"] == 200, upstream
+        
+        # A lentidão anterior liga o cProfile na próxima chamada da ferramenta
+        assert "profile" in profiled and "cumulative" in profiled["profile"], profiled.keys()
+        
+        # Fora de um trace, as chamadas externas não abrem traces novos
+        await server._call_upstream("openweathermap", lambda: asyncio.sleep(0))
+        assert server.tracer.stats()["traces"] == 3, server.tracer.stats()
+        
+        # Requisição sem resposta: o span http é encerrado com o erro, não fica aberto
+        await server.execute_tool("get_weather", {"city": "Falha"})
+        server.tracer.close()
+        failed = load_traces(str(tmp_dir / "traces.jsonl"))[-1]["spans"]
+        http = failed["children"][0]["children"][0]["children"][0]
+        assert http["name"].startswith("http GET") and "ConnectTimeout" in http["error"], http
+        assert "unfinished" not in http and http["duration_ms"] <= failed["duration_ms"], http
+        
+        # Revalidação em segundo plano: trace próprio, não filho da chamada já gravada
+        server.weather_cache.ttl, server.weather_cache.stale_ttl = 0, 60
+        await server.execute_tool("get_weather", {"city": "Rapida"})
+        await asyncio.gather(*server._background_tasks)
+        server.tracer.close()
+        call, refresh = load_traces(str(tmp_dir / "traces.jsonl"))[-2:]
+        assert call["name"] == "tool get_weather" and "upstream openweathermap" not in call["breakdown_ms"], call
+        assert refresh["name"] == "refresh weather" and "upstream openweathermap" in refresh["breakdown_ms"], refresh
+        print(f"Lenta: {slow['duration_ms']} ms, {len(profiled['profile'].splitlines())} linhas de perfil")
+        print("Teste de rastreamento concluído com sucesso.")
+    except Exception as e:
+        print(f"Teste de rastreamento falhou: {e!r}")
+    finally:
+        server_module.WEATHER_API_KEY = original_key
+        await server.cleanup()
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+async def test_bench_standins():
+    """Testa os stand-ins do benchmark contra o servidor e os SDKs (sem rede)."""
+    print("\nTestando stand-ins do benchmark...")
+    from anthropic import AsyncAnthropic
+    from openai import AsyncOpenAI
+
+    from bench.loadgen import ApiDriver, parse_mix, run_load
+    from bench.standins import BASE_PATHS, Profile, create_app
+
+    app = create_app({"owm": Profile(latency=1), "openai": Profile(errors=1.0)})
+    transport = httpx.ASGITransport(app=app)
+    base = "http://standins"
+    tmp_dir = Path(tempfile.mkdtemp())
+    originals = (server_module.WEATHER_API_KEY, server_module.WEATHER_API_BASE,
+                 server_module.RESTCOUNTRIES_API_BASE, server_module.COUNTRY_SNAPSHOT_PATH)
+    server_module.WEATHER_API_KEY = "bench"
+    server_module.WEATHER_API_BASE = base + BASE_PATHS["owm"]
+    server_module.RESTCOUNTRIES_API_BASE = base + BASE_PATHS["restcountries"]
+    server_module.COUNTRY_SNAPSHOT_PATH = str(tmp_dir / "countries.json")
+    server = WeatherFilesServer()
+    server.ai_cache = None
+    server.http_client = httpx.AsyncClient(transport=transport)
+    sdk_http = httpx.AsyncClient(transport=transport)
+    try:
+        import httpx2 as anthropic_httpx  # versões recentes do SDK do Anthropic usam o httpx2
+    except ImportError:
+        anthropic_httpx = httpx
+    anthropic_http = anthropic_httpx.AsyncClient(transport=anthropic_httpx.ASGITransport(app=app))
+    server.openai_client = AsyncOpenAI(api_key="bench", base_url=base + BASE_PATHS["openai"], http_client=sdk_http, max_retries=0)
+    server.anthropic_client = AsyncAnthropic(api_key="bench", base_url=base + BASE_PATHS["anthropic"], http_client=anthropic_http)
+
+    try:
+        weather = await server.execute_tool("get_weather", {"city": "Recife"})
+        assert "Recife" in weather and "°C" in weather, weather
+        facts = await server.execute_tool("get_location_facts", {"country": "Chile"})
+        assert not facts.startswith(" "), facts
+
+        # OpenAI responde 500 (errors=1.0): a análise cai no Anthropic, com e sem streaming
+        analysis = await server.execute_tool("analyze_with_ai", {"prompt": "Vai chover?", "use_cache": False})
+        assert "Anthropic" in analysis and "Fallback" in analysis, analysis
+        events = [e async for e in server._stream_analysis("Vai chover?")]
+        assert events[-1]["type"] == "done" and "Anthropic" in events[-1]["result"], events[-1]
+
+        # O mesmo gerador de carga do benchmark, direto na API HTTP
+        import api
+
+        driver = ApiDriver("http://test", 2)
+        driver.client = httpx.AsyncClient(transport=httpx.ASGITransport(app=api.app), base_url="http://test")
+        original_server = api.mcp_server
+        api.mcp_server = server
+        try:
+            result = await run_load(driver, parse_mix("get_weather=1"), concurrency=2, duration=0.2)
+        finally:
+            api.mcp_server = original_server
+            await driver.close()
+        assert result["total"]["requests"] > 0 and result["total"]["errors"] == 0, result
+        stats = (await server.http_client.get(base + "/stats")).json()
+        assert stats["openai"]["errors"] >= 2 and stats["owm"]["requests"] > 0, stats
+        print(f"Carga: {result['total']['requests']} requisições, p50 {result['total']['p50_ms']} ms")
+        print("Teste de stand-ins do benchmark concluído com sucesso.")
+    except Exception as e:
+        print(f"Teste de stand-ins do benchmark falhou: {e!r}")
+    finally:
+        (server_module.WEATHER_API_KEY, server_module.WEATHER_API_BASE,
+         server_module.RESTCOUNTRIES_API_BASE, server_module.COUNTRY_SNAPSHOT_PATH) = originals
+        server.openai_client = server.anthropic_client = None
+        await sdk_http.aclose()
+        await anthropic_http.aclose()
+        await server.cleanup()
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+async def test_startup_time():
+    """Testa a subida do servidor: SDKs de IA fora da importação e orçamento de tempo."""
+    print("\nTestando tempo de subida...")
+    from bench.startup import handshake_seconds, import_profile
+    
+    # Orçamentos folgados: só o carregamento dos dois SDKs de IA levava ~2 s
+    import_budget_ms, handshake_budget_ms = 1500, 3000
+    original_key = server_module.OPENAI_API_KEY
+    server_module.OPENAI_API_KEY = "teste"
+    server = WeatherFilesServer()
+    
+    try:
+        modules = await asyncio.to_thread(import_profile, "server")
+        assert "openai" not in modules and "anthropic" not in modules, sorted(modules)
+        import_ms = modules["server"] / 1000
+        assert import_ms < import_budget_ms, f"importação de server em {import_ms:.0f} ms"
+        handshake_ms = await handshake_seconds() * 1000
+        assert handshake_ms < handshake_budget_ms, f"initialize + list_tools em {handshake_ms:.0f} ms"
+    
+        # Os clientes só são criados no primeiro uso da IA, fora do event loop
+        assert server._ai_clients == {} and server.openai_client is None, server._ai_clients
+        client = await server._ai_client("openai")
+        assert type(client).__name__ == "AsyncOpenAI" and server.openai_client is client, server._ai_clients
+        print(f"Importação: {import_ms:.0f} ms, até list_tools: {handshake_ms:.0f} ms")
+        print("Teste de tempo de subida concluído com sucesso.")
+    except Exception as e:
+        print(f"Teste de tempo de subida falhou: {e!r}")
+    finally:
+        server_module.OPENAI_API_KEY = original_key
+        await server.cleanup()
+
+
+async def test_single_flight():
+    """Testa a deduplicação de chamadas concorrentes (sem acessar a rede)."""
+    print("\nTestando single-flight de chamadas upstream...")
+    server = WeatherFilesServer()
+    calls = []
+    
+    async def fake_fetch(key, priority=None):
+        calls.append(key)
+        await asyncio.sleep(0.05)
+        if key[0] == "atlantida":
+            raise RuntimeError("cidade inexistente")
+        return {"name": key[0].title()}
+    
+    server._fetch_weather = fake_fetch
+    
+    try:
+        results = await asyncio.gather(*[server._weather_data("Recife", "BR") for _ in range(20)])
+        assert len(calls) == 1, f"esperava 1 chamada upstream, houve {len(calls)}"
+        assert all(r is results[0] for r in results)
+        
+        # Erros chegam a todos os que aguardam
+        errors = await asyncio.gather(
+            *[server._weather_data("Atlantida") for _ in range(5)],
+            return_exceptions=True
+        )
+        assert all(isinstance(e, RuntimeError) for e in errors), errors
+        
+        # Cancelar um chamador não cancela os demais
+        waiters = [asyncio.create_task(server._weather_data("Natal", "BR")) for _ in range(3)]
+        await asyncio.sleep(0.01)
+        waiters[0].cancel()
+        done = await asyncio.gather(*waiters, return_exceptions=True)
+        assert isinstance(done[0], asyncio.CancelledError)
+        assert done[1]["name"] == "Natal" and done[2]["name"] == "Natal"
+        
+        # Todos cancelados e a execução falha depois: a exceção não fica órfã
+        unhandled = []
+        loop = asyncio.get_running_loop()
+        loop.set_exception_handler(lambda _loop, context: unhandled.append(context))
+        flight = SingleFlight()
+        
+        async def stubborn():
+            try:
+                await asyncio.sleep(0.05)
+            except asyncio.CancelledError:
+                await asyncio.sleep(0.01)
+            raise RuntimeError("falhou depois do cancelamento")
+        
+        waiter = asyncio.create_task(flight.do("k", stubborn))
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        del waiter  # o traceback do cancelamento mantém a execução viva
+        await asyncio.sleep(0.05)
+        gc.collect()
+        await asyncio.sleep(0)
+        loop.set_exception_handler(None)
+        assert not unhandled, unhandled
+        
+        print(f"Estatísticas: {server.cache_stats()['inflight']}")
+        print("Teste de single-flight concluído com sucesso.")
+    except Exception as e:
+        print(f"Teste de single-flight falhou: {e!r}")
+    finally:
+        await server.cleanup()
+
+
+async def test_weather_batch():
+    """Testa o clima em lote com falhas parciais (sem acessar a rede)."""
+    print("\nTestando get_weather_batch...")
+    server = WeatherFilesServer()
+    original_key = server_module.WEATHER_API_KEY
+    server_module.WEATHER_API_KEY = server_module.WEATHER_API_KEY or "teste"
+    groups, singles = [], []
+    
+    async def fake_group(ids):
+        groups.append(ids)
+        return [{"id": i, "name": f"Cidade {i}", "main": {"temp": 20}} for i in ids]
+    
+    async def fake_fetch(key, priority=None):
+        singles.append(key)
+        if key[0] == "atlantida":
+            raise RuntimeError("cidade inexistente")
+        return {"id": 999, "name": key[0].title(), "main": {"temp": 30}}
+    
+    server._fetch_weather_group = fake_group
+    server._fetch_weather = fake_fetch
+    
+    try:
+        cities = [str(1000 + i) for i in range(25)] + ["Recife,BR", "Atlantida"]
+        result = await server._get_weather_batch(cities, concurrency=4)
+        print(result.splitlines()[-1])
+        assert [len(g) for g in groups] == [20, 5], groups
+        assert len(singles) == 2, singles
+        assert "26 com sucesso, 1 com falha" in result, result
+        print("Teste de clima em lote concluído com sucesso.")
+    except Exception as e:
+        print(f"Teste de clima em lote falhou: {e!r}")
+    finally:
+        server_module.WEATHER_API_KEY = original_key
+        await server.cleanup()
+
+
 async def test_read_file():
     """Testa a leitura de arquivos."""
     print("\nTestando read_file...")
@@ -58,6 +641,119 @@ async def test_read_file():
         await server.cleanup()
 
 
+async def test_read_file_window():
+    """Testa a leitura por janelas, a paginação por cursor e o modo tail."""
+    print("\nTestando read_file com offset/length/cursor/tail...")
+    server = WeatherFilesServer()
+    
+    test_file = Path("test_window.log")
+    test_file.write_text("".join(f"linha {i} ação\n" for i in range(1000)), encoding="utf-8")
+    
+    try:
+        result = await server._read_file(str(test_file), offset=10, length=3, unit="lines")
+        assert "linha 10 ação\nlinha 11 ação\nlinha 12 ação" in result, result
+        
+        cursor = result.split('cursor="')[1].split('"')[0]
+        result = await server._read_file(str(test_file), cursor=cursor, length=2)
+        assert "linha 13 ação\nlinha 14 ação" in result and "linha 15" not in result, result
+        
+        # A janela não corta caracteres multibyte: o 'ç' fica para o próximo trecho
+        result = await server._read_file(str(test_file), offset=0, length=10)
+        assert "bytes 0-9" in result, result
+        
+        result = await server._read_file(str(test_file), mode="tail", length=2)
+        assert result.endswith("linha 998 ação\nlinha 999 ação"), result
+        
+        # No fim do arquivo o trecho informa as linhas realmente lidas
+        short_file = Path("test_window_short.log")
+        short_file.write_text("a\nb\nc")
+        try:
+            result = await server._read_file(str(short_file), offset=1, length=5, unit="lines")
+            assert "Trecho: linhas 1-3 (bytes 2-5)" in result, result
+            result = await server._read_file(str(short_file), offset=10, length=5, unit="lines")
+            assert "Trecho: linhas 3-3 (bytes 5-5)" in result, result
+        finally:
+            short_file.unlink()
+        print("Teste de leitura por janelas concluído com sucesso.")
+    except Exception as e:
+        print(f"Teste de leitura por janelas falhou: {e!r}")
+    finally:
+        if test_file.exists():
+            test_file.unlink()
+        await server.cleanup()
+
+
+async def test_file_ops_off_loop():
+    """Mede a latência de clima enquanto uma leitura lenta de arquivo está em andamento."""
+    print("\nTestando operações de arquivo fora do event loop...")
+    server = WeatherFilesServer()
+    
+    async def fake_fetch(key, priority=None):
+        await asyncio.sleep(0.01)
+        return {"name": key[0].title()}
+    
+    server._fetch_weather = fake_fetch
+    
+    try:
+        # Simula uma leitura travada em NFS ocupando uma thread do pool por 1 s
+        slow_read = asyncio.create_task(server._run_file_op(time.sleep, 1.0))
+        await asyncio.sleep(0.05)
+        
+        latencies = []
+        for i in range(10):
+            start = time.perf_counter()
+            await server._weather_data(f"Cidade {i}")
+            latencies.append(time.perf_counter() - start)
+        
+        assert not slow_read.done(), "a leitura lenta deveria estar em andamento"
+        worst = max(latencies) * 1000
+        print(f"Latência de clima durante leitura lenta: máx {worst:.1f} ms")
+        assert worst < 200, f"event loop bloqueado ({worst:.0f} ms)"
+        
+        # Timeout por operação libera o chamador
+        try:
+            await server._run_file_op(time.sleep, 1.0, timeout=0.1)
+            raise AssertionError("esperava timeout")
+        except asyncio.TimeoutError:
+            pass
+        
+        await slow_read
+        print("Teste de operações fora do event loop concluído com sucesso.")
+    except Exception as e:
+        print(f"Teste de operações fora do event loop falhou: {e!r}")
+    finally:
+        await server.cleanup()
+
+
+async def test_file_cache():
+    """Testa o cache de conteúdo de arquivos validado por stat()."""
+    print("\nTestando cache de read_file...")
+    server = WeatherFilesServer()
+    test_file = Path(tempfile.mkdtemp()) / "config.json"
+    test_file.write_text('{"versao": 1}')
+    
+    try:
+        for _ in range(5):
+            result = await server._read_file(str(test_file))
+        stats = server.cache_stats()["files"]
+        assert stats["hits"] == 4 and stats["misses"] == 1, stats
+        assert stats["resident_bytes"] == len('{"versao": 1}'), stats
+        
+        # Alterar o arquivo muda a assinatura (mtime/tamanho) e invalida a entrada
+        test_file.write_text('{"versao": 22}')
+        result = await server._read_file(str(test_file))
+        assert '"versao": 22' in result, result
+        
+        assert server.invalidate_file_cache(str(test_file.parent)) == 1
+        print(f"Estatísticas: {server.cache_stats()['files']}")
+        print("Teste de cache de arquivos concluído com sucesso.")
+    except Exception as e:
+        print(f"Teste de cache de arquivos falhou: {e!r}")
+    finally:
+        shutil.rmtree(test_file.parent, ignore_errors=True)
+        await server.cleanup()
+
+
 async def test_list_directory():
     """Testa a listagem de diretórios."""
     print("\nTestando list_directory...")
@@ -73,6 +769,94 @@ async def test_list_directory():
         await server.cleanup()
 
 
+async def test_list_directory_pages():
+    """Testa a paginação por cursor e a listagem recursiva com filtro."""
+    print("\nTestando list_directory com cursor/recursão...")
+    server = WeatherFilesServer()
+    root = Path(tempfile.mkdtemp())
+    (root / "sub").mkdir()
+    for i in range(15):
+        (root / f"arq{i:02d}.txt").write_text("x")
+    (root / "sub" / "modulo.py").write_text("print()")
+    
+    try:
+        first = await server._list_directory(str(root), page_size=10)
+        assert "[DIR] sub" in first and "16 no total" in first, first
+        cursor = first.split('cursor="')[1].split('"')[0]
+        second = await server._list_directory(str(root), cursor=cursor, page_size=10)
+        assert "arq14.txt" in second and "arq08.txt" not in second and "cursor=" not in second, second
+        
+        result = await server._list_directory(str(root), recursive=True, pattern="*.py")
+        assert "sub/modulo.py" in result and "arq" not in result, result
+        
+        # Cursor de um modo usado no outro: erro de parâmetro, não KeyError
+        mixed = await server._list_directory(str(root), recursive=True, cursor=cursor, page_size=10)
+        assert mixed.startswith(" Parâmetro inválido para listagem") and "recursive" in mixed, mixed
+        walked = await server._list_directory(str(root), recursive=True, page_size=5)
+        walk_cursor = walked.split('cursor="')[1].split('"')[0]
+        mixed = await server._list_directory(str(root), cursor=walk_cursor, page_size=10)
+        assert mixed.startswith(" Parâmetro inválido para listagem") and "recursive" in mixed, mixed
+        
+        # A listagem recursiva retoma do cursor: itens criados entre as páginas
+        # antes do ponto de retomada não deslocam nem repetem os seguintes
+        (root / "sub" / "outro").mkdir()
+        (root / "sub" / "outro" / "fundo.txt").write_text("x")
+        seen, cursor = [], None
+        while True:
+            page = await asyncio.to_thread(walk_page, str(root), 4, 5, cursor)
+            seen += [rel for rel, _ in page.entries]
+            if len(seen) == 4:
+                (root / "aaa.txt").write_text("x")
+            cursor = page.next_cursor
+            if not cursor:
+                break
+        expected = ["sub"] + [f"arq{i:02d}.txt" for i in range(15)] + ["sub/outro", "sub/modulo.py", "sub/outro/fundo.txt"]
+        assert seen == expected, seen
+        
+        escape = encode_cursor({"s": [["../", 0]], "a": [False, "", ""]})
+        invalid = await server._list_directory(str(root), recursive=True, cursor=escape)
+        assert invalid.startswith(" Parâmetro inválido para listagem"), invalid
+        print("Teste de paginação de diretórios concluído com sucesso.")
+    except Exception as e:
+        print(f"Teste de paginação de diretórios falhou: {e!r}")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+        await server.cleanup()
+
+
+async def test_search_files():
+    """Testa a busca de conteúdo com ranking e arquivos binários ignorados."""
+    print("\nTestando search_files...")
+    server = WeatherFilesServer()
+    root = Path(tempfile.mkdtemp())
+    (root / "pkg").mkdir()
+    (root / "pkg" / "muitos.py").write_text("clima\nclima quente\nCLIMA frio\n")
+    (root / "um.txt").write_text("sem nada\no clima mudou\n")
+    (root / "dados.bin").write_bytes(b"\0\0clima\0")
+    (root / "cidades.md").write_text("AÇÃO\nSão Paulo\nSÃO PAULO\n", encoding="utf-8")
+    
+    try:
+        result = await server._search_files(str(root), "clima")
+        assert "4 ocorrências em 2 arquivos" in result, result
+        assert result.index("muitos.py") < result.index("um.txt"), "ranking incorreto"
+        assert "dados.bin" not in result and "L2: o clima mudou" in result, result
+        
+        result = await server._search_files(str(root), r"clima\s+\w+", regex=True, case_sensitive=True, glob="*.py")
+        assert "1 ocorrências em 1 arquivos" in result, result
+        
+        # Maiúsculas e minúsculas fora do ASCII também são igualadas
+        result = await server._search_files(str(root), "são paulo", glob="*.md")
+        assert "2 ocorrências em 1 arquivos" in result and "L3: SÃO PAULO" in result, result
+        result = await server._search_files(str(root), "ação", glob="*.md")
+        assert "L1: AÇÃO" in result, result
+        print("Teste de busca concluído com sucesso.")
+    except Exception as e:
+        print(f"Teste de busca falhou: {e!r}")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+        await server.cleanup()
+
+
 async def test_location_facts():
     """Testa os fatos geográficos."""
     print("\nTestando get_location_facts...")
@@ -88,6 +872,543 @@ async def test_location_facts():
         await server.cleanup()
 
 
+async def test_ai_cache():
+    """Testa o cache persistente de respostas de IA (sem chamar provedores)."""
+    print("\nTestando cache de analyze_with_ai...")
+    db_dir = Path(tempfile.mkdtemp())
+    servers = [WeatherFilesServer(), WeatherFilesServer()]
+    calls = []
+    
+    async def fake_complete(provider, full_prompt):
+        calls.append(provider)
+        await asyncio.sleep(0.2)
+        return f"resposta para: {full_prompt}"
+    
+    for server in servers:
+        # Dois "workers" apontando para o mesmo banco
+        server.ai_cache = AIResponseCache(str(db_dir / "ai.sqlite3"), ttl=60, max_entries=10)
+        server.openai_client = object()
+        server._complete = fake_complete
+    
+    try:
+        first = await servers[0]._analyze_with_ai("Vai chover?", "Recife")
+        start = time.perf_counter()
+        second = await servers[1]._analyze_with_ai("Vai chover?", "Recife")
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        assert len(calls) == 1 and "cache" in second, (calls, second)
+        print(f"Acerto no cache em {elapsed_ms:.1f} ms")
+        
+        await servers[1]._analyze_with_ai("Vai chover?", "Recife", use_cache=False)
+        assert len(calls) == 2, calls
+        print("Teste de cache de IA concluído com sucesso.")
+    except Exception as e:
+        print(f"Teste de cache de IA falhou: {e!r}")
+    finally:
+        for server in servers:
+            server.openai_client = None
+            await server.cleanup()
+        shutil.rmtree(db_dir, ignore_errors=True)
+
+
+async def test_ai_hedging():
+    """Testa o hedging entre provedores de IA com provedores simulados."""
+    print("\nTestando hedging de analyze_with_ai...")
+    server = WeatherFilesServer()
+    original_anthropic = server.anthropic_client
+    original_min_delay = server_module.AI_HEDGE_MIN_DELAY
+    server.ai_cache = None
+    server.openai_client = object()
+    server.anthropic_client = object()
+    cancelled = []
+    delays = {"openai": 1.0, "anthropic": 0.05}
+    
+    async def fake_complete(provider, full_prompt):
+        try:
+            await asyncio.sleep(delays[provider])
+        except asyncio.CancelledError:
+            cancelled.append(provider)
+            raise
+        return f"{provider}: {full_prompt}"
+    
+    def through_breaker(fake):
+        # Simula _complete: a chamada ao provedor passa pelo disjuntor
+        return lambda provider, full_prompt: server.breakers[provider].call(lambda: fake(provider, full_prompt))
+    
+    server._complete = through_breaker(fake_complete)
+    for _ in range(30):
+        server.breakers["openai"].latency.record(0.1)
+    
+    try:
+        start = time.perf_counter()
+        result = await server._analyze_with_ai("Vai chover?")
+        elapsed = time.perf_counter() - start
+        assert "Anthropic" in result and elapsed < 0.9, (result, elapsed)
+        await asyncio.sleep(0)
+        assert cancelled == ["openai"], cancelled
+        print(f"Secundária venceu em {elapsed:.2f}s; primária cancelada")
+        
+        # Com mediana menor, a Anthropic vira a primária; sem orçamento, não há hedge
+        for _ in range(30):
+            server.breakers["anthropic"].latency.record(0.05)
+        server.hedge_budget = HedgeBudget(fraction=0.0)
+        delays["anthropic"] = 0.6
+        result = await server._analyze_with_ai("Vai chover?")
+        assert "Anthropic" in result and "Fallback" not in result, result
+        
+        # Falha da primária aciona a secundária sem esperar o limiar
+        async def failing_anthropic(provider, full_prompt):
+            if provider == "anthropic":
+                raise RuntimeError("indisponível")
+            return await fake_complete(provider, full_prompt)
+        
+        delays["openai"] = 0.05
+        server._complete = through_breaker(failing_anthropic)
+        result = await server._analyze_with_ai("Vai chover?")
+        assert "OpenAI" in result and "Fallback" in result, result
+        
+        # Vitórias seguidas do hedge não derrubam o p95 da primária: a cauda lenta
+        # (10% das chamadas) entra na janela pelo tempo da primária cancelada
+        server_module.AI_HEDGE_MIN_DELAY = 0.01
+        server.hedge_budget = HedgeBudget(fraction=1.0)
+        server.breakers["openai"].latency = LatencyTracker(window=20, min_samples=10)
+        server.breakers["anthropic"].latency = LatencyTracker()
+        for i in range(20):
+            server.breakers["openai"].latency.record(0.1 if i % 10 == 5 else 0.01)
+        initial_p95 = server.breakers["openai"].latency.percentile(0.95)
+        server._complete = through_breaker(fake_complete)
+        delays["anthropic"] = 0.01
+        for i in range(20):
+            delays["openai"] = 0.5 if i % 10 == 5 else 0.01
+            await server._analyze_with_ai(f"Vai chover? {i}")
+        p95 = server.breakers["openai"].latency.percentile(0.95)
+        assert p95 >= initial_p95, (initial_p95, p95)
+        print(f"Estatísticas: {server.ai_stats()['hedge']}; p95 da primária {initial_p95:.2f}s -> {p95:.2f}s")
+        print("Teste de hedging de IA concluído com sucesso.")
+    except Exception as e:
+        print(f"Teste de hedging de IA falhou: {e!r}")
+    finally:
+        server_module.AI_HEDGE_MIN_DELAY = original_min_delay
+        server.openai_client = None
+        server.anthropic_client = original_anthropic
+        await server.cleanup()
+
+
+async def test_hedge_budget():
+    """Testa o orçamento de hedge com requisições concorrentes intercaladas."""
+    print("\nTestando orçamento de hedge...")
+    budget = HedgeBudget(fraction=0.1, window=200)
+
+    try:
+        for _ in range(100):
+            budget.allow()
+
+        # 30 requisições em andamento, intercaladas com outras, pedem hedge depois do atraso
+        tickets = []
+        for _ in range(30):
+            tickets.append(budget.allow())
+            budget.allow()
+        spent = [budget.spend(ticket) for ticket in tickets if ticket is not None]
+
+        stats = budget.stats()
+        assert 0 < budget.hedged <= 0.1 * budget.requests, stats
+        assert spent.count(True) == budget.hedged, spent
+        # Cada hedge marca a posição da sua própria requisição
+        assert sum(budget._decisions) == budget.hedged, stats
+        assert all(budget._decisions[100 + 2 * i] for i in range(budget.hedged)), stats
+        assert False in spent, spent  # o orçamento acabou antes dos 30 hedges
+        print(f"Estatísticas: {stats}")
+        print("Teste de orçamento de hedge concluído com sucesso.")
+    except Exception as e:
+        print(f"Teste de orçamento de hedge falhou: {e!r}")
+
+
+async def test_ai_streaming():
+    """Testa o streaming de IA com fallback no meio da resposta (sem chamar provedores)."""
+    print("\nTestando analyze_with_ai em streaming...")
+    server = WeatherFilesServer()
+    server.ai_cache = None
+    server.openai_client = object()
+    server.anthropic_client = object()
+    
+    async def fake_stream(provider, full_prompt):
+        if provider == "openai":
+            yield "Parcial "
+            raise RuntimeError("conexão perdida")
+        for word in ["Sol ", "o ", "dia ", "todo."]:
+            await asyncio.sleep(0)
+            yield word
+    
+    server._stream_completion = fake_stream
+    
+    try:
+        events = [e async for e in server._stream_analysis("Vai chover?")]
+        kinds = [e["type"] for e in events]
+        assert kinds == ["start", "delta", "fallback", "start", "delta", "delta", "delta", "delta", "done"], kinds
+        assert "Sol o dia todo." in events[-1]["result"] and "Fallback" in events[-1]["result"]
+        
+        # Via MCP, cada trecho chega como notificação de progresso
+        progress = []
+        
+        async def on_progress(value, total, message):
+            progress.append(message)
+        
+        async with create_connected_server_and_client_session(server.server) as client:
+            result = await client.call_tool("analyze_with_ai", {"prompt": "Vai chover?"}, progress_callback=on_progress)
+        assert "Sol o dia todo." in result.content[0].text, result
+        assert progress[-4:] == ["Sol ", "o ", "dia ", "todo."], progress
+        print("Teste de streaming de IA concluído com sucesso.")
+    except Exception as e:
+        print(f"Teste de streaming de IA falhou: {e!r}")
+    finally:
+        server.openai_client = server.anthropic_client = None
+        await server.cleanup()
+
+
+async def test_city_index():
+    """Testa o índice local de cidades, o autocompletar e as consultas por ID."""
+    print("\nTestando índice de cidades...")
+    cities = [
+        {"id": 3448439, "name": "São Paulo", "state": "", "country": "BR", "coord": {"lon": -46.63, "lat": -23.55}},
+        {"id": 3448439, "name": "São Paulo", "state": "", "country": "BR", "coord": {"lon": -46.63, "lat": -23.55}},
+        {"id": 3390760, "name": "Recife", "state": "", "country": "BR", "coord": {"lon": -34.88, "lat": -8.05}},
+        {"id": 3449319, "name": "São Paulo de Olivença", "state": "", "country": "BR", "coord": {"lon": -68.87, "lat": -3.38}},
+        {"id": 4409896, "name": "Springfield", "state": "MO", "country": "US", "coord": {"lon": -93.3, "lat": 37.22}},
+        {"id": 4250542, "name": "Springfield", "state": "IL", "country": "US", "coord": {"lon": -89.64, "lat": 39.8}},
+    ]
+    tmp_dir = Path(tempfile.mkdtemp())
+    server = WeatherFilesServer()
+    try:
+        path = tmp_dir / "city.list.json.gz"
+        with gzip.open(path, "wt", encoding="utf-8") as f:
+            json.dump(cities, f)
+        index = CityIndex.load(path)
+        assert len(index) == len(cities)
+        
+        suggestions = index.complete("sao pau")
+        assert [c.label for c in suggestions] == ["São Paulo, BR", "São Paulo de Olivença, BR"], suggestions
+        assert index.resolve("SAO PAULO", "br").id == 3448439
+        assert index.resolve("Springfield") is None, "homônimos não devem ser resolvidos"
+        assert index.resolve("Springfield", "US") is None
+        
+        # Com o índice, a consulta à API usa o ID em vez do texto livre
+        params = []
+        
+        def handler(request):
+            params.append(dict(request.url.params))
+            return httpx.Response(200, json={"name": "São Paulo", "id": 3448439})
+        
+        server.http_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        server._city_index, server._city_index_loaded = index, True
+        await server._fetch_weather(server._weather_key("são paulo", "BR"))
+        assert params[0].get("id") == "3448439" and "q" not in params[0], params
+        
+        # Sugestão escolhida (ID numérico) com país preenchido: o país é ignorado
+        await server._weather_data("3390760", "BR")
+        assert params[1].get("id") == "3390760" and "q" not in params[1], params
+        assert server._weather_key("3390760", "BR") == server._weather_key("3390760")
+        
+        completed = await server.autocomplete_cities("rec")
+        assert completed and completed[0].id == 3390760
+        print(f"Sugestões para 'sao pau': {[c.label for c in suggestions]}")
+        print("Teste de índice de cidades concluído com sucesso.")
+    except Exception as e:
+        print(f"Teste de índice de cidades falhou: {e!r}")
+    finally:
+        await server.cleanup()
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+async def test_country_index():
+    """Testa o índice offline de países (sem acessar a rede)."""
+    print("\nTestando índice offline de países...")
+    countries = [
+        {
+            "name": {"common": "Brazil", "official": "Federative Republic of Brazil",
+                     "nativeName": {"por": {"common": "Brasil", "official": "República Federativa do Brasil"}}},
+            "cca2": "BR", "cca3": "BRA", "capital": ["Brasília"], "population": 212559409, "area": 8515767.0,
+            "translations": {"jpn": {"common": "ブラジル", "official": "ブラジル連邦共和国"}},
+            "altSpellings": ["BR", "Brasil"],
+        },
+        {
+            "name": {"common": "Japan", "official": "Japan", "nativeName": {"jpn": {"common": "日本", "official": "日本"}}},
+            "cca2": "JP", "cca3": "JPN", "capital": ["Tokyo"], "population": 125836021, "area": 377930.0,
+            "translations": {"por": {"common": "Japão", "official": "Japão"}},
+        },
+    ]
+    index = CountryIndex(countries, fetched_at=0)
+    
+    try:
+        for query, expected in [("Brasil", "BR"), ("brazil", "BR"), ("BRA", "BR"), ("jp", "JP"),
+                                ("japao", "JP"), ("日本", "JP"), ("Brazl", "BR"), ("Vrazil", "BR")]:
+            info = index.lookup(query)
+            assert info and info["cca2"] == expected, f"{query!r} -> {info}"
+        assert index.lookup("Atlântida") is None
+        assert not index.is_fresh(3600)
+        
+        start = time.perf_counter()
+        for _ in range(10000):
+            index.lookup("Brasil")
+        elapsed_us = (time.perf_counter() - start) / 10000 * 1e6
+        print(f"Consulta exata: {elapsed_us:.2f} µs")
+        
+        # O servidor lê o snapshot no pool de arquivos, não no event loop
+        tmp_dir = Path(tempfile.mkdtemp())
+        save_snapshot(countries, tmp_dir / "countries.json")
+        original_path, original_load = server_module.COUNTRY_SNAPSHOT_PATH, CountryIndex.__dict__["load"]
+        threads = []
+        
+        def tracking_load(path):
+            threads.append(threading.current_thread().name)
+            return original_load.__func__(CountryIndex, path)
+        
+        server_module.COUNTRY_SNAPSHOT_PATH = str(tmp_dir / "countries.json")
+        CountryIndex.load = tracking_load
+        server = WeatherFilesServer()
+        try:
+            loaded = await asyncio.gather(*(server._get_country_index() for _ in range(3)))
+            assert loaded[0] is loaded[2] and len(loaded[0]) == 2, loaded
+            assert len(threads) == 1 and threads[0].startswith("mcp-files"), threads
+        finally:
+            server_module.COUNTRY_SNAPSHOT_PATH = original_path
+            CountryIndex.load = original_load
+            await server.cleanup()
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        
+        # Sem snapshot (checkout novo), o servidor gera um a partir do /all e passa a usá-lo
+        tmp_dir = Path(tempfile.mkdtemp())
+        paths = []
+        
+        def handler(request):
+            paths.append(request.url.path)
+            if request.url.path.endswith("/all"):
+                fields = request.url.params["fields"].split(",")
+                return httpx.Response(200, json=[{k: c[k] for k in fields if k in c} for c in countries])
+            return httpx.Response(200, json=[countries[0]])
+        
+        server_module.COUNTRY_SNAPSHOT_PATH = str(tmp_dir / "data" / "countries.json")
+        server = WeatherFilesServer()
+        server.http_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        try:
+            assert (await server._country_info("Brasil"))["cca2"] == "BR"
+            await asyncio.gather(*list(server._background_tasks))
+            assert (await server._country_info("Japão"))["cca2"] == "JP"
+            assert (await server._country_info("Vrazil"))["cca2"] == "BR"
+            assert sum("/name/" in p for p in paths) == 1 and sum(p.endswith("/all") for p in paths) == 2, paths
+            assert len(CountryIndex.load(tmp_dir / "data" / "countries.json")) == 2
+        finally:
+            server_module.COUNTRY_SNAPSHOT_PATH = original_path
+            await server.cleanup()
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        print("Teste de índice de países concluído com sucesso.")
+    except Exception as e:
+        print(f"Teste de índice de países falhou: {e!r}")
+
+
+async def test_hot_city_prefetch():
+    """Testa a contagem de popularidade e o prefetch das cidades quentes."""
+    print("\nTestando prefetch de cidades populares...")
+    server = WeatherFilesServer()
+    fetched, grouped = [], []
+    ids = {"recife": 3390760, "natal": 3394023}
+    
+    async def fake_fetch(key, priority=None):
+        fetched.append(key[0])
+        return {"name": key[0].title(), "id": ids[key[0]]}
+    
+    async def fake_group(group_ids, priority=None):
+        grouped.append((group_ids, priority))
+        return [{"name": "Recife", "id": i} for i in group_ids]
+    
+    server._fetch_weather = fake_fetch
+    server._fetch_weather_group = fake_group
+    try:
+        for _ in range(5):
+            await server._weather_data("Recife")
+        await server._weather_data("Natal")
+        assert server.hot_cities.top(1)[0][0] == server._weather_key("Recife")
+        
+        # Entradas longe de expirar não são revalidadas
+        assert await server._prefetch_hot_cities() == 0
+        
+        # Perto de expirar: só a cidade quente é atualizada, via /group
+        server.weather_cache.ttl = server_module.WEATHER_PREFETCH_LEAD
+        calls = await server._prefetch_hot_cities()
+        assert calls == 1 and grouped == [([3390760], PRIORITY_PREFETCH)], grouped
+        assert fetched == ["recife", "natal"], fetched
+        print(f"Estatísticas: {server.cache_stats()['hot_cities']}")
+        print("Teste de prefetch concluído com sucesso.")
+    except Exception as e:
+        print(f"Teste de prefetch falhou: {e!r}")
+    finally:
+        await server.cleanup()
+
+
+async def test_quota_scheduler():
+    """Testa o token bucket com fila de prioridade e o Retry-After."""
+    print("\nTestando agendador de cotas...")
+    try:
+        quota = QuotaScheduler("teste", rate_per_minute=1200, burst=1, max_wait=1.0)
+        await quota.acquire()
+        order = []
+        
+        async def request(label, priority):
+            await quota.acquire(priority)
+            order.append(label)
+        
+        await asyncio.gather(
+            request("prefetch", PRIORITY_PREFETCH),
+            request("lote", PRIORITY_BATCH),
+            request("interativa", PRIORITY_INTERACTIVE),
+        )
+        assert order == ["interativa", "lote", "prefetch"], order
+        
+        # Espera estimada acima do limite: descarta com erro claro
+        try:
+            await quota.acquire(max_wait=0.01)
+            raise AssertionError("deveria descartar")
+        except QuotaExceededError as e:
+            print(f"Descartada: {e}")
+        
+        # Já na fila, um lote não espera além do prazo mesmo com interativas chegando sem parar
+        quota = QuotaScheduler("teste", rate_per_minute=1200, burst=1, max_wait=0.3)
+        await quota.acquire()
+        batch = asyncio.create_task(quota.acquire(PRIORITY_BATCH))
+        stream = []
+        start = time.perf_counter()
+        while not batch.done() and time.perf_counter() - start < 2.0:
+            stream.append(asyncio.create_task(quota.acquire(PRIORITY_INTERACTIVE, max_wait=10.0)))
+            await asyncio.sleep(0.01)
+        elapsed = time.perf_counter() - start
+        for task in stream:
+            task.cancel()
+        await asyncio.gather(*stream, return_exceptions=True)
+        assert batch.done() and isinstance(batch.exception(), QuotaExceededError), batch
+        assert elapsed < 1.0 and quota.stats()["queue"] == 0, (elapsed, quota.stats())
+        print(f"Lote descartado da fila após {elapsed:.2f}s")
+        
+        # 429 com Retry-After pausa a cota e a requisição é repetida
+        original_key = server_module.WEATHER_API_KEY
+        server_module.WEATHER_API_KEY = server_module.WEATHER_API_KEY or "teste"
+        server = WeatherFilesServer()
+        responses = [httpx.Response(429, headers={"Retry-After": "0.2"})]
+        
+        def handler(request):
+            if responses:
+                return responses.pop()
+            return httpx.Response(200, json={"name": "Recife", "id": 3390760, "main": {"temp": 28}})
+        
+        server.http_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        try:
+            start = time.perf_counter()
+            result = await server._get_weather("Recife")
+            elapsed = time.perf_counter() - start
+            assert "Recife" in result and elapsed >= 0.2, (result, elapsed)
+            assert server.quotas["openweathermap"].pauses == 1
+            print(f"Retry-After respeitado: resposta em {elapsed:.2f}s")
+        finally:
+            server_module.WEATHER_API_KEY = original_key
+            await server.cleanup()
+        print("Teste de agendador de cotas concluído com sucesso.")
+    except Exception as e:
+        print(f"Teste de agendador de cotas falhou: {e!r}")
+
+
+async def test_http_client():
+    """Testa o ciclo de vida do cliente HTTP compartilhado e o pré-aquecimento."""
+    print("\nTestando cliente HTTP compartilhado...")
+    server = WeatherFilesServer()
+    hosts = []
+    
+    def handler(request):
+        hosts.append(request.url.host)
+        return httpx.Response(200)
+    
+    server._create_http_client = lambda: httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    try:
+        await server.start()
+        client = server.http_client
+        await server.start()
+        assert server.http_client is client, "start() deve reutilizar o cliente"
+        
+        warmed = await server._prewarm()
+        assert warmed == 2 and "api.openweathermap.org" in hosts, hosts
+        
+        limits = WeatherFilesServer._create_http_client()
+        pool = limits._transport._pool
+        assert pool._max_connections == server_module.HTTP_MAX_CONNECTIONS
+        await limits.aclose()
+        print(f"Hosts pré-aquecidos: {sorted(set(hosts))}")
+        print("Teste de cliente HTTP concluído com sucesso.")
+    except Exception as e:
+        print(f"Teste de cliente HTTP falhou: {e!r}")
+    finally:
+        await server.cleanup()
+        assert server.http_client is None
+
+
+async def test_circuit_breaker():
+    """Testa o disjuntor por serviço externo com um upstream simulado."""
+    print("\nTestando circuit breaker de upstreams...")
+    server = WeatherFilesServer()
+    original_key = server_module.WEATHER_API_KEY
+    server_module.WEATHER_API_KEY = server_module.WEATHER_API_KEY or "teste"
+    requests = []
+    
+    def handler(request):
+        requests.append(request.url.path)
+        if request.url.path.endswith("/name/atlantida"):
+            return httpx.Response(404, json={"message": "Not Found"})
+        return httpx.Response(503, json={"message": "indisponível"})
+    
+    server.http_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    key = server._weather_key("Recife")
+    server.weather_cache.set(key, {"name": "Recife", "id": 3390760})
+    server.weather_cache.ttl = server.weather_cache.stale_ttl = 0
+    
+    try:
+        breaker = server.breakers["openweathermap"]
+        for _ in range(breaker.min_calls):
+            try:
+                await server._fetch_weather(server._weather_key("Natal"))
+            except httpx.HTTPStatusError:
+                pass
+        assert breaker.state == CIRCUIT_OPEN, breaker.stats()
+        
+        # Circuito aberto: falha na hora, sem chamar o upstream
+        calls = len(requests)
+        start = time.perf_counter()
+        result = await server._get_weather("Natal")
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        assert "circuito aberto" in result and len(requests) == calls, result
+        print(f"Falha rápida em {elapsed_ms:.2f} ms: {result.strip()}")
+        
+        # Resposta expirada ainda serve como resposta degradada
+        data = await server._weather_data("Recife")
+        assert data["name"] == "Recife" and len(requests) == calls
+        
+        # Meio aberto: uma sondagem bem-sucedida fecha o circuito
+        breaker._opened_at -= breaker.open_seconds
+        assert breaker.state == CIRCUIT_HALF_OPEN
+        breaker.record_success(0.01)
+        assert breaker.state == CIRCUIT_CLOSED
+        
+        # 404 é erro do chamador e não abre o circuito
+        countries = server.breakers["restcountries"]
+        for _ in range(countries.min_calls * 2):
+            try:
+                await server._fetch_country("atlantida")
+            except httpx.HTTPStatusError:
+                pass
+        assert countries.state == CIRCUIT_CLOSED, countries.stats()
+        print(f"Estatísticas: {server.circuit_stats()['openweathermap']}")
+        print("Teste de circuit breaker concluído com sucesso.")
+    except Exception as e:
+        print(f"Teste de circuit breaker falhou: {e!r}")
+    finally:
+        server_module.WEATHER_API_KEY = original_key
+        await server.cleanup()
+
+
 async def main():
     """Executa todos os testes."""
     print("=" * 60)
@@ -95,8 +1416,33 @@ async def main():
     print("=" * 60)
     
     await test_location_facts()
+    await test_country_index()
+    await test_city_index()
+    await test_ai_cache()
+    await test_ai_hedging()
+    await test_hedge_budget()
+    await test_ai_streaming()
     await test_list_directory()
+    await test_list_directory_pages()
+    await test_file_ops_off_loop()
+    await test_search_files()
     await test_read_file()
+    await test_read_file_window()
+    await test_file_cache()
+    await test_weather_cache()
+    await test_single_flight()
+    await test_circuit_breaker()
+    await test_http_client()
+    await test_quota_scheduler()
+    await test_hot_city_prefetch()
+    await test_weather_batch()
+    await test_forecast()
+    await test_tool_registry()
+    await test_execute_batch()
+    await test_metrics()
+    await test_tracing()
+    await test_bench_standins()
+    await test_startup_time()
     await test_weather()  # Por último pois requer API key
     
     print("\n" + "=" * 60)
@@ -0,0 +1,185 @@
+"""
+Registro único das ferramentas do MCP Weather & Files Server.
+
+Cada ferramenta declara uma vez o nome, as descrições, o ``inputSchema`` e o
+método que a executa. O schema JSON é convertido em um modelo pydantic na
+criação do registro, de modo que a validação dos argumentos roda no código
+compilado do pydantic-core, antes de qualquer I/O, e as listas servidas ao
+MCP e ao dashboard são montadas uma única vez.
+"""
+
+from dataclasses import dataclass, field
+from typing import Annotated, Any, Iterator, Literal, Optional
+
+from mcp.types import Tool
+from pydantic import BaseModel, BeforeValidator, ConfigDict, Field, ValidationError, create_model
+
+
+class UnknownToolError(LookupError):
+    """Ferramenta não registrada."""
+
+    def __init__(self, name: str):
+        super().__init__(f"Ferramenta '{name}' não encontrada")
+        self.name = name
+
+
+class ToolArgumentError(ValueError):
+    """Argumentos que não respeitam o ``inputSchema`` da ferramenta."""
+
+    def __init__(self, name: str, errors: list[str]):
+        super().__init__(f"Argumentos inválidos para {name}: {'; '.join(errors)}")
+        self.name = name
+        self.errors = errors
+
+
+class ToolFailure(str):
+    """Mensagem de erro devolvida por um handler.
+
+    As ferramentas respondem às falhas com texto em vez de levantar; a
+    mensagem continua sendo uma ``str`` comum para o MCP e a API, e
+    ``error_type`` (o tipo da exceção) alimenta a métrica de erros.
+    """
+
+    error_type: str
+
+    def __new__(cls, message: str, error: "BaseException | str"):
+        failure = super().__new__(cls, message)
+        failure.error_type = error if isinstance(error, str) else type(error).__name__
+        return failure
+
+
+def _parse_flag(value: Any) -> Any:
+    """Aceita também 'sim'/'não' vindos dos formulários do dashboard."""
+    if isinstance(value, str):
+        lowered = value.strip().lower()
+        if lowered in ("sim", "s"):
+            return True
+        if lowered in ("não", "nao", "n"):
+            return False
+    return value
+
+
+def _split_list(value: Any) -> Any:
+    """O dashboard envia listas como texto separado por ';' ou quebra de linha."""
+    if isinstance(value, str):
+        return [item.strip() for item in value.replace("\n", ";").split(";") if item.strip()]
+    return value
+
+
+_SCALARS = {
+    "string": str,
+    "integer": int,
+    "number": float,
+    "boolean": Annotated[bool, BeforeValidator(_parse_flag)],
+    "object": dict,
+}
+
+
+def _field_type(prop: dict) -> Any:
+    """Tipo pydantic equivalente a uma propriedade do schema JSON."""
+    if "enum" in prop:
+        return Literal[tuple(prop["enum"])]
+    if prop.get("type") == "array":
+        item = _field_type(prop.get("items", {}))
+        return Annotated[
+            list[item],
+            BeforeValidator(_split_list),
+            Field(min_length=prop.get("minItems"), max_length=prop.get("maxItems")),
+        ]
+    base = _SCALARS.get(prop.get("type"), Any)
+    if "minimum" in prop or "maximum" in prop:
+        return Annotated[base, Field(ge=prop.get("minimum"), le=prop.get("maximum"))]
+    return base
+
+
+def compile_schema(name: str, schema: dict) -> type[BaseModel]:
+    """Modelo pydantic que valida os argumentos descritos por ``schema``.
+
+    Campos opcionais sem ``default`` ficam como None e não são repassados ao
+    handler, que aplica o próprio padrão.
+    """
+    required = set(schema.get("required", ()))
+    fields = {}
+    for prop_name, prop in schema.get("properties", {}).items():
+        annotation = _field_type(prop)
+        if prop_name in required:
+            fields[prop_name] = (annotation, ...)
+        else:
+            fields[prop_name] = (Optional[annotation], prop.get("default"))
+    return create_model(
+        f"{name}_arguments",
+        __config__=ConfigDict(coerce_numbers_to_str=True),
+        **fields,
+    )
+
+
+@dataclass
+class ToolSpec:
+    """Declaração de uma ferramenta.
+
+    ``handler`` e ``progress_handler`` são nomes de métodos do servidor,
+    resolvidos a cada chamada. ``progress_handler``, se houver, recebe uma
+    função ``report(message)`` antes dos argumentos e é usado quando o
+    cliente pede notificações de progresso.
+    """
+
+    name: str
+    description: str
+    input_schema: dict
+    handler: str
+    summary: str = ""  # descrição curta exibida no dashboard
+    progress_handler: Optional[str] = None
+    arguments: type[BaseModel] = field(init=False, repr=False)
+
+    def __post_init__(self):
+        self.arguments = compile_schema(self.name, self.input_schema)
+
+    def validate(self, arguments: Optional[dict]) -> dict:
+        """Argumentos validados e convertidos, prontos para o handler."""
+        try:
+            parsed = self.arguments.model_validate(arguments or {})
+        except ValidationError as e:
+            raise ToolArgumentError(self.name, [
+                f"{'.'.join(str(part) for part in error['loc']) or 'argumentos'}: {error['msg']}"
+                for error in e.errors()
+            ]) from None
+        return parsed.model_dump(exclude_none=True)
+
+    def to_mcp(self) -> Tool:
+        return Tool(name=self.name, description=self.description, inputSchema=self.input_schema)
+
+    def to_dashboard(self) -> dict:
+        return {
+            "name": self.name,
+            "description": self.summary or self.description,
+            "params": list(self.input_schema.get("properties", {})),
+            "required": list(self.input_schema.get("required", [])),
+        }
+
+
+class ToolRegistry:
+    """Ferramentas indexadas pelo nome, com as listagens já montadas."""
+
+    def __init__(self, specs: list[ToolSpec]):
+        self._specs: dict[str, ToolSpec] = {}
+        for spec in specs:
+            if spec.name in self._specs:
+                raise ValueError(f"Ferramenta duplicada: '{spec.name}'")
+            self._specs[spec.name] = spec
+        self.mcp_tools: list[Tool] = [spec.to_mcp() for spec in specs]
+        self.dashboard: list[dict] = [spec.to_dashboard() for spec in specs]
+
+    def __len__(self) -> int:
+        return len(self._specs)
+
+    def __iter__(self) -> Iterator[ToolSpec]:
+        return iter(self._specs.values())
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._specs
+
+    def get(self, name: str) -> ToolSpec:
+        try:
+            return self._specs[name]
+        except KeyError:
+            raise UnknownToolError(name) from None
@@ -0,0 +1,388 @@
+"""
+Rastreamento de requisições do MCP Weather & Files Server.
+
+Cada chamada de ferramenta abre um trace com spans aninhados (handler,
+serviços externos, tentativas de fallback, requisições HTTP e as fases da
+conexão: TCP, TLS, envio e espera pela resposta). O span atual fica em uma
+``ContextVar``, então tarefas criadas durante a chamada herdam o pai.
+
+Toda chamada grava uma linha curta em JSONL com a duração e o tempo por
+tipo de span. Só as que passam do limite de lentidão gravam a árvore
+completa e, opcionalmente, um perfil do cProfile.
+"""
+
+import json
+import logging
+import os
+import queue
+import secrets
+import threading
+import time
+from contextvars import Context, ContextVar, copy_context
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Optional
+
+import httpx
+
+if TYPE_CHECKING:
+    import cProfile
+
+logger = logging.getLogger("mcp-weather-server")
+
+_current: ContextVar[Optional["Span"]] = ContextVar("mcp_trace_span", default=None)
+
+PROFILE_LINES = 25  # funções listadas no perfil de uma chamada lenta
+
+
+class Span:
+    """Trecho cronometrado de uma chamada."""
+
+    __slots__ = ("tracer", "name", "attrs", "parent", "children", "events", "start", "end", "error", "_token")
+
+    def __init__(self, tracer: "Tracer", name: str, attrs: dict):
+        self.tracer = tracer
+        self.name = name
+        self.attrs = attrs
+        self.parent: Optional[Span] = None
+        self.children: list[Span] = []
+        self.events: list[dict] = []
+        self.start = 0.0
+        self.end: Optional[float] = None
+        self.error: Optional[str] = None
+        self._token = None
+
+    def _begin(self):
+        self.parent = _active()
+        if self.parent is not None:
+            self.parent.children.append(self)
+        self.start = time.perf_counter()
+        if self.parent is None:
+            self.tracer._root_started(self)
+
+    def finish(self, error: Optional[str] = None):
+        """Encerra um span aberto com ``Tracer.start``."""
+        if self.end is not None:
+            return
+        self.end = time.perf_counter()
+        if error:
+            self.error = error
+        if self.parent is None:
+            self.tracer._root_finished(self)
+
+    def child(self, name: str, **attrs) -> "Span":
+        """Subspan iniciado agora, sem alterar o span atual."""
+        span = Span(self.tracer, name, attrs)
+        span.parent = self
+        self.children.append(span)
+        span.start = time.perf_counter()
+        return span
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def event(self, name: str, **attrs):
+        self.events.append({"name": name, "at_ms": round((time.perf_counter() - self.start) * 1000, 3), **attrs})
+
+    def __enter__(self) -> "Span":
+        self._begin()
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            _current.reset(self._token)
+        except ValueError:
+            # Encerrado em outro contexto (ex: gerador fechado por outra tarefa)
+            _current.set(self.parent)
+        self.finish(f"{exc_type.__name__}: {exc}" if exc_type else None)
+        return False
+
+    @property
+    def duration(self) -> float:
+        return (self.end if self.end is not None else time.perf_counter()) - self.start
+
+    def to_dict(self, origin: float) -> dict:
+        """Árvore do span, com tempos em ms relativos ao início do trace."""
+        children_time = sum(child.duration for child in self.children)
+        node = {
+            "name": self.name,
+            "start_ms": round((self.start - origin) * 1000, 3),
+            "duration_ms": round(self.duration * 1000, 3),
+            # Tempo fora dos filhos: processamento local, formatação, espera no pool
+            "self_ms": round(max(0.0, self.duration - children_time) * 1000, 3),
+        }
+        if self.attrs:
+            node["attrs"] = self.attrs
+        if self.error:
+            node["error"] = self.error
+        if self.end is None:
+            node["unfinished"] = True
+        if self.events:
+            node["events"] = self.events
+        if self.children:
+            node["children"] = [child.to_dict(origin) for child in self.children]
+        return node
+
+
+def _active() -> Optional[Span]:
+    """Span atual, se ainda aberto. Tarefas criadas durante uma chamada herdam
+    a ContextVar e podem continuar depois que o trace já foi gravado."""
+    span = _current.get()
+    return span if span is not None and span.end is None else None
+
+
+def detached_context() -> Context:
+    """Cópia do contexto atual sem span, para tarefas de segundo plano
+    (revalidação, prefetch) que não devem se pendurar no trace de quem as criou."""
+    context = copy_context()
+    context.run(_current.set, None)
+    return context
+
+
+class _NoopSpan:
+    """Span usado com o rastreamento desligado."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def child(self, name: str, **attrs):
+        return self
+
+    def set(self, **attrs):
+        pass
+
+    def event(self, name: str, **attrs):
+        pass
+
+    def finish(self, error: Optional[str] = None):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Tracer:
+    """Cria spans e grava os traces em um arquivo JSONL.
+
+    Com ``profile=True``, uma chamada lenta marca o seu nome: a próxima
+    chamada com esse nome roda sob o cProfile e, se também for lenta, o
+    perfil vai junto com a árvore de spans. As demais chamadas não pagam o
+    custo do profiler.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        enabled: bool = True,
+        slow_seconds: float = 2.0,
+        profile: bool = False,
+    ):
+        self.path = Path(path)
+        self.enabled = enabled
+        self.slow_seconds = slow_seconds
+        self.profile = profile
+        self._file = None
+        self._lock = threading.Lock()
+        self._queue: Optional[queue.SimpleQueue] = None
+        self._writer: Optional[threading.Thread] = None
+        self._profile_next: set[str] = set()
+        self._profiler: Optional["cProfile.Profile"] = None
+        self._profiled_root: Optional[Span] = None
+
+        self.traces = 0
+        self.slow_traces = 0
+        self.profiles = 0
+
+    def span(self, name: str, **attrs):
+        """Context manager de um span filho do atual (ou raiz de um novo trace)."""
+        if not self.enabled:
+            return NOOP_SPAN
+        return Span(self, name, attrs)
+
+    def child(self, name: str, **attrs):
+        """Como ``span``, mas só dentro de um trace: fora dele (ex: tarefas em
+        segundo plano) não cria um trace novo."""
+        if not self.enabled or _active() is None:
+            return NOOP_SPAN
+        return Span(self, name, attrs)
+
+    def start(self, name: str, **attrs):
+        """Span filho do atual, encerrado com ``finish()``, sem virar o span atual.
+
+        Para trechos que não cabem em um bloco ``with`` (hooks do httpx,
+        geradores assíncronos). Fora de um trace não faz nada.
+        """
+        parent = _active() if self.enabled else None
+        if parent is None:
+            return NOOP_SPAN
+        return parent.child(name, **attrs)
+
+    def event(self, name: str, **attrs):
+        """Registra um evento (ex: fallback) no span atual."""
+        span = _active()
+        if span is not None:
+            span.event(name, **attrs)
+
+    def _root_started(self, span: Span):
+        if self.profile and self._profiler is None and span.name in self._profile_next:
+            import cProfile  # só com um perfil armado, fora da subida do servidor
+
+            self._profile_next.discard(span.name)
+            self._profiler = cProfile.Profile()
+            self._profiled_root = span
+            try:
+                self._profiler.enable()
+            except ValueError:
+                # Outro profiler ativo no processo
+                self._profiler = self._profiled_root = None
+
+    def _root_finished(self, span: Span):
+        profile_text = None
+        if self._profiled_root is span:
+            self._profiler.disable()
+            if span.duration >= self.slow_seconds:
+                import io
+                import pstats
+
+                out = io.StringIO()
+                pstats.Stats(self._profiler, stream=out).sort_stats("cumulative").print_stats(PROFILE_LINES)
+                profile_text = out.getvalue()
+            self._profiler = self._profiled_root = None
+
+        slow = span.duration >= self.slow_seconds
+        record: dict[str, Any] = {
+            "trace_id": secrets.token_hex(8),
+            "ts": round(time.time() - span.duration, 3),
+            "name": span.name,
+            "duration_ms": round(span.duration * 1000, 3),
+            "slow": slow,
+        }
+        if span.attrs:
+            record["attrs"] = span.attrs
+        if span.error:
+            record["error"] = span.error
+        if slow:
+            record["spans"] = span.to_dict(span.start)
+            if profile_text:
+                record["profile"] = profile_text
+                self.profiles += 1
+            elif self.profile:
+                self._profile_next.add(span.name)
+            self.slow_traces += 1
+        else:
+            record["breakdown_ms"] = self._breakdown(span)
+        self.traces += 1
+        self._write(record)
+
+    @staticmethod
+    def _breakdown(root: Span) -> dict:
+        """Tempo total por nome de span (sem o ``attrs``), abaixo da raiz."""
+        totals: dict[str, float] = {}
+        stack = list(root.children)
+        while stack:
+            span = stack.pop()
+            totals[span.name] = totals.get(span.name, 0.0) + span.duration * 1000
+            stack.extend(span.children)
+        return {name: round(ms, 3) for name, ms in totals.items()}
+
+    def _write(self, record: dict):
+        """Enfileira o registro; a gravação roda em uma thread própria, fora do event loop."""
+        with self._lock:
+            if self._writer is None:
+                self._queue = queue.SimpleQueue()
+                self._writer = threading.Thread(
+                    target=self._drain, args=(self._queue,), name="mcp-trace-writer", daemon=True
+                )
+                self._writer.start()
+            self._queue.put(record)
+
+    def _drain(self, records: queue.SimpleQueue):
+        while (record := records.get()) is not None:
+            line = json.dumps(record, ensure_ascii=False, default=str) + "\n"
+            try:
+                if self._file is None:
+                    self.path.parent.mkdir(parents=True, exist_ok=True)
+                    self._file = open(self.path, "a", encoding="utf-8", buffering=1)
+                self._file.write(line)
+            except OSError as e:
+                logger.warning(f"Falha ao gravar trace em {self.path}: {str(e)}")
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def instrument(self, client: httpx.AsyncClient):
+        """Cria um span por requisição do cliente, com as fases da conexão."""
+        if not self.enabled:
+            return
+        client.event_hooks["request"].append(self._on_request)
+        client.event_hooks["response"].append(self._on_response)
+
+    async def _on_request(self, request: httpx.Request):
+        span = self.start(f"http {request.method} {request.url.host}", path=request.url.path)
+        if span is NOOP_SPAN:
+            return
+        phases: dict[str, Span] = {}
+
+        # Eventos do httpcore: connection.connect_tcp.started, http11.send_request_headers.complete...
+        async def trace(event: str, info: dict):
+            phase, _, stage = event.rpartition(".")
+            if stage == "started":
+                phases[phase] = span.child(phase.split(".", 1)[-1])
+            elif phase in phases:
+                phases.pop(phase).finish(repr(info.get("exception")) if stage == "failed" else None)
+
+        request.extensions["trace"] = trace
+        request.extensions["mcp_span"] = span
+
+    def finish_request(self, error: BaseException):
+        """Encerra o span de uma requisição que falhou antes da resposta
+        (timeout, DNS, TLS, conexão perdida), com as fases ainda abertas."""
+        try:
+            request = error.request  # httpx.RequestError e HTTPStatusError
+        except (AttributeError, RuntimeError):
+            return
+        span = request.extensions.get("mcp_span")
+        if span is None or span.end is not None:
+            return
+        message = f"{type(error).__name__}: {error}"
+        for phase in span.children:
+            phase.finish(message)
+        span.finish(message)
+
+    async def _on_response(self, response: httpx.Response):
+        span = response.request.extensions.get("mcp_span")
+        if span is not None:
+            span.set(status=response.status_code, http_version=response.http_version)
+            span.finish()
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "path": str(self.path),
+            "slow_seconds": self.slow_seconds,
+            "profile": self.profile,
+            "traces": self.traces,
+            "slow_traces": self.slow_traces,
+            "profiles": self.profiles,
+        }
+
+    def close(self):
+        """Grava os registros pendentes e fecha o arquivo."""
+        with self._lock:
+            writer, records = self._writer, self._queue
+            self._writer = self._queue = None
+        if writer is not None:
+            records.put(None)
+            writer.join()
+
+
+def load_traces(path: str, slow_only: bool = False) -> list[dict]:
+    """Lê os traces gravados (útil para inspeção e testes)."""
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    return [r for r in records if r.get("slow")] if slow_only else records